@@ -1,112 +1,281 @@
-from flask import Flask, render_template, request, jsonify, Blueprint
-from PIL import Image
-import io
+from flask import Flask, render_template, request, jsonify, Blueprint, Response, make_response, stream_with_context
+import functools
 import os
 import numpy as np
 import cv2
 import base64
-from tensorflow.keras.models import load_model
-import tensorflow as tf
+import json
+import secrets
+import io
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from tensorflow.keras.applications.efficientnet import preprocess_input
 from flask_cors import CORS
 from voice import getNewLangAudio, get_supported_languages_map
+from voice_jobs import VoiceJobStore, VoiceJobRunner, VOICE_JOB_EXECUTOR, refresh_tts_gauges
+from batching import MicroBatcher
+from inference import (LazyEngine, prefetch_file, classify, TARGET_SIZE, LAST_CONV_LAYER, CLASS_NAMES,
+                       INFERENCE_BACKEND, MODEL_PATH, TFLITE_MODEL_PATH)
+from metrics import metrics, process_rss_bytes, process_pss_bytes, process_age_seconds
+from gradcam_store import GradcamStore
+from decoding import check_image, decode_image, DecodeError, RAW_SHAPE_HEADER
+from gradcam import GradCamRenderer
+from feedback_writer import FeedbackWriter, QueueFull
+from embedding_index import EmbeddingIndex, DEDUP_ACTION, DEDUP_MAX_DISTANCE
+from sample_store import SampleStore, SAMPLE_STORE_ENABLED
+from sample_counter import SampleCounter, TRAINING_DATA_DIR
+from prediction_cache import PredictionCache, perceptual_hash, pixel_digest, PRED_CACHE_ENABLED
 
 
 app = Flask(__name__)
 CORS(app)
 
 # =====================================================================
-# CONFIGURACIÓN GRAD-CAM
+# CONFIGURACIÓN GRAD-CAM (suavizado, umbral y bounding box en gradcam.py)
 # =====================================================================
-TARGET_SIZE = (255, 255)
-LAST_CONV_LAYER = 'top_activation'
-GAUSSIAN_KERNEL_SIZE = (3, 3)
-GAUSSIAN_SIGMA = 0
-ALPHA = 1
-BETA = 0
-THRESH_METHOD = 'otsu'
-FIXED_THRESH = 127
-MORPH_KERNEL_SIZE = (5, 5)
-MORPH_OPERATION = cv2.MORPH_CLOSE
-MARGIN = 10
-BBOX_COLOR = (0, 255, 0)
-BBOX_THICKNESS = 2
-COLORMAP = cv2.COLORMAP_JET
+# Entrega del Grad-CAM en /predict (sobrescribible con ?mode=):
+# 'base64' (JPEG dentro del JSON), 'url' (JPEG en /gradcam/<id>),
+# 'multipart' (JSON + JPEG en multipart/mixed), 'grid' (heatmap uint8 + bbox)
+# o 'bbox' (solo coordenadas, sin dibujar)
+GRADCAM_MODE = os.environ.get('GRADCAM_MODE', 'base64')
+GRADCAM_MODES = ('base64', 'url', 'multipart', 'grid', 'bbox')
 # =====================================================================
 
-# Cargar modelo
-model = load_model('model.h5')
-grad_model = tf.keras.models.Model(
-    inputs=model.input,
-    outputs=[model.get_layer(LAST_CONV_LAYER).output, model.output]
-)
+# =====================================================================
+# CONFIGURACIÓN /predict_batch
+# =====================================================================
+PREDICT_BATCH_SIZE = int(os.environ.get('PREDICT_BATCH_SIZE', 16))
+PREDICT_BATCH_MAX_IMAGES = int(os.environ.get('PREDICT_BATCH_MAX_IMAGES', 1000))
+# Suma máxima de bytes de las imágenes (sin comprimir, para las de un zip)
+PREDICT_BATCH_MAX_BYTES = int(os.environ.get('PREDICT_BATCH_MAX_BYTES', 256 * 2**20))
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', os.cpu_count() or 4))
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# =====================================================================
+
+# =====================================================================
+# CONFIGURACIÓN DE ARRANQUE
+# =====================================================================
+# 1: la app se importa una vez en el master de uWSGI (lazy-apps = false, ver
+# uwsgi-preload.ini) y cada worker carga y precalienta su propia copia del
+# modelo tras el fork; solo se comparten las librerías importadas
+PRELOAD = os.environ.get('BINIT_PRELOAD', '0') == '1'
+# =====================================================================
 
-# Lista de clases
-CLASS_NAMES = [
-    'CARDBOARD',
-    'GLASS',
-    'METAL',
-    'ORGANIC',
-    'PAPER',
-    'PEN',
-    'PET',
-    'PLASTIC_BAG',
-    'UNICEL',
-    'WRAPPER',
-    'OTHER'
-]
+# Modelo compilado y precalentado (ver inference.py); se construye en init_worker
+engine = LazyEngine()
 
 
 def make_gradcam_heatmap(img_array):
-    with tf.GradientTape() as tape:
-        conv_outputs, predictions = grad_model(img_array)
-        pred_index = tf.argmax(predictions[0])
-        class_channel = predictions[:, pred_index]
+    _, pred_index, _, heatmap = engine.run(img_array)
+    return heatmap[0], pred_index[0]
 
-    grads = tape.gradient(class_channel, conv_outputs)
-    pooled_grads = tf.reduce_mean(grads, axis=(0, 1, 2))
 
-    heatmap = tf.reduce_sum(tf.multiply(conv_outputs[0], pooled_grads), axis=-1)
-    heatmap = tf.maximum(heatmap, 0)
-    heatmap /= tf.reduce_max(heatmap)
-
-    return heatmap.numpy(), pred_index.numpy()
+# Pipeline de render compilado una sola vez a partir de la configuración de gradcam.py
+renderer = GradCamRenderer()
 
 
 def apply_gradcam(heatmap, original_img):
-    # Procesamiento del heatmap
-    heatmap = cv2.GaussianBlur(heatmap, GAUSSIAN_KERNEL_SIZE, GAUSSIAN_SIGMA)
-    heatmap = cv2.resize(heatmap, (original_img.shape[1], original_img.shape[0]))
-    heatmap_uint8 = np.uint8(255 * heatmap)
-
-    # Crear superposición
-    heatmap_color = cv2.applyColorMap(heatmap_uint8, COLORMAP)
-    heatmap_color = cv2.cvtColor(heatmap_color, cv2.COLOR_BGR2RGB)
-    superimposed_img = cv2.addWeighted(original_img, ALPHA, heatmap_color, BETA, 0)
-
-    # Thresholding y bounding box
-    if THRESH_METHOD == 'otsu':
-        _, thresh = cv2.threshold(heatmap_uint8, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    else:
-        _, thresh = cv2.threshold(heatmap_uint8, FIXED_THRESH, 255, cv2.THRESH_BINARY)
+    return renderer.render(heatmap, original_img)
+
+
+# Agrupa las peticiones concurrentes de /predict en un solo forward pass
+# (ver BATCH_MAX_SIZE y BATCH_MAX_WAIT_MS en batching.py)
+batcher = MicroBatcher(lambda batch: engine.run(batch))
+
+# Imágenes Grad-CAM de corta duración para el modo 'url'
+gradcam_store = GradcamStore()
+
+# Numeración atómica de las muestras de /save_image (ver sample_counter.py)
+sample_counter = SampleCounter()
 
-    kernel = np.ones(MORPH_KERNEL_SIZE, np.uint8)
-    thresh = cv2.morphologyEx(thresh, MORPH_OPERATION, kernel)
+# Copia normalizada y deduplicada de cada muestra para reentrenar (ver sample_store.py)
+sample_store = SampleStore() if SAMPLE_STORE_ENABLED else None
 
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-    if contours:
-        largest_contour = max(contours, key=cv2.contourArea)
-        x, y, w, h = cv2.boundingRect(largest_contour)
+# Índice de embeddings por clase para detectar muestras casi duplicadas
+# (ver DEDUP_* en embedding_index.py)
+dedup_index = EmbeddingIndex() if DEDUP_ACTION in ('flag', 'skip') else None
+if dedup_index is not None:
+    dedup_index.load_all()
 
-        x = max(0, x - MARGIN)
-        y = max(0, y - MARGIN)
-        w = min(original_img.shape[1] - x, w + 2*MARGIN)
-        h = min(original_img.shape[0] - y, h + 2*MARGIN)
 
-        cv2.rectangle(superimposed_img, (x, y), (x+w, y+h), BBOX_COLOR, BBOX_THICKNESS)
+def _feedback_saved(path, jpeg, vector):
+    """Ya en disco: copia para reentrenar e índice de duplicados (un fallo de escritura no deja rastro)."""
+    # training_data/<CLASE>/<CLASE>_N.jpg
+    class_name = os.path.basename(os.path.dirname(path))
+    if sample_store is not None:
+        sample_store.append(jpeg, class_name, source=path)
+    if dedup_index is not None and vector is not None:
+        dedup_index.add(class_name, vector, os.path.basename(path))
 
-    return superimposed_img
+# Las imágenes de feedback se escriben en segundo plano (ver feedback_writer.py)
+def _feedback_error(path, stage, error):
+    metrics.inc('binit_feedback_errors_total', stage=stage)
+    app.logger.error(f"Feedback no guardado ({stage}) {path}: {error}")
+
+
+feedback_writer = FeedbackWriter(
+    on_write=lambda seconds: metrics.observe('binit_feedback_write_seconds', seconds),
+    on_saved=_feedback_saved,
+    on_error=_feedback_error
+)
+
+# Frames repetidos o casi idénticos se responden sin pasar por el modelo
+# (ver PRED_CACHE_* en prediction_cache.py)
+prediction_cache = PredictionCache() if PRED_CACHE_ENABLED else None
+
+
+# Trabajos de /voice: el endpoint solo encola; los ejecuta un hilo de fondo
+# o un mule de uWSGI según VOICE_JOB_EXECUTOR (ver voice_jobs.py)
+voice_job_store = VoiceJobStore()
+voice_runner = VoiceJobRunner(
+    voice_job_store,
+    on_stage=lambda stage, seconds: metrics.observe(
+        'binit_stage_duration_seconds', seconds, endpoint='voice_job', stage=stage),
+    on_finish=lambda status: metrics.inc('binit_voice_jobs_total', status=status),
+)
+
+
+# Coste de arranque del worker (ver /ready). El preload solo ahorra el tiempo de
+# importación: salvo con el servidor de modelo, cada worker carga y precalienta su motor
+startup = {'mode': 'preload' if PRELOAD else 'lazy', 'model_per_worker': INFERENCE_BACKEND != 'remote'}
+if PRELOAD:
+    startup['preload_saves'] = 'import_time'
+
+
+def init_worker():
+    """Carga y precalienta el modelo en este proceso y registra tiempo y memoria de arranque."""
+    engine.load()
+    startup.update(
+        pid=os.getpid(),
+        load_seconds=engine.load_seconds,
+        ready_seconds=process_age_seconds(),
+        rss_bytes=process_rss_bytes(),
+        pss_bytes=process_pss_bytes(),
+    )
+    if startup['ready_seconds'] is not None:
+        metrics.set_gauge('binit_worker_startup_seconds', startup['ready_seconds'], mode=startup['mode'])
+    metrics.set_gauge('binit_worker_startup_rss_bytes', startup['rss_bytes'], mode=startup['mode'])
+    if VOICE_JOB_EXECUTOR == 'thread':
+        # Retoma los trabajos que quedaron en cola antes de reiniciar
+        voice_runner.ensure_started()
+    print(f"✅ Worker {os.getpid()} listo ({startup['mode']}): modelo en {engine.load_seconds:.1f} s, "
+          f"RSS {startup['rss_bytes'] / 2**20:.0f} MB")
+
+
+if PRELOAD:
+    # En el master solo se importan las librerías y se lee el modelo a la caché
+    # de páginas: TensorFlow no debe ejecutar nada antes del fork
+    if INFERENCE_BACKEND != 'remote':
+        prefetch_file(TFLITE_MODEL_PATH if INFERENCE_BACKEND == 'tflite' else MODEL_PATH)
+    try:
+        import uwsgi
+        from uwsgidecorators import postfork
+
+        @postfork
+        def _init_forked_worker():
+            # postfork también se ejecuta en los mules (p. ej. el de voz, heredado de
+            # uwsgi.ini), que no usan el modelo: solo los workers lo cargan
+            if uwsgi.mule_id() == 0:
+                init_worker()
+    except ImportError:
+        # Sin uWSGI no hay fork
+        init_worker()
+else:
+    init_worker()
+
+
+def _refresh_gauges(collector):
+    collector.set_gauge('binit_model_warm', int(engine.warm))
+    collector.set_gauge('binit_batch_queue_depth', batcher.queue_depth())
+    collector.set_gauge('binit_feedback_queue_depth', feedback_writer.queue_depth())
+    collector.set_gauge('binit_process_resident_memory_bytes', process_rss_bytes())
+    refresh_tts_gauges(collector)
+
+
+metrics.register_gauge_callback(_refresh_gauges)
+
+
+def instrumented(endpoint):
+    """Registra peticiones, errores, latencia y peticiones en curso del endpoint."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with metrics.request(endpoint) as state:
+                response = make_response(view(*args, **kwargs))
+                state['status'] = response.status_code
+                return response
+        return wrapper
+    return decorator
+
+
+class BatchTooLarge(ValueError):
+    """La petición de /predict_batch supera PREDICT_BATCH_MAX_IMAGES o PREDICT_BATCH_MAX_BYTES."""
+
+
+def batch_sources(opened):
+    """
+    Imágenes de /predict_batch como (nombre, función que devuelve los bytes):
+    archivos de un multipart (incluidos .zip) o un zip en el cuerpo. El número
+    de imágenes y su tamaño (ZipInfo.file_size en los zip) se comprueban antes
+    de leer ninguna; los bytes se leen al decodificar cada batch. Los
+    temporales se añaden a `opened` para cerrarlos al terminar la respuesta.
+    """
+    sources = []
+    total = 0
+
+    def add(name, size, read):
+        nonlocal total
+        total += size
+        if len(sources) >= PREDICT_BATCH_MAX_IMAGES:
+            raise BatchTooLarge(f'Máximo {PREDICT_BATCH_MAX_IMAGES} imágenes por petición')
+        if total > PREDICT_BATCH_MAX_BYTES:
+            raise BatchTooLarge(f'Máximo {PREDICT_BATCH_MAX_BYTES} bytes de imágenes por petición')
+        sources.append((name, read))
+
+    def add_zip(fileobj):
+        # zipfile no descomprime más de file_size aunque el archivo mienta sobre él
+        archive = zipfile.ZipFile(fileobj)
+        for info in archive.infolist():
+            if not info.is_dir() and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                add(info.filename, info.file_size, functools.partial(archive.read, info))
+
+    if request.files:
+        for _, storage in request.files.items(multi=True):
+            filename = storage.filename or ''
+            if filename.lower().endswith('.zip'):
+                # Werkzeug ya guardó la parte en un temporal: el zip se lee de ahí
+                add_zip(storage.stream)
+            else:
+                size = storage.stream.seek(0, io.SEEK_END)
+                storage.stream.seek(0)
+                add(filename, size, storage.read)
+    elif request.content_length:
+        if request.content_length > PREDICT_BATCH_MAX_BYTES:
+            raise BatchTooLarge(f'Máximo {PREDICT_BATCH_MAX_BYTES} bytes de imágenes por petición')
+        # A disco: zipfile necesita un archivo con seek y el zip no se carga en memoria
+        body = tempfile.TemporaryFile()
+        opened.append(body)
+        shutil.copyfileobj(request.stream, body, 1 << 20)
+        body.seek(0)
+        add_zip(body)
+    return sources
+
+
+def multipart_response(result, jpeg_bytes):
+    """Respuesta multipart/mixed con el resultado JSON y el JPEG del Grad-CAM."""
+    boundary = secrets.token_hex(16)
+    body = b''.join([
+        f'--{boundary}\r\nContent-Type: application/json\r\n\r\n'.encode(),
+        json.dumps(result).encode(),
+        f'\r\n--{boundary}\r\nContent-Type: image/jpeg\r\n'
+        f'Content-Disposition: inline; name="gradcam"; filename="gradcam.jpg"\r\n\r\n'.encode(),
+        jpeg_bytes,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return Response(body, content_type=f'multipart/mixed; boundary={boundary}')
 
 
 # =====================================================================
@@ -126,110 +295,305 @@ def index():
     return render_template('index.html')
 
 
+def tts_state():
+    """
+    Modelos TTS de cada proceso (workers o mule de voz) por pid, leídos de los
+    gauges binit_tts_* ya volcados: pueden ir METRICS_FLUSH_INTERVAL por detrás.
+    """
+    processes = {}
+    for (name, labels), value in metrics.gauges('binit_tts_model_').items():
+        labels = dict(labels)
+        field = name[len('binit_tts_model_'):]
+        model = processes.setdefault(labels['pid'], {}).setdefault(labels['model'], {})
+        model[field] = bool(value) if field == 'loaded' else value
+    return {'executor': VOICE_JOB_EXECUTOR, 'processes': processes}
+
+
 @binit_bp.route('/health')
 def health_check():
     """Endpoint de salud para monitoreo"""
+    try:
+        # Con INFERENCE_BACKEND=remote es una consulta al servidor de modelo
+        model = engine.stats()
+    except Exception as e:
+        model = {'error': str(e)}
     return jsonify({
         'status': 'healthy',
         'service': 'binit-ai',
+        'model': model,
+        'tts': tts_state(),
         'endpoints': {
             'main': f'{SUBPATH}/',
             'predict': f'{SUBPATH}/predict',
+            'predict_batch': f'{SUBPATH}/predict_batch',
+            'voice': f'{SUBPATH}/voice',
+            'voice_job': f'{SUBPATH}/voice/jobs/<job_id>',
             'save_image': f'{SUBPATH}/save_image',
-            'health': f'{SUBPATH}/health'
+            'health': f'{SUBPATH}/health',
+            'ready': f'{SUBPATH}/ready',
+            'metrics': f'{SUBPATH}/metrics'
         }
     })
 
+
+@binit_bp.route('/ready')
+def ready():
+    """Disponibilidad del worker: 200 con el modelo precalentado, 503 mientras arranca"""
+    warm = engine.warm
+    body = dict(startup, status='ready' if warm else 'warming', warm=warm)
+    return jsonify(body), 200 if warm else 503
+
+
+@binit_bp.route('/metrics')
+def metrics_endpoint():
+    """Métricas en formato Prometheus agregadas entre todos los workers"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @binit_bp.route('/lang', methods=['GET'])
 def listLang():
     return jsonify(get_supported_languages_map())
 
 @binit_bp.route('/voice', methods=['POST'])
+@instrumented('voice')
 def generate_voice():
+    """Encola la generación de todos los audios de un idioma; devuelve el id del trabajo"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         lang = data.get('lang', '')
         
         if not lang:
             app.logger.error('No se especificó el idioma')
             return jsonify({'error': 'No se especificó el idioma'}), 400
-        
-        # Usar la nueva función para generar todos los audios
-        from voice import generate_all_audios_for_language
-        result = generate_all_audios_for_language(lang, app.logger)
-        
-        if result['success']:
-            return jsonify({
-                'success': True,
-                'message': f'Audios generados exitosamente para {lang}',
-                'generated_files': result['generated_files'],
-                'total_generated': result['total_generated'],
-                'errors': result['errors']
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': result.get('error', 'Error desconocido'),
-                'errors': result.get('errors', [])
-            }), 500
+
+        if lang not in get_supported_languages_map():
+            return jsonify({'error': f'Idioma no soportado: {lang}'}), 400
+
+        job_id, existing = voice_job_store.submit(lang)
+        if VOICE_JOB_EXECUTOR == 'thread':
+            voice_runner.ensure_started()
+        job = voice_job_store.get(job_id)
+        return jsonify(dict(job, success=True, deduplicated=existing,
+                            status_url=f'{SUBPATH}/voice/jobs/{job_id}')), 202
             
     except Exception as e:
         app.logger.error(f"Error en /voice: {str(e)}")
         return jsonify({'error': 'Error interno del servidor'}), 500
 
+
+@binit_bp.route('/voice/jobs/<job_id>', methods=['GET'])
+def voice_job_status(job_id):
+    """Estado y progreso por archivo de un trabajo de /voice"""
+    job = voice_job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job)
+
+
+@binit_bp.route('/voice/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_voice_job(job_id):
+    """Cancela un trabajo de /voice (en curso: al terminar la frase actual)"""
+    job = voice_job_store.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(job)
+
 @binit_bp.route('/predict', methods=['POST'])
+@instrumented('predict')
 def predict():
     try:
         # Breakpoint para debugging - puedes poner aquí un punto de interrupción
         print("🔍 DEBUG: Iniciando predicción...")
+
+        mode = request.args.get('mode', GRADCAM_MODE)
+        if mode not in GRADCAM_MODES:
+            return jsonify({'error': f'Modo no válido: {mode}'}), 400
         
         # Procesar imagen
-        pil_image = Image.open(io.BytesIO(request.data)).convert('RGB')
-        pil_image = pil_image.resize(TARGET_SIZE)
-        original_img = np.array(pil_image)
-
-        # Preprocesar para modelo
-        x = preprocess_input(original_img.copy())
-        x = np.expand_dims(x, axis=0)
-
-        # Predicción
-        y = model.predict(x)[0]
-        idx = np.argmax(y)
-        confidence = float(y[idx])
-
-        # Breakpoint para debugging - aquí puedes ver la predicción
-        print(f"🔍 DEBUG: Predicción - idx: {idx}, confidence: {confidence}")
-
-        if confidence <= 0.5:
-            class_name = 'OTHER'
+        with metrics.stage('predict', 'decode'):
+            original_img = decode_image(request.data, request.content_type,
+                                        request.headers.get(RAW_SHAPE_HEADER))
+
+        # Buscar el frame en la caché por su hash perceptual (confirmado con el sha1 de los píxeles)
+        cached = None
+        if prediction_cache is not None:
+            with metrics.stage('predict', 'cache'):
+                phash = perceptual_hash(original_img)
+                digest = pixel_digest(original_img)
+                cached = prediction_cache.get(phash, digest)
+            metrics.inc('binit_prediction_cache_total', result='hit' if cached else 'miss')
+
+        if cached:
+            class_name, confidence, heatmap = cached['label'], cached['confidence'], cached['heatmap']
+            print(f"🔍 DEBUG: Predicción desde caché - {class_name}")
         else:
-            class_name = CLASS_NAMES[idx]
+            # Preprocesar para modelo
+            with metrics.stage('predict', 'preprocess'):
+                x = preprocess_input(original_img.astype(np.float32))
+
+            # Predicción y Grad-CAM en un solo pass (agrupado con otras peticiones concurrentes)
+            with metrics.stage('predict', 'inference'):
+                _, idx, confidence, heatmap = batcher.submit(x)
+            confidence = float(confidence)
 
-        # Generar Grad-CAM
-        heatmap, _ = make_gradcam_heatmap(x)
-        grad_img = apply_gradcam(heatmap, original_img)
+            # Breakpoint para debugging - aquí puedes ver la predicción
+            print(f"🔍 DEBUG: Predicción - idx: {idx}, confidence: {confidence}")
 
-        # Convertir a base64
-        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(grad_img, cv2.COLOR_RGB2BGR))
-        img_str = base64.b64encode(buffer).decode('utf-8')
+            class_name = classify(idx, confidence)
 
         result = {
             'label': class_name,
-            'confidence': round(confidence * 100, 2),
-            'gradcam': img_str
+            'confidence': round(confidence * 100, 2)
         }
-        
         print(f"🔍 DEBUG: Resultado final - {result['label']} con {result['confidence']}% confianza")
-        
+
+        if mode in ('grid', 'bbox'):
+            # El cliente dibuja la superposición: sin colormap ni JPEG en el servidor
+            with metrics.stage('predict', 'gradcam'):
+                bbox = renderer.bbox(heatmap, original_img.shape)
+            if mode == 'grid':
+                result['heatmap'] = np.uint8(255 * heatmap).tolist()
+            result['bbox'] = [int(v) for v in bbox] if bbox else None
+            if prediction_cache is not None and not cached:
+                prediction_cache.put(phash, digest, class_name, confidence, heatmap)
+            return jsonify(result)
+
+        if cached and cached['jpeg']:
+            jpeg_bytes = cached['jpeg']
+        else:
+            # Generar Grad-CAM
+            with metrics.stage('predict', 'gradcam'):
+                grad_img = apply_gradcam(heatmap, original_img)
+
+            with metrics.stage('predict', 'encode'):
+                _, buffer = cv2.imencode('.jpg', cv2.cvtColor(grad_img, cv2.COLOR_RGB2BGR))
+                jpeg_bytes = buffer.tobytes()
+
+            if cached:
+                # Entrada guardada por una petición 'grid'/'bbox': se completa con el JPEG
+                prediction_cache.set_jpeg(cached['id'], jpeg_bytes)
+            elif prediction_cache is not None:
+                prediction_cache.put(phash, digest, class_name, confidence, heatmap, jpeg_bytes)
+
+        if mode == 'url':
+            result['gradcam_url'] = f'{SUBPATH}/gradcam/{gradcam_store.put(jpeg_bytes)}'
+        elif mode == 'base64':
+            result['gradcam'] = base64.b64encode(jpeg_bytes).decode('utf-8')
+
+        if mode == 'multipart':
+            return multipart_response(result, jpeg_bytes)
         return jsonify(result)
 
+    except DecodeError as e:
+        app.logger.error(f"Error en /predict: {str(e)}")
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"⁉️ Error: {str(e)}")
         app.logger.error(f"Error en /predict: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@binit_bp.route('/predict_batch', methods=['POST'])
+@instrumented('predict_batch')
+def predict_batch():
+    """
+    Clasifica varias imágenes (multipart o zip) en batches de PREDICT_BATCH_SIZE
+    y devuelve una línea NDJSON por imagen a medida que termina cada batch.
+    """
+    gradcam = request.args.get('gradcam', 'none')
+    if gradcam not in ('none', 'base64', 'url', 'grid', 'bbox'):
+        return jsonify({'error': f'Modo de Grad-CAM no válido: {gradcam}'}), 400
+    opened = []
+    try:
+        sources = batch_sources(opened)
+    except zipfile.BadZipFile as e:
+        error = {'error': f'Zip no válido: {e}'}, 400
+    except BatchTooLarge as e:
+        error = {'error': str(e)}, 413
+    else:
+        error = None if sources else ({'error': 'No se recibieron imágenes'}, 400)
+    if error:
+        for f in opened:
+            f.close()
+        return jsonify(error[0]), error[1]
+
+    def decode(source):
+        filename, read = source
+        try:
+            return filename, decode_image(read()), None
+        except (DecodeError, zipfile.BadZipFile) as e:
+            return filename, None, str(e)
+
+    def result_line(index, filename, probs_idx, confidence, heatmap, original_img):
+        confidence = float(confidence)
+        result = {
+            'index': index,
+            'filename': filename,
+            'label': classify(probs_idx, confidence),
+            'confidence': round(confidence * 100, 2)
+        }
+        if gradcam in ('grid', 'bbox'):
+            bbox = renderer.bbox(heatmap, original_img.shape)
+            if gradcam == 'grid':
+                result['heatmap'] = np.uint8(255 * heatmap).tolist()
+            result['bbox'] = [int(v) for v in bbox] if bbox else None
+        elif gradcam != 'none':
+            grad_img = apply_gradcam(heatmap, original_img)
+            _, buffer = cv2.imencode('.jpg', cv2.cvtColor(grad_img, cv2.COLOR_RGB2BGR))
+            if gradcam == 'url':
+                result['gradcam_url'] = f'{SUBPATH}/gradcam/{gradcam_store.put(buffer.tobytes())}'
+            else:
+                result['gradcam'] = base64.b64encode(buffer).decode('utf-8')
+        return json.dumps(result) + '\n'
+
+    def run_batch(pending):
+        with metrics.stage('predict_batch', 'preprocess'):
+            x = preprocess_input(np.stack([img for _, _, img in pending]).astype(np.float32))
+        with metrics.stage('predict_batch', 'inference'):
+            _, idx, confidence, heatmap = engine.run(x)
+        with metrics.stage('predict_batch', 'gradcam'):
+            return ''.join(result_line(index, filename, int(idx[i]), confidence[i], heatmap[i], img)
+                           for i, (index, filename, img) in enumerate(pending))
+
+    def generate():
+        indexed = list(enumerate(sources))
+        chunks = [indexed[i:i + PREDICT_BATCH_SIZE] for i in range(0, len(indexed), PREDICT_BATCH_SIZE)]
+        try:
+            with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as executor:
+                # Solo se leen y decodifican los bytes del batch actual y del siguiente,
+                # que avanza en paralelo mientras se infiere el actual
+                futures = [executor.submit(decode, source) for _, source in chunks[0]]
+                for k, chunk in enumerate(chunks):
+                    with metrics.stage('predict_batch', 'decode'):
+                        decoded = [f.result() for f in futures]
+                    if k + 1 < len(chunks):
+                        futures = [executor.submit(decode, source) for _, source in chunks[k + 1]]
+
+                    pending = []
+                    for (index, _), (filename, img, error) in zip(chunk, decoded):
+                        if error:
+                            yield json.dumps({'index': index, 'filename': filename, 'error': error}) + '\n'
+                        else:
+                            pending.append((index, filename, img))
+                    if pending:
+                        yield run_batch(pending)
+        finally:
+            for f in opened:
+                f.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@binit_bp.route('/gradcam/<image_id>', methods=['GET'])
+def get_gradcam(image_id):
+    """Imagen Grad-CAM generada por /predict?mode=url (caduca tras GRADCAM_TTL)"""
+    data = gradcam_store.get(image_id)
+    if data is None:
+        return jsonify({'error': 'Imagen no encontrada o caducada'}), 404
+    return Response(data, mimetype='image/jpeg', headers={'Cache-Control': 'private, max-age=60'})
+
+
 @binit_bp.route('/save_image', methods=['POST'])
+@instrumented('save_image')
 def save_image():
     try:
         if 'image' not in request.files:
@@ -245,31 +609,52 @@ def save_image():
         if correct_class not in CLASS_NAMES:
             return jsonify({'success': False, 'error': f'Clase no válida: {correct_class}'}), 400
 
+        data = image_file.read()
+        try:
+            # Sin deduplicación basta la cabecera: la conversión a JPEG (y un archivo
+            # truncado) se resuelve en el hilo de escritura, que lo notifica con on_error.
+            # Con deduplicación se decodifica aquí una sola vez y se reutiliza el array
+            with metrics.stage('save_image', 'validate'):
+                img = decode_image(data) if dedup_index is not None else check_image(data)
+        except DecodeError:
+            return jsonify({'success': False, 'error': 'El archivo no es una imagen válida'}), 400
+
+        # Comparar con las muestras ya guardadas de la clase
+        near_duplicate = None
+        vector = None
+        if dedup_index is not None:
+            with metrics.stage('save_image', 'dedup'):
+                embedding = engine.embed(preprocess_input(img[np.newaxis].astype(np.float32)))[0]
+                vector = dedup_index.project(embedding)
+                distance, neighbour = dedup_index.nearest(correct_class, vector)
+            if distance is not None and distance <= DEDUP_MAX_DISTANCE:
+                near_duplicate = {'duplicate_of': neighbour, 'distance': round(distance, 4)}
+                metrics.inc('binit_feedback_duplicates_total', action=DEDUP_ACTION)
+                if DEDUP_ACTION == 'skip':
+                    return jsonify({'success': True, 'skipped': True, 'near_duplicate': near_duplicate})
+
         dir_name = correct_class
-        save_dir = os.path.join('training_data', dir_name)
+        save_dir = os.path.join(TRAINING_DATA_DIR, dir_name)
         os.makedirs(save_dir, exist_ok=True)
 
-        # Encontrar siguiente número incremental
-        max_num = 0
-        existing_files = os.listdir(save_dir)
-        for f in existing_files:
-            if f.startswith(f"{correct_class}_") and f.endswith('.jpg'):
-                try:
-                    num = int(f.split('_')[1].split('.')[0])
-                    if num > max_num:
-                        max_num = num
-                except:
-                    pass
-        next_num = max_num + 1
-
-        # Guardar imagen
-        filename = f"{correct_class}_{next_num}.jpg"
-        image_path = os.path.join(save_dir, filename)
-        image = Image.open(image_file)
-        print(image_file)
-        image_file
-        image.save(image_path)
-
+        # Siguiente número incremental, único entre workers
+        with metrics.stage('save_image', 'numbering'):
+            next_num = sample_counter.next_number(correct_class)
+
+        # Encolar la imagen; se escribe en segundo plano
+        with metrics.stage('save_image', 'enqueue'):
+            filename = f"{correct_class}_{next_num}.jpg"
+            image_path = os.path.join(save_dir, filename)
+            try:
+                feedback_writer.submit(image_path, data, vector)
+            except QueueFull as e:
+                metrics.inc('binit_feedback_rejected_total')
+                app.logger.warning(f"/save_image rechazada: {e}")
+                response = jsonify({'success': False, 'error': 'Servidor ocupado, reintenta en unos segundos'})
+                return response, 503, {'Retry-After': '5'}
+
+        if near_duplicate:
+            return jsonify({'success': True, 'near_duplicate': near_duplicate})
         return jsonify({'success': True})
     except Exception as e:
         app.logger.error(f"Error en /save_image: {str(e)}")
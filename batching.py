@@ -0,0 +1,124 @@
+"""
+Planificador de micro-batching para la inferencia de /predict.
+
+Las peticiones concurrentes se encolan y un hilo trabajador las agrupa en
+batches (por tamaño máximo o por tiempo máximo de espera) para ejecutar un
+solo forward pass. Cada llamador recibe únicamente su porción del resultado.
+"""
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+# =====================================================================
+# CONFIGURACIÓN MICRO-BATCHING
+# =====================================================================
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 8))
+BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', 5))
+# =====================================================================
+
+
+class _PendingRequest:
+    """Una muestra encolada a la espera de su resultado."""
+    __slots__ = ('x', 'event', 'result', 'error')
+
+    def __init__(self, x):
+        self.x = x
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _take_row(outputs, i):
+    """Extrae la fila i de la salida del batch (array, tupla/lista o dict de arrays)."""
+    if isinstance(outputs, dict):
+        return {k: v[i] for k, v in outputs.items()}
+    if isinstance(outputs, (tuple, list)):
+        return tuple(o[i] for o in outputs)
+    return outputs[i]
+
+
+class MicroBatcher:
+    """
+    Agrupa muestras individuales en batches para `run_batch`.
+
+    `run_batch` recibe un array con dimensión de batch y devuelve un array,
+    una tupla o un dict de arrays cuya primera dimensión es el batch.
+    """
+    def __init__(self, run_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, x):
+        """Encola una muestra (sin dimensión de batch) y bloquea hasta tener su resultado."""
+        if self.max_batch_size == 1:
+            return _take_row(self.run_batch(np.expand_dims(x, axis=0)), 0)
+
+        self._ensure_worker()
+        pending = _PendingRequest(x)
+        self._queue.put(pending)
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def queue_depth(self):
+        """Muestras encoladas que aún no entran en un batch."""
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        # El hilo se arranca de forma perezosa y se recrea tras un fork,
+        # ya que los hilos del proceso padre no sobreviven en el hijo.
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue()
+            self._pid = pid
+            self._thread = threading.Thread(target=self._worker, name='binit-batcher', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        """Bloquea hasta la primera muestra y completa el batch hasta llenarlo o agotar la espera."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # Primero se drena lo que ya está encolado, sin esperar
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            try:
+                outputs = self.run_batch(np.stack([p.x for p in batch]))
+                for i, pending in enumerate(batch):
+                    pending.result = _take_row(outputs, i)
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            finally:
+                for pending in batch:
+                    pending.event.set()
@@ -0,0 +1,183 @@
+"""
+Benchmark por etapas del pipeline de /predict.
+
+Pasa un directorio de JPEGs por las mismas etapas que usa el endpoint y
+reporta p50/p95/p99 y throughput de cada una. El resultado se guarda en JSON
+para comparar ejecuciones antes y después de cambiar el motor o Grad-CAM.
+
+Uso:
+    python benchmark.py training_data --limit 100 --repeat 3 --output bench.json
+    python benchmark.py training_data --compare bench_anterior.json
+    python benchmark.py training_data --decode-compare
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+from tensorflow.keras.applications.efficientnet import preprocess_input
+
+from decoding import decode_encoded, open_encoded, resize_image
+from gradcam import GradCamRenderer
+from inference import TARGET_SIZE, LazyEngine
+
+# Mismo motor y render que /predict, sin arrancar la app (batcher, almacenes, trabajos de voz)
+engine = LazyEngine()
+renderer = GradCamRenderer()
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg')
+
+
+def list_images(root, limit=None):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        paths.extend(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def summarize(samples):
+    """Percentiles en milisegundos y throughput (elementos/s) de una etapa."""
+    ms = np.array(samples) * 1000.0
+    return {
+        'count': int(ms.size),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'throughput_per_s': float(1000.0 / ms.mean()) if ms.mean() > 0 else None,
+    }
+
+
+def run_pipeline(raw, timings):
+    """Ejecuta las etapas de /predict sobre los bytes de una imagen, midiendo cada una."""
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    total_start = time.perf_counter()
+    # Decodificación + resize tal como lo hace /predict (ver FAST_DECODE en decoding.py),
+    # medidos por separado para seguir siendo comparables con ejecuciones anteriores
+    pil_image = timed('decode', open_encoded, raw)
+    original_img = timed('resize', resize_image, pil_image)
+    x = timed('preprocess', lambda: preprocess_input(original_img.astype(np.float32)))
+    # Clasificación y heatmap en un solo forward pass, como el batcher de /predict
+    _, _, _, heatmap = timed('inference', engine.run, np.expand_dims(x, axis=0))
+    grad_img = timed('apply_gradcam', renderer.render, heatmap[0], original_img)
+    _, buffer = timed('imencode', lambda: cv2.imencode('.jpg', cv2.cvtColor(grad_img, cv2.COLOR_RGB2BGR)))
+    timed('base64', lambda: base64.b64encode(buffer).decode('utf-8'))
+    timings.setdefault('total', []).append(time.perf_counter() - total_start)
+
+
+def decode_comparison(images):
+    """
+    Compara la decodificación completa (PIL decode + resize) con la reducida
+    (`Image.draft`): tiempo de decode+resize y cambio en la predicción.
+    """
+    timings = {'full': [], 'fast': []}
+    pixel_diff, prob_diff, agree = [], [], 0
+    for raw in images:
+        outputs = {}
+        for name, fast in (('full', False), ('fast', True)):
+            start = time.perf_counter()
+            img = decode_encoded(raw, TARGET_SIZE, fast=fast)
+            timings[name].append(time.perf_counter() - start)
+            probs = engine.predict(np.expand_dims(preprocess_input(img.astype(np.float32)), axis=0))[0]
+            outputs[name] = (img, probs)
+        (full_img, full_probs), (fast_img, fast_probs) = outputs['full'], outputs['fast']
+        pixel_diff.append(float(np.abs(full_img.astype(np.int16) - fast_img.astype(np.int16)).mean()))
+        prob_diff.append(float(np.abs(full_probs - fast_probs).max()))
+        agree += int(np.argmax(full_probs) == np.argmax(fast_probs))
+    return {
+        'full': summarize(timings['full']),
+        'fast': summarize(timings['fast']),
+        'top1_agreement': agree / len(images),
+        'mean_abs_pixel_diff': float(np.mean(pixel_diff)),
+        'max_prob_diff': float(np.max(prob_diff)),
+    }
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nComparación con {previous_path} (p50 ms):")
+    for stage, stats in current['stages'].items():
+        before = previous.get('stages', {}).get(stage)
+        if not before:
+            continue
+        delta = stats['p50_ms'] - before['p50_ms']
+        pct = (delta / before['p50_ms'] * 100) if before['p50_ms'] else 0.0
+        print(f"  {stage:<16} {before['p50_ms']:9.2f} -> {stats['p50_ms']:9.2f} ({pct:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark por etapas del pipeline de /predict')
+    parser.add_argument('images', help='Directorio con JPEGs (se recorre recursivamente)')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=3, help='Imágenes descartadas al inicio')
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', help='JSON de una ejecución anterior')
+    parser.add_argument('--decode-compare', action='store_true',
+                        help='Compara decodificación completa contra reducida (tiempo y predicción)')
+    args = parser.parse_args()
+
+    paths = list_images(args.images, args.limit)
+    if not paths:
+        print(f"No se encontraron JPEGs en {args.images}")
+        return 2
+
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+
+    for raw in images[:args.warmup]:
+        run_pipeline(raw, {})
+
+    timings = {}
+    for _ in range(args.repeat):
+        for raw in images:
+            run_pipeline(raw, timings)
+
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'images': len(images),
+        'repeat': args.repeat,
+        'host': {'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'engine': engine.stats(),
+        'stages': {stage: summarize(samples) for stage, samples in timings.items()},
+    }
+
+    print(f"{'etapa':<16} {'p50':>9} {'p95':>9} {'p99':>9} {'items/s':>10}")
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<16} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+              f"{stats['p99_ms']:9.2f} {stats['throughput_per_s']:10.1f}")
+
+    if args.decode_compare:
+        result['decode'] = decode_comparison(images)
+        d = result['decode']
+        print(f"\ndecode+resize p50: completo {d['full']['p50_ms']:.2f} ms | "
+              f"reducido {d['fast']['p50_ms']:.2f} ms")
+        print(f"coincidencia top-1: {d['top1_agreement'] * 100:.1f}% | "
+              f"dif. media de píxel: {d['mean_abs_pixel_diff']:.2f} | "
+              f"dif. máx. de probabilidad: {d['max_prob_diff']:.4f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        compare(result, args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Reclasificación offline de training_data/<CLASE>/ con un modelo.
+
+Recorre las imágenes guardadas por /save_image con un pipeline `tf.data`
+(lectura y decodificación en paralelo + prefetch) y aplica las mismas reglas
+que /predict: decodificación de decoding.py, `preprocess_input` y el umbral
+de confianza de inference.py. Genera en el directorio de salida:
+
+- predictions.csv: una fila por imagen (se escribe por batch, permite reanudar)
+- disagreements.csv: imágenes cuya predicción no coincide con su carpeta
+- confusion_matrix.csv y summary.json
+
+Uso:
+    python bulk_classify.py training_data --model model_nuevo.h5 --output-dir bulk_results
+    python bulk_classify.py training_data --restart
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications.efficientnet import preprocess_input
+
+from decoding import decode_encoded, DecodeError
+from inference import load_engine, classify, CLASS_NAMES, MODEL_PATH, TARGET_SIZE
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PREDICTION_FIELDS = ['path', 'folder_label', 'label', 'confidence', 'top_class', 'match']
+
+
+def list_samples(root):
+    """(ruta, etiqueta de la carpeta) de cada imagen bajo root/<CLASE>/."""
+    samples = []
+    for dirpath, _, filenames in os.walk(root):
+        folder_label = os.path.basename(dirpath).upper()
+        for f in filenames:
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(dirpath, f), folder_label))
+    samples.sort()
+    return samples
+
+
+def read_predictions(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def _load_image(path):
+    """Misma decodificación que /predict; las imágenes ilegibles se marcan con ok=False."""
+    try:
+        with open(path.decode(), 'rb') as f:
+            return decode_encoded(f.read(), TARGET_SIZE), True
+    except (OSError, DecodeError):
+        return np.zeros((TARGET_SIZE[1], TARGET_SIZE[0], 3), np.uint8), False
+
+
+def build_dataset(samples, batch_size):
+    paths = [p for p, _ in samples]
+
+    def load(path):
+        img, ok = tf.numpy_function(_load_image, [path], [tf.uint8, tf.bool])
+        img.set_shape([TARGET_SIZE[1], TARGET_SIZE[0], 3])
+        return path, preprocess_input(tf.cast(img, tf.float32)), ok
+
+    return (tf.data.Dataset.from_tensor_slices(paths)
+            .map(load, num_parallel_calls=tf.data.AUTOTUNE)
+            .batch(batch_size)
+            .prefetch(tf.data.AUTOTUNE))
+
+
+def write_reports(rows, output_dir):
+    """Discrepancias, matriz de confusión (filas: carpeta, columnas: predicción) y resumen."""
+    index = {name: i for i, name in enumerate(CLASS_NAMES)}
+    matrix = np.zeros((len(CLASS_NAMES), len(CLASS_NAMES)), np.int64)
+    disagreements = []
+    unknown_folders = {}
+    for row in rows:
+        if row['match'] != '1':
+            disagreements.append(row)
+        if row['folder_label'] in index:
+            matrix[index[row['folder_label']], index[row['label']]] += 1
+        else:
+            unknown_folders[row['folder_label']] = unknown_folders.get(row['folder_label'], 0) + 1
+
+    with open(os.path.join(output_dir, 'disagreements.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PREDICTION_FIELDS)
+        writer.writeheader()
+        writer.writerows(disagreements)
+
+    with open(os.path.join(output_dir, 'confusion_matrix.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['folder \\ predicted'] + CLASS_NAMES)
+        for name, counts in zip(CLASS_NAMES, matrix):
+            writer.writerow([name] + counts.tolist())
+
+    total = int(matrix.sum())
+    per_class = {}
+    for i, name in enumerate(CLASS_NAMES):
+        support = int(matrix[i].sum())
+        if support:
+            per_class[name] = {'support': support, 'recall': float(matrix[i, i] / support)}
+    summary = {
+        'images': len(rows),
+        'disagreements': len(disagreements),
+        'accuracy': float(np.trace(matrix) / total) if total else None,
+        'per_class': per_class,
+        'unknown_folders': unknown_folders,
+        'classes': CLASS_NAMES,
+        'confusion_matrix': matrix.tolist(),
+    }
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reclasifica training_data con un modelo')
+    parser.add_argument('data', nargs='?', default='training_data',
+                        help='Directorio con subcarpetas por clase')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--output-dir', default='bulk_results')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--restart', action='store_true',
+                        help='Ignora predicciones previas en lugar de reanudar')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    predictions_path = os.path.join(args.output_dir, 'predictions.csv')
+    if args.restart and os.path.exists(predictions_path):
+        os.remove(predictions_path)
+
+    samples = list_samples(args.data)
+    if not samples:
+        print(f"No se encontraron imágenes en {args.data}")
+        return 2
+
+    done = {row['path'] for row in read_predictions(predictions_path)}
+    pending = [s for s in samples if s[0] not in done]
+    folder_labels = dict(samples)
+    print(f"📂 {len(samples)} imágenes, {len(done)} ya clasificadas, {len(pending)} pendientes")
+
+    failed = []
+    if pending:
+        engine = load_engine('keras', model_path=args.model)
+        new_file = not os.path.exists(predictions_path)
+        start = time.perf_counter()
+        processed = 0
+        with open(predictions_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=PREDICTION_FIELDS)
+            if new_file:
+                writer.writeheader()
+            for paths, batch, ok in build_dataset(pending, args.batch_size):
+                probs = engine.predict(batch)
+                for path, p, valid in zip(paths.numpy(), probs, ok.numpy()):
+                    path = path.decode()
+                    if not valid:
+                        failed.append(path)
+                        continue
+                    idx = int(np.argmax(p))
+                    label = classify(idx, float(p[idx]))
+                    writer.writerow({
+                        'path': path,
+                        'folder_label': folder_labels[path],
+                        'label': label,
+                        'confidence': round(float(p[idx]) * 100, 2),
+                        'top_class': CLASS_NAMES[idx],
+                        'match': int(label == folder_labels[path]),
+                    })
+                # Cada batch queda en disco antes de pasar al siguiente
+                f.flush()
+                os.fsync(f.fileno())
+                processed += len(probs)
+                elapsed = time.perf_counter() - start
+                print(f"\r  {processed}/{len(pending)} ({processed / elapsed:.1f} img/s)", end='', flush=True)
+        print()
+
+    if failed:
+        print(f"⚠️ {len(failed)} imágenes no se pudieron decodificar (se reintentarán al reanudar)")
+    summary = write_reports(read_predictions(predictions_path), args.output_dir)
+    accuracy = f"{summary['accuracy'] * 100:.2f}%" if summary['accuracy'] is not None else 'n/d'
+    print(f"✅ Precisión frente a las carpetas: {accuracy} | discrepancias: {summary['disagreements']}")
+    print(f"Resultados en {args.output_dir}/")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
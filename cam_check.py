@@ -0,0 +1,93 @@
+"""
+Verifica que el modo CAM (sin gradientes) produce las mismas bounding boxes
+que Grad-CAM sobre un conjunto de imágenes de muestra.
+
+Uso:
+    python cam_check.py training_data --limit 200 --min-iou 0.5 --min-agreement 0.9
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from app import TARGET_SIZE, engine as app_engine, renderer, preprocess_input
+from inference import InferenceEngine, MODEL_PATH
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_images(root, limit=None):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for f in sorted(filenames):
+            if f.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(dirpath, f))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def bbox_iou(a, b):
+    if a is None or b is None:
+        return 1.0 if a is None and b is None else 0.0
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compara bounding boxes de CAM contra Grad-CAM')
+    parser.add_argument('images', help='Directorio con imágenes de muestra (se recorre recursivamente)')
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--min-iou', type=float, default=0.5,
+                        help='IoU mínimo para considerar que dos cajas coinciden')
+    parser.add_argument('--min-agreement', type=float, default=0.9,
+                        help='Fracción mínima de imágenes que deben coincidir')
+    args = parser.parse_args()
+
+    paths = list_images(args.images, args.limit)
+    if not paths:
+        print(f"No se encontraron imágenes en {args.images}")
+        return 2
+
+    # Con INFERENCE_BACKEND=tflite la app no carga el modelo Keras
+    keras_model = app_engine.model
+    if keras_model is None:
+        from tensorflow.keras.models import load_model
+        keras_model = load_model(MODEL_PATH)
+
+    engines = [InferenceEngine(keras_model, cam_method=method) for method in ('gradcam', 'cam')]
+    if engines[1].cam_method != 'cam':
+        print("El modelo no admite CAM sin gradientes")
+        return 2
+
+    ious = []
+    for path in paths:
+        original_img = np.array(Image.open(path).convert('RGB').resize(TARGET_SIZE))
+        x = np.expand_dims(preprocess_input(original_img.astype(np.float32)), axis=0)
+
+        boxes = []
+        for engine in engines:
+            _, _, _, heatmap = engine.run(x)
+            boxes.append(renderer.bbox(heatmap[0], original_img.shape))
+
+        iou = bbox_iou(*boxes)
+        ious.append(iou)
+        print(f"{path}: gradcam={boxes[0]} cam={boxes[1]} iou={iou:.3f}")
+
+    ious = np.array(ious)
+    agreement = float(np.mean(ious >= args.min_iou))
+    print(f"\nImágenes: {len(ious)}")
+    print(f"IoU medio: {ious.mean():.3f} | mediana: {np.median(ious):.3f}")
+    print(f"Coincidencia (IoU >= {args.min_iou}): {agreement * 100:.1f}%")
+
+    return 0 if agreement >= args.min_agreement else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Caché de latentes de condicionamiento de XTTS por voz de referencia.
+
+Con `speaker_wav`, XTTS vuelve a calcular en cada síntesis el embedding del
+hablante y los latentes de condicionamiento del GPT a partir del MP3 de
+referencia. Como las referencias son siempre los mismos archivos de
+static/audios/es/, se calculan una vez y se guardan en memoria y en disco
+(CONDITIONING_CACHE_DIR), con clave (nombre del modelo, ruta de la
+referencia, sha256 del archivo): si el archivo cambia, la clave cambia.
+
+Uso (precalcular los latentes de todas las referencias):
+    python conditioning_cache.py static/audios/es
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+# =====================================================================
+# CONFIGURACIÓN CACHÉ DE CONDICIONAMIENTO
+# =====================================================================
+CONDITIONING_CACHE_ENABLED = os.environ.get('CONDITIONING_CACHE_ENABLED', '1') == '1'
+CONDITIONING_CACHE_DIR = os.environ.get('CONDITIONING_CACHE_DIR', 'tts_latents')
+# =====================================================================
+
+
+def xtts_model(ttsInstance):
+    """Modelo Xtts subyacente de una instancia de TTS.api, o None si no es XTTS."""
+    model = getattr(getattr(ttsInstance, 'synthesizer', None), 'tts_model', None)
+    return model if hasattr(model, 'get_conditioning_latents') else None
+
+
+class ConditioningCache:
+    def __init__(self, directory=CONDITIONING_CACHE_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._latents = {}
+        # (ruta, mtime, tamaño) -> sha256, para no releer la referencia en cada frase
+        self._digests = {}
+
+    def _digest(self, path):
+        st = os.stat(path)
+        stamp = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(stamp)
+        if digest is None:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            self._digests[stamp] = digest
+        return digest
+
+    def key(self, modelName, refAudioPath):
+        ident = f"{modelName}\0{os.path.abspath(refAudioPath)}\0{self._digest(refAudioPath)}"
+        return hashlib.sha256(ident.encode()).hexdigest()[:32]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.pt')
+
+    def get(self, model, modelName, refAudioPath):
+        """
+        (gpt_cond_latent, speaker_embedding) de la referencia para `model`
+        (Xtts): de memoria, de disco o calculados y guardados. Se llama con el
+        modelo adquirido del registro, así que no hay cálculos concurrentes.
+        """
+        import torch
+
+        key = self.key(modelName, refAudioPath)
+        with self._lock:
+            cached = self._latents.get(key)
+        if cached is not None:
+            return cached
+
+        path = self._path(key)
+        try:
+            data = torch.load(path, map_location=model.device)
+            cached = (data['gpt_cond_latent'], data['speaker_embedding'])
+        except FileNotFoundError:
+            cached = None
+        except Exception as e:
+            print(f"⚠️ Latentes en caché ilegibles, se recalculan ({path}): {e}")
+            cached = None
+
+        if cached is None:
+            config = model.config
+            start = time.perf_counter()
+            cached = model.get_conditioning_latents(
+                audio_path=[refAudioPath],
+                gpt_cond_len=config.gpt_cond_len,
+                gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+                max_ref_length=config.max_ref_len,
+                sound_norm_refs=config.sound_norm_refs,
+            )
+            print(f"✅ Latentes de {os.path.basename(refAudioPath)} calculados en "
+                  f"{time.perf_counter() - start:.2f} s")
+            self._save(path, cached)
+
+        with self._lock:
+            self._latents[key] = cached
+        return cached
+
+    def _save(self, path, latents):
+        import torch
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                torch.save({'gpt_cond_latent': latents[0].cpu(), 'speaker_embedding': latents[1].cpu()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ No se pudieron guardar los latentes en {path}: {e}")
+
+    def size(self):
+        with self._lock:
+            return len(self._latents)
+
+
+def synthesize_with_latents(ttsInstance, latents, text, langCode, outputPath):
+    """Equivalente a `tts_to_file(speaker_wav=...)` usando latentes ya calculados."""
+    model = xtts_model(ttsInstance)
+    config = model.config
+    gpt_cond_latent, speaker_embedding = latents
+    out = model.inference(
+        text,
+        langCode,
+        gpt_cond_latent,
+        speaker_embedding,
+        temperature=config.temperature,
+        length_penalty=config.length_penalty,
+        repetition_penalty=config.repetition_penalty,
+        top_k=config.top_k,
+        top_p=config.top_p,
+        enable_text_splitting=True,
+    )
+    ttsInstance.synthesizer.save_wav(wav=out['wav'], path=outputPath)
+
+
+conditioning_cache = ConditioningCache()
+
+
+if __name__ == '__main__':
+    from voice import COQUI_TTS_MODEL_NAME, tts_registry
+
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'static/audios/es'
+    with tts_registry.acquire(COQUI_TTS_MODEL_NAME) as tts:
+        model = xtts_model(tts)
+        if model is None:
+            print(f"{COQUI_TTS_MODEL_NAME} no es un modelo XTTS")
+            sys.exit(2)
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(('.mp3', '.wav')):
+                conditioning_cache.get(model, COQUI_TTS_MODEL_NAME, os.path.join(directory, name))
+    print(f"{conditioning_cache.size()} referencias en {CONDITIONING_CACHE_DIR}")
@@ -0,0 +1,102 @@
+"""
+Decodificación de los frames que llegan a /predict.
+
+- JPEG/PNG: con FAST_DECODE se usa `Image.draft` para que libjpeg decodifique
+  directamente a una escala reducida (1/2, 1/4 o 1/8) cercana a TARGET_SIZE,
+  seguida de un único resize.
+- Tensor crudo: `application/octet-stream` con la cabecera `X-Image-Shape`
+  (`alto,ancho,3`) se lee sin copia con `np.frombuffer`.
+"""
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from inference import TARGET_SIZE
+
+
+# =====================================================================
+# CONFIGURACIÓN DECODIFICACIÓN
+# =====================================================================
+FAST_DECODE = os.environ.get('FAST_DECODE', '1') == '1'
+RAW_CONTENT_TYPE = 'application/octet-stream'
+RAW_SHAPE_HEADER = 'X-Image-Shape'
+# =====================================================================
+
+
+class DecodeError(ValueError):
+    """La imagen recibida no se puede decodificar."""
+
+
+def decode_raw(data, shape_header, target_size=TARGET_SIZE):
+    """Tensor RGB uint8 (alto, ancho, 3) sin copiar el buffer cuando ya tiene TARGET_SIZE."""
+    try:
+        shape = tuple(int(v) for v in shape_header.split(','))
+    except (AttributeError, ValueError):
+        raise DecodeError(f'Cabecera {RAW_SHAPE_HEADER} no válida: {shape_header!r}')
+    if len(shape) != 3 or shape[2] != 3 or min(shape) <= 0:
+        raise DecodeError(f'Forma no soportada: {shape} (se espera alto,ancho,3)')
+    if len(data) != shape[0] * shape[1] * shape[2]:
+        raise DecodeError(f'Tamaño {len(data)} no coincide con la forma {shape}')
+
+    img = np.frombuffer(data, dtype=np.uint8).reshape(shape)
+    if (shape[1], shape[0]) != tuple(target_size):
+        img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+def check_pixels(pil_image):
+    """
+    Rechaza imágenes de más de Image.MAX_IMAGE_PIXELS píxeles. PIL solo avisa
+    con DecompressionBombWarning hasta el doble de ese límite; promoverla con
+    warnings.simplefilter cambiaría el filtro de todo el proceso y no es
+    seguro entre hilos.
+    """
+    limit = Image.MAX_IMAGE_PIXELS
+    if limit and pil_image.size[0] * pil_image.size[1] > limit:
+        raise DecodeError(f'Imagen demasiado grande: {pil_image.size[0]}x{pil_image.size[1]} píxeles')
+
+
+def check_image(data):
+    """
+    Comprobación barata de una imagen codificada: solo lee la cabecera (formato
+    y dimensiones) sin decodificar los píxeles, así que no detecta un archivo
+    truncado.
+    """
+    try:
+        pil_image = Image.open(io.BytesIO(data))
+    except (OSError, SyntaxError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise DecodeError(f'El archivo no es una imagen válida: {e}')
+    check_pixels(pil_image)
+    return pil_image.format
+
+
+def open_encoded(data, target_size=TARGET_SIZE, fast=FAST_DECODE):
+    """JPEG/PNG a imagen PIL RGB (con FAST_DECODE, ya reducida cerca de target_size)."""
+    try:
+        pil_image = Image.open(io.BytesIO(data))
+        check_pixels(pil_image)
+        if fast:
+            # Solo tiene efecto en JPEG; elige la mayor reducción que no baja de target_size
+            pil_image.draft('RGB', target_size)
+        return pil_image.convert('RGB')
+    except (OSError, SyntaxError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise DecodeError(f'No se pudo decodificar la imagen: {e}')
+
+
+def resize_image(pil_image, target_size=TARGET_SIZE):
+    return np.array(pil_image.resize(target_size))
+
+
+def decode_encoded(data, target_size=TARGET_SIZE, fast=FAST_DECODE):
+    """JPEG/PNG a array RGB uint8 de TARGET_SIZE."""
+    return resize_image(open_encoded(data, target_size, fast), target_size)
+
+
+def decode_image(data, content_type=None, shape_header=None, target_size=TARGET_SIZE, fast=FAST_DECODE):
+    """Decodifica el cuerpo de una petición a un array RGB uint8 de TARGET_SIZE."""
+    if content_type and content_type.split(';')[0].strip() == RAW_CONTENT_TYPE and shape_header:
+        return decode_raw(data, shape_header, target_size)
+    return decode_encoded(data, target_size, fast)
@@ -0,0 +1,256 @@
+"""
+Índice de vecinos cercanos por clase para detectar muestras casi duplicadas.
+
+Cada muestra de /save_image se representa con su embedding (pooling global de
+LAST_CONV_LAYER) proyectado con una matriz aleatoria fija a DEDUP_DIM
+dimensiones y normalizado, de modo que la distancia es 1 - coseno. Por clase
+se guarda un archivo de registros de tamaño fijo (vector + nombre del
+archivo) al que solo se añade al final; cada worker lo mantiene en memoria y
+lee los registros que otros workers hayan añadido antes de cada búsqueda. La
+búsqueda es un producto matriz-vector sobre los vectores de la clase.
+
+El umbral DEDUP_MAX_DISTANCE por defecto no está calibrado: los embeddings
+(no negativos tras la activación) quedan cerca entre sí en distancia coseno,
+así que el valor adecuado depende del modelo y de los datos. `--calibrate`
+mide, por clase, la distancia de cada imagen a una copia ligeramente
+recortada y recomprimida (un casi duplicado) y a su vecino más cercano
+distinto, y sugiere un umbral; conviene ejecutarlo antes de activar 'flag'
+o 'skip'.
+
+Uso:
+    python embedding_index.py training_data              # reconstruye el índice
+    python embedding_index.py training_data --calibrate  # histograma y umbral sugerido
+"""
+import argparse
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+from sample_counter import TRAINING_DATA_DIR
+
+
+# =====================================================================
+# CONFIGURACIÓN DETECCIÓN DE DUPLICADOS
+# =====================================================================
+# 'off', 'flag' (guarda y avisa) o 'skip' (no guarda la muestra). Con 'flag' o
+# 'skip', /save_image ejecuta el backbone del modelo dentro de la petición
+DEDUP_ACTION = os.environ.get('DEDUP_ACTION', 'off').lower()
+# Sin calibrar: ajustarlo con `python embedding_index.py --calibrate` antes de usar 'flag' o 'skip'
+DEDUP_MAX_DISTANCE = float(os.environ.get('DEDUP_MAX_DISTANCE', 0.02))
+DEDUP_INDEX_DIR = os.environ.get('DEDUP_INDEX_DIR', os.path.join(TRAINING_DATA_DIR, '.dedup'))
+DEDUP_DIM = int(os.environ.get('DEDUP_DIM', 128))
+# =====================================================================
+
+_PROJECTION_SEED = 0
+_NAME_BYTES = 64
+
+
+def record_dtype(dim=DEDUP_DIM):
+    return np.dtype([('vector', np.float32, (dim,)), ('name', f'S{_NAME_BYTES}')])
+
+
+class EmbeddingIndex:
+    def __init__(self, directory=DEDUP_INDEX_DIR, dim=DEDUP_DIM):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = record_dtype(dim)
+        self._projection = None
+        self._classes = {}
+        self._lock = threading.Lock()
+
+    def _path(self, class_name):
+        return os.path.join(self.directory, f'{class_name}.{self.dim}.bin')
+
+    def project(self, embedding):
+        """Embedding del modelo a vector unitario de DEDUP_DIM dimensiones."""
+        embedding = np.asarray(embedding, np.float32).ravel()
+        if self._projection is None or self._projection.shape[0] != embedding.size:
+            # Semilla fija: los vectores guardados siguen siendo comparables entre procesos
+            rng = np.random.default_rng(_PROJECTION_SEED)
+            self._projection = (rng.standard_normal((embedding.size, self.dim)) /
+                                np.sqrt(self.dim)).astype(np.float32)
+        vector = embedding @ self._projection
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _load(self, class_name):
+        """Vectores y nombres de la clase, leyendo solo lo añadido desde la última vez."""
+        entry = self._classes.setdefault(class_name, {
+            'buffer': np.empty((1024, self.dim), np.float32), 'count': 0, 'names': [], 'offset': 0})
+        path = self._path(class_name)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return entry
+        # Un registro a medio escribir por otro worker se lee en la siguiente búsqueda
+        complete = size - size % self.dtype.itemsize
+        if complete > entry['offset']:
+            count = (complete - entry['offset']) // self.dtype.itemsize
+            records = np.fromfile(path, dtype=self.dtype, count=count, offset=entry['offset'])
+            needed = entry['count'] + count
+            if needed > len(entry['buffer']):
+                # Capacidad que se duplica: añadir una muestra no copia todo el índice
+                grown = np.empty((max(needed, 2 * len(entry['buffer'])), self.dim), np.float32)
+                grown[:entry['count']] = entry['buffer'][:entry['count']]
+                entry['buffer'] = grown
+            entry['buffer'][entry['count']:needed] = records['vector']
+            entry['count'] = needed
+            entry['names'].extend(n.decode() for n in records['name'])
+            entry['offset'] = complete
+        return entry
+
+    def nearest(self, class_name, vector):
+        """(distancia, nombre) de la muestra más cercana de la clase, o (None, None)."""
+        with self._lock:
+            entry = self._load(class_name)
+            if not entry['count']:
+                return None, None
+            similarities = entry['buffer'][:entry['count']] @ vector
+            best = int(np.argmax(similarities))
+            return float(1.0 - similarities[best]), entry['names'][best]
+
+    def add(self, class_name, vector, name):
+        """Añade la muestra (una sola escritura en modo append, atómica entre workers)."""
+        record = np.zeros(1, self.dtype)
+        record['vector'] = vector
+        record['name'] = name.encode()[:_NAME_BYTES]
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(class_name), 'ab') as f:
+            f.write(record.tobytes())
+
+    def load_all(self):
+        """Carga en memoria todas las clases que ya tienen índice en disco."""
+        suffix = f'.{self.dim}.bin'
+        try:
+            names = [f[:-len(suffix)] for f in os.listdir(self.directory) if f.endswith(suffix)]
+        except OSError:
+            return
+        with self._lock:
+            for class_name in names:
+                self._load(class_name)
+
+    def size(self):
+        with self._lock:
+            return {name: len(entry['names']) for name, entry in self._classes.items()}
+
+
+def class_images(root):
+    """(clase, [rutas]) de cada carpeta root/<CLASE>/, en orden."""
+    for class_name in sorted(os.listdir(root)):
+        class_dir = os.path.join(root, class_name)
+        if not os.path.isdir(class_dir) or class_name.startswith('.'):
+            continue
+        names = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+        yield class_name, [os.path.join(class_dir, name) for name in names]
+
+
+def load_images(paths):
+    """(rutas, arrays RGB de TARGET_SIZE) de las imágenes que se pueden decodificar."""
+    from decoding import decode_encoded, DecodeError
+
+    kept, images = [], []
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                images.append(decode_encoded(f.read()))
+            kept.append(path)
+        except (OSError, DecodeError):
+            pass
+    return kept, images
+
+
+def project_images(images, index, engine, batch_size=32):
+    """Vectores del índice (n, dim) de una lista de arrays RGB de TARGET_SIZE."""
+    from tensorflow.keras.applications.efficientnet import preprocess_input
+
+    vectors = [index.project(embedding)
+               for i in range(0, len(images), batch_size)
+               for embedding in engine.embed(preprocess_input(np.stack(images[i:i + batch_size]).astype(np.float32)))]
+    return np.array(vectors, np.float32).reshape(len(vectors), index.dim)
+
+
+def rebuild(root, index, engine, batch_size=32):
+    """Reconstruye el índice de todas las clases a partir de las imágenes de root/<CLASE>/."""
+    for class_name, paths in class_images(root):
+        path = index._path(class_name)
+        if os.path.exists(path):
+            os.remove(path)
+        for i in range(0, len(paths), batch_size):
+            kept, images = load_images(paths[i:i + batch_size])
+            if images:
+                for name, vector in zip(kept, project_images(images, index, engine, batch_size)):
+                    index.add(class_name, vector, os.path.basename(name))
+        print(f"{class_name}: {len(paths)}")
+
+
+def near_copy(img, crop=0.05, quality=70):
+    """Casi duplicado de la imagen: recorte de `crop` por lado, resize y JPEG de baja calidad."""
+    h, w = img.shape[:2]
+    dy, dx = int(h * crop), int(w * crop)
+    resized = cv2.resize(img[dy:h - dy, dx:w - dx], (w, h), interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return cv2.imdecode(buffer, cv2.IMREAD_UNCHANGED)
+
+
+def calibrate(root, index, engine, limit=200, batch_size=32):
+    """
+    Distancias para elegir DEDUP_MAX_DISTANCE: 'duplicates' de cada imagen a su
+    casi duplicado (`near_copy`) y 'distinct' de cada imagen a la más cercana
+    de las demás de su clase (hasta `limit` imágenes por clase).
+    """
+    duplicates, distinct = [], []
+    for class_name, paths in class_images(root):
+        _, images = load_images(paths[:limit])
+        if not images:
+            continue
+        vectors = project_images(images, index, engine, batch_size)
+        copies = project_images([near_copy(img) for img in images], index, engine, batch_size)
+        duplicates.extend(1.0 - np.sum(vectors * copies, axis=1))
+        if len(vectors) > 1:
+            similarities = vectors @ vectors.T
+            np.fill_diagonal(similarities, -np.inf)
+            distinct.extend(1.0 - similarities.max(axis=1))
+        print(f"{class_name}: {len(images)}")
+    return {'duplicates': np.array(duplicates), 'distinct': np.array(distinct)}
+
+
+def print_calibration(distances, bins=(0, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 2.0)):
+    duplicates, distinct = distances['duplicates'], distances['distinct']
+    if not duplicates.size:
+        print("No se encontraron imágenes")
+        return
+    print(f"\n{'distancia':<16} {'casi duplicados':>16} {'distintas':>10}")
+    dup_counts, _ = np.histogram(duplicates, bins)
+    distinct_counts, _ = np.histogram(distinct, bins)
+    for low, high, dup, other in zip(bins[:-1], bins[1:], dup_counts, distinct_counts):
+        print(f"[{low:.3f}, {high:.3f}) {dup:>16} {other:>10}")
+    threshold = float(np.percentile(duplicates, 95))
+    false_positives = float(np.mean(distinct <= threshold)) if distinct.size else 0.0
+    print(f"\nDEDUP_MAX_DISTANCE sugerido: {threshold:.4f} (detecta el 95% de los casi duplicados; "
+          f"marcaría el {false_positives * 100:.1f}% de las muestras distintas)")
+    print(f"Con el valor actual ({DEDUP_MAX_DISTANCE}): detecta el "
+          f"{np.mean(duplicates <= DEDUP_MAX_DISTANCE) * 100:.1f}% de los casi duplicados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Índice de casi duplicados por clase')
+    parser.add_argument('data', nargs='?', default=TRAINING_DATA_DIR)
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Histograma de distancias y DEDUP_MAX_DISTANCE sugerido (no modifica el índice)')
+    parser.add_argument('--limit', type=int, default=200, help='Imágenes por clase al calibrar')
+    args = parser.parse_args()
+
+    from inference import load_engine
+    engine = load_engine()
+    if args.calibrate:
+        print_calibration(calibrate(args.data, EmbeddingIndex(), engine, args.limit))
+    else:
+        rebuild(args.data, EmbeddingIndex(), engine)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
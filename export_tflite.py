@@ -0,0 +1,104 @@
+"""
+Exporta model.h5 a modelos TFLite float16 e int8 para el backend
+INFERENCE_BACKEND=tflite.
+
+Cada modelo tiene dos salidas (activaciones de LAST_CONV_LAYER y
+probabilidades) y va acompañado de los pesos de cabeza para CAM
+(`<modelo>_cam_head.npy`), de modo que el heatmap sigue disponible sin
+gradientes. El modelo int8 se calibra con imágenes de training_data/.
+
+Uso:
+    python export_tflite.py --model model.h5 --data training_data --samples 200
+"""
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tensorflow.keras.applications.efficientnet import preprocess_input
+from tensorflow.keras.models import load_model
+
+from inference import MODEL_PATH, TARGET_SIZE, LAST_CONV_LAYER, cam_head_weights, cam_head_path
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def calibration_images(data_dir, samples, seed=0):
+    """Rutas de imágenes de calibración repartidas entre todas las clases."""
+    paths = []
+    for dirpath, _, filenames in os.walk(data_dir):
+        paths.extend(os.path.join(dirpath, f) for f in filenames if f.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    random.Random(seed).shuffle(paths)
+    return paths[:samples]
+
+
+def representative_dataset(paths):
+    def generator():
+        for path in paths:
+            img = np.array(Image.open(path).convert('RGB').resize(TARGET_SIZE), np.float32)
+            yield [preprocess_input(img)[np.newaxis]]
+    return generator
+
+
+def convert(grad_model, mode, calibration_paths=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(grad_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        # Cuantización entera completa; la entrada y salida siguen en float32
+        converter.representative_dataset = representative_dataset(calibration_paths)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError(f'Modo no soportado: {mode}')
+    return converter.convert()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta model.h5 a TFLite float16 e int8')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--data', default='training_data', help='Imágenes para calibrar int8')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--modes', nargs='+', default=['float16', 'int8'], choices=['float16', 'int8'])
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    grad_model = tf.keras.models.Model(
+        inputs=model.input,
+        outputs=[model.get_layer(LAST_CONV_LAYER).output, model.output]
+    )
+    try:
+        head_weights = cam_head_weights(model)
+    except ValueError as e:
+        print(f"⚠️ No se exportan pesos CAM ({e}): el backend TFLite no generará heatmap")
+        head_weights = None
+
+    calibration_paths = None
+    if 'int8' in args.modes:
+        calibration_paths = calibration_images(args.data, args.samples)
+        if not calibration_paths:
+            print(f"No hay imágenes de calibración en {args.data}")
+            return 1
+        print(f"Calibrando int8 con {len(calibration_paths)} imágenes")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    base = os.path.splitext(os.path.basename(args.model))[0]
+    for mode in args.modes:
+        suffix = 'fp16' if mode == 'float16' else 'int8'
+        out_path = os.path.join(args.output_dir, f"{base}_{suffix}.tflite")
+        with open(out_path, 'wb') as f:
+            f.write(convert(grad_model, mode, calibration_paths))
+        if head_weights is not None:
+            np.save(cam_head_path(out_path), head_weights)
+        print(f"✓ {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Escritura diferida de las imágenes de feedback de /save_image.
+
+El endpoint solo comprueba la cabecera de la imagen, la encola y responde; un
+hilo de fondo la convierte a JPEG (`to_jpeg`, decodificación completa),
+escribe los archivos y agrupa los fsync de cada tanda. Los fallos posteriores
+de cada archivo se notifican con `on_error`. La cola es acotada: si está
+llena, `submit` lanza `QueueFull` para que el endpoint responda 503 en lugar
+de perder datos. Al terminar el worker (`die-on-term`, recarga por memoria) se
+vacía la cola antes de salir.
+"""
+import atexit
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+
+# =====================================================================
+# CONFIGURACIÓN ESCRITURA DE FEEDBACK
+# =====================================================================
+FEEDBACK_QUEUE_SIZE = int(os.environ.get('FEEDBACK_QUEUE_SIZE', 256))
+# Máximo de archivos por tanda de fsync
+FEEDBACK_FSYNC_BATCH = int(os.environ.get('FEEDBACK_FSYNC_BATCH', 32))
+# Segundos que espera el worker al salir para vaciar la cola
+FEEDBACK_SHUTDOWN_TIMEOUT = float(os.environ.get('FEEDBACK_SHUTDOWN_TIMEOUT', 30))
+# =====================================================================
+
+_STOP = object()
+
+
+class QueueFull(Exception):
+    """La cola de escritura está llena; el cliente debe reintentar."""
+
+
+def to_jpeg(data):
+    """
+    Bytes JPEG de la imagen: los JPEG se guardan tal cual, el resto se convierte.
+    Decodifica la imagen completa, así que lanza OSError si está dañada o truncada.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    if image.format == 'JPEG':
+        return data
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class FeedbackWriter:
+    """
+    Cola acotada de escrituras (ruta, bytes de imagen) atendida por un hilo de fondo.
+
+    `on_write(seconds)` recibe, por cada archivo, el tiempo desde que se
+    encoló hasta que quedó en disco; `on_saved(path, jpeg, meta)` se llama
+    después de cada archivo guardado, desde el mismo hilo de fondo, con el
+    `meta` de `submit`. `on_error(path, etapa, error)` recibe cada archivo
+    perdido ('encode', 'write') o cuyo rename puede no ser durable
+    ('fsync_dir'); los errores de on_write/on_saved llegan con la etapa
+    'callback' y no cuentan como fallo, porque el archivo ya está guardado.
+    """
+    def __init__(self, max_queue=FEEDBACK_QUEUE_SIZE, fsync_batch=FEEDBACK_FSYNC_BATCH,
+                 shutdown_timeout=FEEDBACK_SHUTDOWN_TIMEOUT, on_write=None, on_saved=None, on_error=None):
+        self.max_queue = max_queue
+        self.fsync_batch = max(1, int(fsync_batch))
+        self.shutdown_timeout = shutdown_timeout
+        self.on_write = on_write
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.written = 0
+        self.errors = 0
+        self.callback_errors = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def submit(self, path, data, meta=None):
+        """Encola la imagen para escribirla en `path`; lanza QueueFull si no hay sitio."""
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((path, data, meta, time.monotonic()))
+        except queue.Full:
+            raise QueueFull(f'Cola de escritura llena ({self.max_queue})')
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _ensure_worker(self):
+        # Igual que MicroBatcher: hilo perezoso que se recrea tras un fork
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            if self._pid != pid:
+                self._queue = queue.Queue(maxsize=self.max_queue)
+            self._pid = pid
+            self._thread = threading.Thread(target=self._worker, name='binit-feedback-writer', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        """Bloquea hasta el primer elemento y toma lo que ya esté encolado, hasta fsync_batch."""
+        batch = [self._queue.get()]
+        while len(batch) < self.fsync_batch and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is _STOP
+            items = [item for item in batch if item is not _STOP]
+            if items:
+                # Los fallos se tratan por archivo dentro de _write_batch y _report
+                self._report(self._write_batch(items))
+            if stop:
+                return
+
+    def _notify_error(self, path, stage, error):
+        try:
+            if self.on_error:
+                self.on_error(path, stage, error)
+                return
+        except Exception as e:
+            error = f'{error} (on_error: {e})'
+        print(f"⚠️ Feedback {path} ({stage}): {error}")
+
+    def _failed(self, path, stage, error):
+        self.errors += 1
+        self._notify_error(path, stage, error)
+
+    def _report(self, saved):
+        """Callbacks de los archivos ya guardados; un error aquí no deshace el guardado."""
+        done = time.monotonic()
+        for entry in saved:
+            try:
+                if self.on_write:
+                    self.on_write(done - entry['queued_at'])
+                if self.on_saved:
+                    self.on_saved(entry['path'], entry['data'], entry['meta'])
+            except Exception as e:
+                self.callback_errors += 1
+                self._notify_error(entry['path'], 'callback', e)
+
+    def _write_batch(self, items):
+        """
+        Escribe toda la tanda en temporales y después hace los fsync juntos (el
+        kernel agrupa el writeback), renombra y sincroniza cada carpeta una vez.
+        Un fallo solo afecta a su archivo; los temporales nunca quedan en disco.
+        Devuelve las entradas guardadas.
+        """
+        entries = [{'path': path, 'data': data, 'meta': meta, 'queued_at': queued_at,
+                    'file': None, 'tmp': None, 'ok': True}
+                   for path, data, meta, queued_at in items]
+
+        def fail(entry, error, stage='write'):
+            entry['ok'] = False
+            self._failed(entry['path'], stage, error)
+
+        for entry in entries:
+            try:
+                entry['data'] = to_jpeg(entry['data'])
+            except Exception as e:
+                fail(entry, e, 'encode')
+
+        try:
+            for entry in entries:
+                if not entry['ok']:
+                    continue
+                try:
+                    directory = os.path.dirname(entry['path']) or '.'
+                    os.makedirs(directory, exist_ok=True)
+                    fd, entry['tmp'] = tempfile.mkstemp(dir=directory, suffix='.tmp')
+                    entry['file'] = os.fdopen(fd, 'wb')
+                    entry['file'].write(entry['data'])
+                    entry['file'].flush()
+                except Exception as e:
+                    fail(entry, e)
+
+            for entry in entries:
+                if entry['ok']:
+                    try:
+                        os.fsync(entry['file'].fileno())
+                    except Exception as e:
+                        fail(entry, e)
+
+            directories = set()
+            for entry in entries:
+                if entry['file'] is not None:
+                    file, entry['file'] = entry['file'], None
+                    try:
+                        file.close()
+                    except Exception as e:
+                        if entry['ok']:
+                            fail(entry, e)
+                if entry['ok']:
+                    try:
+                        os.replace(entry['tmp'], entry['path'])
+                        entry['tmp'] = None
+                        directories.add(os.path.dirname(entry['path']) or '.')
+                    except Exception as e:
+                        fail(entry, e)
+            for directory in directories:
+                try:
+                    fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except Exception as e:
+                    # Los archivos ya están en su sitio, pero el rename puede no ser durable
+                    self._failed(directory, 'fsync_dir', e)
+        finally:
+            for entry in entries:
+                if entry['file'] is not None:
+                    try:
+                        entry['file'].close()
+                    except OSError:
+                        pass
+                if entry['tmp'] is not None:
+                    try:
+                        os.remove(entry['tmp'])
+                    except OSError:
+                        pass
+
+        saved = [entry for entry in entries if entry['ok']]
+        self.written += len(saved)
+        return saved
+
+    def close(self):
+        """Vacía la cola y detiene el hilo (se llama al salir del proceso)."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(self.shutdown_timeout)
+        if thread.is_alive():
+            print(f"⚠️ Quedan {self._queue.qsize()} imágenes de feedback sin guardar")
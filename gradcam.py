@@ -0,0 +1,137 @@
+"""
+Render del Grad-CAM: suavizado, bounding box y superposición.
+
+`GradCamRenderer` se construye una sola vez a partir de la configuración y
+deja resueltas las operaciones que realmente afectan a la salida: con
+ALPHA = 1 y BETA = 0 el colormap nunca llega a la imagen, así que no se
+calcula. El kernel morfológico y la tabla del colormap se precalculan, y los
+buffers intermedios se reutilizan entre llamadas (uno por hilo y tamaño).
+"""
+import threading
+
+import cv2
+import numpy as np
+
+
+# =====================================================================
+# CONFIGURACIÓN GRAD-CAM
+# =====================================================================
+GAUSSIAN_KERNEL_SIZE = (3, 3)
+GAUSSIAN_SIGMA = 0
+ALPHA = 1
+BETA = 0
+THRESH_METHOD = 'otsu'
+FIXED_THRESH = 127
+MORPH_KERNEL_SIZE = (5, 5)
+MORPH_OPERATION = cv2.MORPH_CLOSE
+MARGIN = 10
+BBOX_COLOR = (0, 255, 0)
+BBOX_THICKNESS = 2
+COLORMAP = cv2.COLORMAP_JET
+# =====================================================================
+
+
+class GradCamRenderer:
+    def __init__(self, gaussian_kernel_size=GAUSSIAN_KERNEL_SIZE, gaussian_sigma=GAUSSIAN_SIGMA, alpha=ALPHA,
+                 beta=BETA, thresh_method=THRESH_METHOD, fixed_thresh=FIXED_THRESH,
+                 morph_kernel_size=MORPH_KERNEL_SIZE, morph_operation=MORPH_OPERATION, margin=MARGIN,
+                 bbox_color=BBOX_COLOR, bbox_thickness=BBOX_THICKNESS, colormap=COLORMAP):
+        self.gaussian_kernel_size = gaussian_kernel_size
+        self.gaussian_sigma = gaussian_sigma
+        self.blur = tuple(gaussian_kernel_size) != (1, 1)
+        self.alpha = alpha
+        self.beta = beta
+        self.margin = margin
+        self.bbox_color = bbox_color
+        self.bbox_thickness = bbox_thickness
+
+        if thresh_method == 'otsu':
+            self.thresh_value, self.thresh_flags = 0, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+        else:
+            self.thresh_value, self.thresh_flags = fixed_thresh, cv2.THRESH_BINARY
+        self.morph_operation = morph_operation
+        self.morph_kernel = np.ones(morph_kernel_size, np.uint8)
+
+        # Superposición mínima según ALPHA/BETA
+        if beta == 0:
+            self._overlay = self._overlay_copy if alpha == 1 else self._overlay_scale
+            self.colormap_lut = None
+        else:
+            self._overlay = self._overlay_blend
+            # applyColorMap + BGR2RGB resueltos en una tabla de 256 colores RGB
+            lut = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), colormap)
+            self.colormap_lut = np.ascontiguousarray(lut[:, 0, ::-1])
+
+        self._local = threading.local()
+
+    def _buffers(self, shape):
+        """Buffers intermedios del hilo actual para imágenes de alto x ancho."""
+        key = (shape[0], shape[1])
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None or buffers['key'] != key:
+            buffers = self._local.buffers = {
+                'key': key,
+                'resized': np.empty(key, np.float32),
+                'uint8': np.empty(key, np.uint8),
+                'thresh': np.empty(key, np.uint8),
+                'closed': np.empty(key, np.uint8),
+            }
+        return buffers
+
+    def heatmap_uint8(self, heatmap, shape):
+        """
+        Suaviza y reescala el heatmap al tamaño de la imagen, como uint8.
+        Devuelve un buffer reutilizado: solo es válido hasta la siguiente llamada del hilo.
+        """
+        buffers = self._buffers(shape)
+        if self.blur:
+            heatmap = cv2.GaussianBlur(heatmap, self.gaussian_kernel_size, self.gaussian_sigma)
+        resized = cv2.resize(heatmap, (shape[1], shape[0]), dst=buffers['resized'])
+        np.multiply(resized, 255, out=resized)
+        # Truncado como np.uint8(255 * heatmap)
+        np.copyto(buffers['uint8'], resized, casting='unsafe')
+        return buffers['uint8']
+
+    def _bbox_from_uint8(self, heatmap_uint8):
+        buffers = self._buffers(heatmap_uint8.shape)
+        _, thresh = cv2.threshold(heatmap_uint8, self.thresh_value, 255, self.thresh_flags,
+                                  dst=buffers['thresh'])
+        closed = cv2.morphologyEx(thresh, self.morph_operation, self.morph_kernel, dst=buffers['closed'])
+
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return None
+
+        largest_contour = max(contours, key=cv2.contourArea)
+        x, y, w, h = cv2.boundingRect(largest_contour)
+
+        x = max(0, x - self.margin)
+        y = max(0, y - self.margin)
+        w = min(heatmap_uint8.shape[1] - x, w + 2 * self.margin)
+        h = min(heatmap_uint8.shape[0] - y, h + 2 * self.margin)
+        return x, y, w, h
+
+    def bbox(self, heatmap, shape):
+        """Solo la bounding box (x, y, w, h) en coordenadas de la imagen, o None; no dibuja."""
+        return self._bbox_from_uint8(self.heatmap_uint8(heatmap, shape))
+
+    def _overlay_copy(self, original_img, heatmap_uint8):
+        return original_img.copy()
+
+    def _overlay_scale(self, original_img, heatmap_uint8):
+        return cv2.convertScaleAbs(original_img, alpha=self.alpha)
+
+    def _overlay_blend(self, original_img, heatmap_uint8):
+        heatmap_color = self.colormap_lut[heatmap_uint8]
+        return cv2.addWeighted(original_img, self.alpha, heatmap_color, self.beta, 0)
+
+    def render(self, heatmap, original_img):
+        """Imagen con la superposición y la bounding box dibujada."""
+        heatmap_uint8 = self.heatmap_uint8(heatmap, original_img.shape)
+        superimposed_img = self._overlay(original_img, heatmap_uint8)
+
+        bbox = self._bbox_from_uint8(heatmap_uint8)
+        if bbox and self.bbox_thickness:
+            x, y, w, h = bbox
+            cv2.rectangle(superimposed_img, (x, y), (x + w, y + h), self.bbox_color, self.bbox_thickness)
+        return superimposed_img
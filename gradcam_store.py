@@ -0,0 +1,74 @@
+"""
+Almacén de corta duración para las imágenes Grad-CAM servidas por /gradcam/<id>.
+
+Las imágenes se guardan como archivos en un directorio compartido, de modo
+que cualquier worker de uWSGI puede servir el id generado por otro. Las
+entradas caducan tras GRADCAM_TTL segundos.
+"""
+import os
+import re
+import secrets
+import tempfile
+import time
+
+
+# =====================================================================
+# CONFIGURACIÓN ALMACÉN GRAD-CAM
+# =====================================================================
+GRADCAM_STORE_DIR = os.environ.get('GRADCAM_STORE_DIR', os.path.join(tempfile.gettempdir(), 'binit_gradcam'))
+GRADCAM_TTL = float(os.environ.get('GRADCAM_TTL', 120))
+# =====================================================================
+
+_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class GradcamStore:
+    def __init__(self, directory=GRADCAM_STORE_DIR, ttl=GRADCAM_TTL, purge_interval=30.0):
+        self.directory = directory
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def _path(self, image_id):
+        return os.path.join(self.directory, f'{image_id}.jpg')
+
+    def put(self, data):
+        """Guarda los bytes y devuelve su id."""
+        os.makedirs(self.directory, exist_ok=True)
+        image_id = secrets.token_hex(16)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(image_id))
+
+        if time.time() - self._last_purge > self.purge_interval:
+            self.purge()
+        return image_id
+
+    def get(self, image_id):
+        """Bytes de la imagen, o None si el id no es válido o ya caducó."""
+        if not _ID_PATTERN.match(image_id):
+            return None
+        path = self._path(image_id)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def purge(self):
+        """Elimina las entradas caducadas."""
+        self._last_purge = time.time()
+        try:
+            entries = os.scandir(self.directory)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                try:
+                    if self._last_purge - entry.stat().st_mtime > self.ttl:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
@@ -0,0 +1,217 @@
+"""
+Reentrenamiento rápido de la cabeza de clasificación con embeddings cacheados.
+
+El backbone (todo hasta el pooling global tras LAST_CONV_LAYER) se ejecuta
+una sola vez por imagen; el embedding resultante se guarda en disco en
+bloques .npy (leídos con memory-map) indexados por el sha256 del archivo.
+Cada ejecución solo calcula los embeddings de las muestras nuevas y después
+entrena únicamente las capas de la cabeza, que comparten pesos con el modelo
+completo, así que el resultado se guarda como un `.h5` que la app carga
+igual que model.h5 (MODEL_PATH).
+
+La caché se separa por huella de los pesos del backbone: un modelo
+reentrenado con esta herramienta sigue reutilizando los mismos embeddings.
+
+Uso:
+    python head_finetune.py --data training_data --output model_finetuned.h5
+    MODEL_PATH=model_finetuned.h5 python app.py
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications.efficientnet import preprocess_input
+from tensorflow.keras.models import load_model
+
+from decoding import decode_encoded, DecodeError
+from inference import CLASS_NAMES, LAST_CONV_LAYER, MODEL_PATH, TARGET_SIZE
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def split_model(model, conv_layer_name=LAST_CONV_LAYER):
+    """(modelo de embeddings hasta el pooling global, capas de la cabeza)."""
+    layers = model.layers
+    start = layers.index(model.get_layer(conv_layer_name)) + 1
+    for i, layer in enumerate(layers[start:], start):
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            embedding_model = tf.keras.Model(model.inputs, layer.output)
+            return embedding_model, layers[i + 1:]
+    raise ValueError('El modelo no tiene pooling global después de ' + conv_layer_name)
+
+
+def build_head(head_layers, dim):
+    """Modelo Input(dim) -> capas de la cabeza; comparte pesos con el modelo completo."""
+    inputs = tf.keras.Input(shape=(dim,))
+    x = inputs
+    for layer in head_layers:
+        x = layer(x)
+    return tf.keras.Model(inputs, x)
+
+
+def backbone_fingerprint(embedding_model):
+    digest = hashlib.sha256()
+    for w in embedding_model.weights:
+        digest.update(w.name.encode())
+        digest.update(np.ascontiguousarray(w.numpy()).tobytes())
+    return digest.hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """Embeddings por sha256 en bloques .npy de solo escritura al final + índice SQLite."""
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS embeddings '
+                          '(sha256 TEXT PRIMARY KEY, chunk TEXT NOT NULL, row INTEGER NOT NULL)')
+        self._chunks = {}
+
+    def missing(self, digests):
+        known = {r[0] for r in self.conn.execute('SELECT sha256 FROM embeddings')}
+        return [d for d in digests if d not in known]
+
+    def add(self, digests, embeddings):
+        """Guarda un bloque nuevo; el índice solo se actualiza cuando el .npy ya está completo."""
+        chunk = f"chunk-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{len(self._chunks):04d}.npy"
+        path = os.path.join(self.directory, chunk)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(embeddings, np.float32))
+        os.replace(tmp_path, path)
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO embeddings (sha256, chunk, row) VALUES (?, ?, ?)',
+                                  [(d, chunk, i) for i, d in enumerate(digests)])
+        self._chunks[chunk] = None
+
+    def _chunk(self, name):
+        if self._chunks.get(name) is None:
+            self._chunks[name] = np.load(os.path.join(self.directory, name), mmap_mode='r')
+        return self._chunks[name]
+
+    def get(self, digests):
+        """Matriz (len(digests), dim) con los embeddings en el orden pedido."""
+        locations = dict((d, (c, r)) for d, c, r in self.conn.execute('SELECT sha256, chunk, row FROM embeddings'))
+        return np.stack([self._chunk(locations[d][0])[locations[d][1]] for d in digests])
+
+
+def list_samples(root):
+    """(ruta, sha256, índice de clase) de training_data/<CLASE>/*."""
+    samples = []
+    for label in sorted(os.listdir(root)):
+        class_dir = os.path.join(root, label)
+        if not os.path.isdir(class_dir) or label.upper() not in CLASS_NAMES:
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(class_dir, name)
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                samples.append((path, digest, CLASS_NAMES.index(label.upper())))
+    return samples
+
+
+def embed_missing(samples, cache, embedding_model, batch_size):
+    """Calcula y guarda los embeddings que aún no están en la caché."""
+    pending = {}
+    for path, digest, _ in samples:
+        pending.setdefault(digest, path)
+    missing = cache.missing(list(pending))
+    if not missing:
+        return 0, []
+
+    def load(digest):
+        try:
+            with open(pending[digest], 'rb') as f:
+                return digest, decode_encoded(f.read(), TARGET_SIZE)
+        except (OSError, DecodeError):
+            return digest, None
+
+    failed = []
+    done = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor() as executor:
+        for i in range(0, len(missing), batch_size):
+            loaded = list(executor.map(load, missing[i:i + batch_size]))
+            failed.extend(pending[d] for d, img in loaded if img is None)
+            loaded = [(d, img) for d, img in loaded if img is not None]
+            if not loaded:
+                continue
+            batch = preprocess_input(np.stack([img for _, img in loaded]).astype(np.float32))
+            cache.add([d for d, _ in loaded], embedding_model(batch, training=False).numpy())
+            done += len(loaded)
+            print(f"\r  embeddings: {done}/{len(missing)} "
+                  f"({done / (time.perf_counter() - start):.1f} img/s)", end='', flush=True)
+    print()
+    return done, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reentrena solo la cabeza del modelo con embeddings cacheados')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--data', default='training_data')
+    parser.add_argument('--cache-dir', default='embedding_cache')
+    parser.add_argument('--output', default='model_finetuned.h5')
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--validation-split', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    samples = list_samples(args.data)
+    if not samples:
+        print(f"No se encontraron imágenes en {args.data}")
+        return 2
+
+    model = load_model(args.model)
+    embedding_model, head_layers = split_model(model)
+    fingerprint = backbone_fingerprint(embedding_model)
+    cache = EmbeddingCache(os.path.join(args.cache_dir, fingerprint))
+    print(f"📂 {len(samples)} imágenes | backbone {fingerprint}")
+
+    added, failed = embed_missing(samples, cache, embedding_model, args.batch_size)
+    unique = len({digest for _, digest, _ in samples})
+    print(f"🧮 {added} embeddings nuevos, {unique - added - len(failed)} reutilizados")
+    if failed:
+        print(f"⚠️ {len(failed)} imágenes no se pudieron decodificar")
+    failed = set(failed)
+    samples = [s for s in samples if s[0] not in failed]
+
+    x = cache.get([digest for _, digest, _ in samples])
+    y = np.array([label for _, _, label in samples])
+    order = np.random.default_rng(args.seed).permutation(len(samples))
+    n_val = int(len(samples) * args.validation_split)
+    val, train = order[:n_val], order[n_val:]
+
+    head = build_head(head_layers, x.shape[1])
+    head.compile(optimizer=tf.keras.optimizers.Adam(args.learning_rate),
+                 loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    callbacks = []
+    if n_val:
+        _, before = head.evaluate(x[val], y[val], verbose=0)
+        print(f"Precisión de validación antes: {before * 100:.2f}%")
+        callbacks.append(tf.keras.callbacks.EarlyStopping(patience=5, restore_best_weights=True))
+
+    start = time.perf_counter()
+    head.fit(x[train], y[train], validation_data=(x[val], y[val]) if n_val else None,
+             epochs=args.epochs, batch_size=args.batch_size, callbacks=callbacks, verbose=2)
+    print(f"⏱️ Cabeza entrenada en {time.perf_counter() - start:.1f} s")
+    if n_val:
+        _, after = head.evaluate(x[val], y[val], verbose=0)
+        print(f"Precisión de validación después: {after * 100:.2f}%")
+
+    # Las capas de la cabeza son las del modelo completo: basta con guardarlo
+    model.save(args.output)
+    print(f"✅ Modelo guardado en {args.output} (usar con MODEL_PATH={args.output})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Motores de inferencia para BinIt.
+
+`InferenceEngine` envuelve `model` y `grad_model` en `tf.function` con un
+`input_signature` fijo para TARGET_SIZE, de modo que el camino caliente de
+/predict no vuelve a trazar el grafo ni pasa por el bucle de `model.predict`.
+`TFLiteEngine` ejecuta los modelos cuantizados generados por export_tflite.py.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+# =====================================================================
+# CONFIGURACIÓN DEL MODELO
+# =====================================================================
+MODEL_PATH = os.environ.get('MODEL_PATH', 'model.h5')
+# 'keras' (model.h5), 'tflite' (modelos generados por export_tflite.py) o
+# 'remote' (servidor compartido, ver model_server.py)
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras').lower()
+TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', 'model_int8.tflite')
+TFLITE_THREADS = int(os.environ['TFLITE_THREADS']) if os.environ.get('TFLITE_THREADS') else None
+TARGET_SIZE = (255, 255)
+LAST_CONV_LAYER = 'top_activation'
+# 'gradcam' (backward pass) o 'cam' (pesos de la cabeza, sin gradientes)
+CAM_METHOD = os.environ.get('CAM_METHOD', 'gradcam').lower()
+# Compilación XLA de las funciones de inferencia
+XLA_JIT = os.environ.get('XLA_JIT', '0') == '1'
+# =====================================================================
+
+# Lista de clases (en el orden de salida del modelo)
+CLASS_NAMES = [
+    'CARDBOARD',
+    'GLASS',
+    'METAL',
+    'ORGANIC',
+    'PAPER',
+    'PEN',
+    'PET',
+    'PLASTIC_BAG',
+    'UNICEL',
+    'WRAPPER',
+    'OTHER'
+]
+# Con confianza igual o inferior se reporta 'OTHER'
+CONFIDENCE_THRESHOLD = 0.5
+
+
+def classify(idx, confidence):
+    """Etiqueta final de una predicción según CONFIDENCE_THRESHOLD."""
+    return 'OTHER' if confidence <= CONFIDENCE_THRESHOLD else CLASS_NAMES[idx]
+
+
+def cam_head_weights(model, conv_layer_name=LAST_CONV_LAYER):
+    """
+    Pesos efectivos (canales x clases) de la cabeza pooling global + densas.
+    Con más de una capa densa se componen sus kernels: el resultado es exacto
+    si las activaciones intermedias son lineales y una aproximación si no lo son.
+    """
+    layers = model.layers
+    conv_index = layers.index(model.get_layer(conv_layer_name))
+    weights = None
+    pooled = False
+    for layer in layers[conv_index + 1:]:
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            pooled = True
+        elif isinstance(layer, (tf.keras.layers.Dropout, tf.keras.layers.Activation,
+                                tf.keras.layers.Flatten)):
+            continue
+        elif isinstance(layer, tf.keras.layers.BatchNormalization):
+            gamma = layer.gamma.numpy() if layer.scale else 1.0
+            scale = gamma / np.sqrt(layer.moving_variance.numpy() + layer.epsilon)
+            weights = np.diag(scale) if weights is None else weights * scale
+        elif isinstance(layer, tf.keras.layers.Dense):
+            kernel = layer.kernel.numpy()
+            weights = kernel if weights is None else weights @ kernel
+        else:
+            raise ValueError(f'Capa no soportada para CAM: {layer.name} ({type(layer).__name__})')
+    if not pooled or weights is None:
+        raise ValueError('La cabeza del modelo no es pooling global + densas')
+    return weights.astype(np.float32)
+
+
+def _normalize_heatmap(heatmap):
+    heatmap = tf.maximum(heatmap, 0)
+    return tf.math.divide_no_nan(heatmap, tf.reduce_max(heatmap, axis=(1, 2), keepdims=True))
+
+
+class InferenceEngine:
+    """
+    Clasificación + mapa de activación compilados con firma fija.
+
+    `run(batch)` devuelve (probabilidades, índice, confianza, heatmap) como
+    arrays de numpy con la dimensión de batch al frente; `predict(batch)`
+    devuelve solo las probabilidades.
+    """
+    def __init__(self, model, conv_layer_name=LAST_CONV_LAYER, target_size=TARGET_SIZE,
+                 cam_method=CAM_METHOD, jit_compile=XLA_JIT, warmup=True):
+        self.model = model
+        self.grad_model = tf.keras.models.Model(
+            inputs=model.input,
+            outputs=[model.get_layer(conv_layer_name).output, model.output]
+        )
+        self.conv_layer_name = conv_layer_name
+        self.target_size = target_size
+        self.jit_compile = jit_compile
+        self.trace_count = 0
+        self.warm = False
+        self.warmup_seconds = None
+
+        self.cam_method = cam_method
+        self._head_weights = None
+        if cam_method == 'cam':
+            try:
+                self._head_weights = tf.constant(cam_head_weights(model, conv_layer_name))
+            except ValueError as e:
+                print(f"⚠️ CAM_METHOD=cam no disponible ({e}), usando Grad-CAM")
+                self.cam_method = 'gradcam'
+        elif cam_method != 'gradcam':
+            raise ValueError(f'CAM_METHOD no válido: {cam_method}')
+
+        # TARGET_SIZE sigue la convención de PIL (ancho, alto)
+        spec = tf.TensorSpec([None, target_size[1], target_size[0], 3], tf.float32)
+        explain = self._cam if self.cam_method == 'cam' else self._gradcam
+        self._explain_fn = tf.function(explain, input_signature=[spec], jit_compile=jit_compile)
+        self._classify_fn = tf.function(self._classify, input_signature=[spec], jit_compile=jit_compile)
+        self._embed_fn = tf.function(self._embed, input_signature=[spec], jit_compile=jit_compile)
+
+        if warmup:
+            self.warmup()
+
+    # -----------------------------------------------------------------
+    # Funciones trazadas (el contador solo avanza al trazar)
+    # -----------------------------------------------------------------
+    def _classify(self, img_array):
+        self.trace_count += 1
+        return self.model(img_array, training=False)
+
+    def _embed(self, img_array):
+        self.trace_count += 1
+        conv_outputs, _ = self.grad_model(img_array, training=False)
+        return tf.reduce_mean(conv_outputs, axis=(1, 2))
+
+    def _gradcam(self, img_array):
+        self.trace_count += 1
+        # Clasificación y Grad-CAM en un único forward pass grabado por la cinta
+        with tf.GradientTape() as tape:
+            conv_outputs, predictions = self.grad_model(img_array, training=False)
+            pred_index = tf.argmax(predictions, axis=-1)
+            class_channel = tf.gather(predictions, pred_index, axis=1, batch_dims=1)
+
+        # Las muestras del batch son independientes, así que el gradiente de la
+        # suma equivale al gradiente por imagen
+        grads = tape.gradient(class_channel, conv_outputs)
+        pooled_grads = tf.reduce_mean(grads, axis=(1, 2))
+
+        heatmap = tf.einsum('bhwc,bc->bhw', conv_outputs, pooled_grads)
+        return predictions, pred_index, tf.reduce_max(predictions, axis=-1), _normalize_heatmap(heatmap)
+
+    def _cam(self, img_array):
+        self.trace_count += 1
+        conv_outputs, predictions = self.grad_model(img_array, training=False)
+        pred_index = tf.argmax(predictions, axis=-1)
+        class_weights = tf.transpose(tf.gather(self._head_weights, pred_index, axis=1))
+        heatmap = tf.einsum('bhwc,bc->bhw', conv_outputs, class_weights)
+        return predictions, pred_index, tf.reduce_max(predictions, axis=-1), _normalize_heatmap(heatmap)
+
+    # -----------------------------------------------------------------
+    # API pública
+    # -----------------------------------------------------------------
+    # Las funciones compiladas solo aceptan float32: un uint8 se convierte aquí
+    # en lugar de fallar en convert_to_tensor
+    def run(self, batch):
+        """Clasificación + heatmap para un batch (N, alto, ancho, 3)."""
+        outputs = self._explain_fn(tf.convert_to_tensor(np.asarray(batch, np.float32)))
+        return tuple(t.numpy() for t in outputs)
+
+    def predict(self, batch):
+        """Solo probabilidades, sin mapa de activación."""
+        return self._classify_fn(tf.convert_to_tensor(np.asarray(batch, np.float32))).numpy()
+
+    def embed(self, batch):
+        """Embedding (N, canales): activaciones de LAST_CONV_LAYER con pooling global."""
+        return self._embed_fn(tf.convert_to_tensor(np.asarray(batch, np.float32))).numpy()
+
+    def warmup(self):
+        """Traza y ejecuta las funciones compiladas con una imagen vacía."""
+        start = time.perf_counter()
+        dummy = np.zeros((1, self.target_size[1], self.target_size[0], 3), np.float32)
+        self.run(dummy)
+        self.predict(dummy)
+        self.embed(dummy)
+        self.warmup_seconds = time.perf_counter() - start
+        self.warm = True
+
+    def stats(self):
+        return {
+            'backend': 'keras',
+            'cam_method': self.cam_method,
+            'jit_compile': self.jit_compile,
+            'trace_count': self.trace_count,
+            'warm': self.warm,
+            'warmup_seconds': self.warmup_seconds,
+        }
+
+
+def cam_head_path(tflite_path):
+    """Ruta de los pesos de cabeza CAM que acompañan a un modelo TFLite."""
+    return os.path.splitext(tflite_path)[0] + '_cam_head.npy'
+
+
+def _tflite_interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteEngine:
+    """
+    Motor sobre un modelo TFLite con dos salidas (activaciones de
+    LAST_CONV_LAYER y probabilidades), como los que genera export_tflite.py.
+
+    TFLite no calcula gradientes, así que el heatmap se obtiene siempre por CAM
+    con los pesos de cabeza exportados. Si no existen, el heatmap se devuelve
+    vacío (sin bounding box) y `stats()` lo indica con `cam_method: None`.
+    """
+    model = None
+    grad_model = None
+
+    def __init__(self, model_path=TFLITE_MODEL_PATH, target_size=TARGET_SIZE,
+                 num_threads=TFLITE_THREADS, warmup=True):
+        self.model_path = model_path
+        self.target_size = target_size
+        self.num_threads = num_threads
+        self.warm = False
+        self.warmup_seconds = None
+        # El intérprete no es seguro entre hilos
+        self._lock = threading.Lock()
+
+        self._interpreter = _tflite_interpreter_class()(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        outputs = self._interpreter.get_output_details()
+        self._conv_output = next(o for o in outputs if len(o['shape']) == 4)
+        self._probs_output = next(o for o in outputs if len(o['shape']) == 2)
+
+        head_path = cam_head_path(model_path)
+        if os.path.exists(head_path):
+            self._head_weights = np.load(head_path).astype(np.float32)
+            self.cam_method = 'cam'
+        else:
+            print(f"⚠️ No se encontró {head_path}: el backend TFLite no generará heatmap")
+            self._head_weights = None
+            self.cam_method = None
+
+        if warmup:
+            self.warmup()
+
+    def _get_output(self, detail):
+        value = self._interpreter.get_tensor(detail['index'])
+        scale, zero_point = detail['quantization']
+        if scale:
+            value = (value.astype(np.float32) - zero_point) * scale
+        return value.astype(np.float32)
+
+    def _invoke(self, image):
+        value = image[np.newaxis]
+        scale, zero_point = self._input['quantization']
+        if scale:
+            limits = np.iinfo(self._input['dtype'])
+            value = np.clip(np.round(value / scale + zero_point), limits.min, limits.max)
+        with self._lock:
+            self._interpreter.set_tensor(self._input['index'], value.astype(self._input['dtype']))
+            self._interpreter.invoke()
+            return self._get_output(self._conv_output)[0], self._get_output(self._probs_output)[0]
+
+    def run(self, batch):
+        """Clasificación + heatmap CAM para un batch (N, alto, ancho, 3)."""
+        batch = np.asarray(batch, np.float32)
+        conv_outputs, predictions = zip(*(self._invoke(image) for image in batch))
+        conv_outputs = np.stack(conv_outputs)
+        predictions = np.stack(predictions)
+        pred_index = np.argmax(predictions, axis=-1)
+
+        if self._head_weights is None:
+            heatmap = np.zeros(conv_outputs.shape[:3], np.float32)
+        else:
+            class_weights = self._head_weights[:, pred_index].T
+            heatmap = np.maximum(np.einsum('bhwc,bc->bhw', conv_outputs, class_weights), 0)
+            peak = heatmap.max(axis=(1, 2), keepdims=True)
+            heatmap = np.divide(heatmap, peak, out=np.zeros_like(heatmap), where=peak > 0)
+
+        return predictions, pred_index, predictions.max(axis=-1), heatmap
+
+    def predict(self, batch):
+        """Solo probabilidades, sin mapa de activación."""
+        return np.stack([self._invoke(image)[1] for image in np.asarray(batch, np.float32)])
+
+    def embed(self, batch):
+        """Embedding (N, canales): activaciones de LAST_CONV_LAYER con pooling global."""
+        return np.stack([self._invoke(image)[0].mean(axis=(0, 1)) for image in np.asarray(batch, np.float32)])
+
+    def warmup(self):
+        start = time.perf_counter()
+        self.run(np.zeros((1, self.target_size[1], self.target_size[0], 3), np.float32))
+        self.warmup_seconds = time.perf_counter() - start
+        self.warm = True
+
+    def stats(self):
+        return {
+            'backend': 'tflite',
+            'model_path': self.model_path,
+            'cam_method': self.cam_method,
+            'num_threads': self.num_threads,
+            'warm': self.warm,
+            'warmup_seconds': self.warmup_seconds,
+        }
+
+
+class LazyEngine:
+    """
+    Motor que se construye al llamar a `load()` y se vuelve a construir si el
+    proceso cambia (fork). Permite importar la app en el master de uWSGI sin
+    ejecutar nada de TensorFlow antes del fork: sus hilos internos no
+    sobreviven en los hijos. Cualquier atributo del motor real se delega y lo
+    carga si hace falta.
+    """
+    def __init__(self, factory=None, **kwargs):
+        self._factory = factory or load_engine
+        self._kwargs = kwargs
+        self._engine = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    def loaded(self):
+        return self._engine is not None and self._pid == os.getpid()
+
+    def load(self):
+        if self.loaded():
+            return self._engine
+        with self._lock:
+            if not self.loaded():
+                start = time.perf_counter()
+                self._engine = self._factory(**self._kwargs)
+                self._pid = os.getpid()
+                self.load_seconds = time.perf_counter() - start
+        return self._engine
+
+    @property
+    def warm(self):
+        return self.loaded() and self._engine.warm
+
+    def stats(self):
+        if not self.loaded():
+            return {'loaded': False, 'warm': False}
+        return dict(self._engine.stats(), loaded=True, load_seconds=self.load_seconds)
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+def prefetch_file(path, chunk_size=1 << 20):
+    """Lee el archivo completo para dejarlo en la caché de páginas del sistema."""
+    try:
+        with open(path, 'rb') as f:
+            while f.read(chunk_size):
+                pass
+    except OSError as e:
+        print(f"⚠️ No se pudo precargar {path}: {e}")
+
+
+def load_engine(backend=INFERENCE_BACKEND, **kwargs):
+    """Construye el motor de inferencia del backend seleccionado."""
+    if backend == 'tflite':
+        return TFLiteEngine(**kwargs)
+    if backend == 'remote':
+        from model_server import RemoteEngine
+        return RemoteEngine(**kwargs)
+    if backend != 'keras':
+        raise ValueError(f'INFERENCE_BACKEND no válido: {backend}')
+    from tensorflow.keras.models import load_model
+    return InferenceEngine(load_model(kwargs.pop('model_path', MODEL_PATH)), **kwargs)
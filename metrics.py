@@ -0,0 +1,399 @@
+"""
+Colector de métricas estilo Prometheus compartido entre workers de uWSGI.
+
+Cada proceso acumula contadores, histogramas y gauges en memoria y los vuelca
+periódicamente a METRICS_DIR/<pid>.json. El endpoint /metrics (servido por
+cualquier worker) fusiona todos los archivos: contadores e histogramas se
+suman entre procesos (también los de workers ya reciclados) y los gauges solo
+se exportan para procesos vivos, etiquetados con su pid.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - solo en Windows
+    fcntl = None
+
+
+# =====================================================================
+# CONFIGURACIÓN MÉTRICAS
+# =====================================================================
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'binit_metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+# =====================================================================
+
+_ARCHIVE_FILE = '_archive.json'
+_LOCK_FILE = '.lock'
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def process_rss_bytes():
+    """Memoria residente del proceso actual."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss es el pico (en KB en Linux), a falta de /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_pss_bytes():
+    """Memoria proporcional (PSS): las páginas compartidas se reparten entre procesos. None sin /proc."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def process_start_ticks(pid='self'):
+    """Instante de creación del proceso en ticks desde el arranque del sistema. None sin /proc."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # El nombre del proceso puede contener espacios: los campos siguen tras el último ')'
+            return int(f.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_age_seconds():
+    """Segundos desde que se creó el proceso (para un worker, desde el fork). None sin /proc."""
+    start_ticks = process_start_ticks()
+    try:
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    if start_ticks is None:
+        return None
+    return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsCollector:
+    def __init__(self, directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL,
+                 buckets=LATENCY_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._gauge_callbacks = []
+        self._help = {}
+        self._types = {}
+        self._flusher = None
+        self._pid = None
+
+    # -----------------------------------------------------------------
+    # Registro de valores
+    # -----------------------------------------------------------------
+    def describe(self, name, kind, help_text):
+        self._types[name] = kind
+        self._help[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        # Antes de escribir: tras un fork, _ensure_flusher descarta lo heredado del padre
+        self._ensure_flusher()
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        self._ensure_flusher()
+        key = _key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist['buckets'][i] += 1
+            hist['sum'] += seconds
+            hist['count'] += 1
+
+    def set_gauge(self, name, value, **labels):
+        self._ensure_flusher()
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def add_gauge(self, name, delta, **labels):
+        self._ensure_flusher()
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def register_gauge_callback(self, callback):
+        """`callback(collector)` se invoca antes de cada volcado para refrescar gauges."""
+        self._gauge_callbacks.append(callback)
+
+    def start(self):
+        """Arranca el volcado periódico sin esperar al primer valor (p. ej. en el mule de voz)."""
+        self._ensure_flusher()
+
+    @contextmanager
+    def stage(self, endpoint, stage):
+        """Mide la duración de una etapa de un endpoint."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('binit_stage_duration_seconds', time.perf_counter() - start,
+                         endpoint=endpoint, stage=stage)
+
+    @contextmanager
+    def request(self, endpoint):
+        """
+        Cuenta una petición, su latencia y las peticiones en curso.
+        El bloque puede asignar `status` en el dict devuelto; una excepción
+        cuenta como 500.
+        """
+        self._ensure_flusher()
+        state = {'status': 200}
+        self.add_gauge('binit_inflight_requests', 1, endpoint=endpoint)
+        start = time.perf_counter()
+        try:
+            yield state
+        except Exception:
+            state['status'] = 500
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.add_gauge('binit_inflight_requests', -1, endpoint=endpoint)
+            self.inc('binit_requests_total', endpoint=endpoint, status=str(state['status']))
+            if state['status'] >= 400:
+                self.inc('binit_request_errors_total', endpoint=endpoint)
+            self.observe('binit_request_duration_seconds', elapsed, endpoint=endpoint)
+
+    # -----------------------------------------------------------------
+    # Persistencia compartida entre procesos
+    # -----------------------------------------------------------------
+    def _ensure_flusher(self):
+        # Hilo de volcado perezoso y recreado tras un fork (como en batching.py)
+        pid = os.getpid()
+        if self._flusher is not None and self._pid == pid and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is not None and self._pid == pid and self._flusher.is_alive():
+                return
+            if self._pid is not None and self._pid != pid:
+                # Los valores heredados del padre ya están en su propio archivo
+                self._counters.clear()
+                self._histograms.clear()
+                self._gauges.clear()
+            self._pid = pid
+            self._flusher = threading.Thread(target=self._flush_loop, name='binit-metrics', daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _snapshot(self):
+        for callback in self._gauge_callbacks:
+            try:
+                callback(self)
+            except Exception:
+                pass
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[n, list(l), v] for (n, l), v in self._counters.items()],
+                'histograms': [[n, list(l), h['buckets'], h['sum'], h['count']]
+                               for (n, l), h in self._histograms.items()],
+                'gauges': [[n, list(l), v] for (n, l), v in self._gauges.items()],
+            }
+
+    def flush(self):
+        """Escribe el estado de este proceso de forma atómica."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(tmp_path, path)
+
+    @contextmanager
+    def _dir_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, _LOCK_FILE), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _compact_dead(self, snapshots):
+        """
+        Acumula los archivos de procesos muertos en el archivo histórico.
+        Debe llamarse con el lock del directorio tomado.
+        """
+        dead = [(path, snap) for path, snap in snapshots if not pid_alive(snap['pid'])]
+        if not dead or fcntl is None:
+            return
+        archive_path = os.path.join(self.directory, _ARCHIVE_FILE)
+        archive = self._read(archive_path) or {'pid': None, 'counters': [], 'histograms': [], 'gauges': []}
+        merged = self._merge([archive] + [snap for _, snap in dead], include_gauges=False)
+        archive = {
+            'pid': None,
+            'counters': [[n, list(l), v] for (n, l), v in merged['counters'].items()],
+            'histograms': [[n, list(l), h['buckets'], h['sum'], h['count']]
+                           for (n, l), h in merged['histograms'].items()],
+            'gauges': [],
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(archive, f)
+        os.replace(tmp_path, archive_path)
+        for path, _ in dead:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _merge(self, snapshots, include_gauges=True):
+        counters, histograms, gauges = {}, {}, {}
+        for snap in snapshots:
+            for name, labels, value in snap.get('counters', []):
+                key = (name, tuple(tuple(l) for l in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, buckets, total, count in snap.get('histograms', []):
+                key = (name, tuple(tuple(l) for l in labels))
+                hist = histograms.setdefault(key, {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0})
+                hist['buckets'] = [a + b for a, b in zip(hist['buckets'], buckets)]
+                hist['sum'] += total
+                hist['count'] += count
+            if include_gauges and snap.get('pid') is not None and pid_alive(snap['pid']):
+                for name, labels, value in snap.get('gauges', []):
+                    key = (name, tuple(tuple(l) for l in labels) + (('pid', str(snap['pid'])),))
+                    gauges[key] = value
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def gauges(self, prefix=''):
+        """
+        Gauges de los procesos vivos cuyo nombre empieza por `prefix`, como
+        {(nombre, etiquetas): valor}; las etiquetas incluyen el pid.
+        """
+        self.flush()
+        snapshots = []
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json') and filename != _ARCHIVE_FILE:
+                snap = self._read(os.path.join(self.directory, filename))
+                if snap is not None:
+                    snapshots.append(snap)
+        return {key: value for key, value in self._merge(snapshots)['gauges'].items()
+                if key[0].startswith(prefix)}
+
+    def render(self):
+        """Texto en formato de exposición de Prometheus con todos los workers."""
+        self.flush()
+        with self._dir_lock():
+            snapshots = []
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json') and filename != _ARCHIVE_FILE:
+                    path = os.path.join(self.directory, filename)
+                    snap = self._read(path)
+                    if snap is not None:
+                        snapshots.append((path, snap))
+            self._compact_dead(snapshots)
+
+            archive = self._read(os.path.join(self.directory, _ARCHIVE_FILE))
+            live = [snap for path, snap in snapshots if os.path.exists(path)]
+        merged = self._merge(([archive] if archive else []) + live)
+
+        by_name = {}
+        for kind in ('counters', 'histograms', 'gauges'):
+            for (name, labels), value in merged[kind].items():
+                by_name.setdefault(name, []).append((kind, labels, value))
+
+        lines = []
+        for name in sorted(by_name):
+            kind = self._types.get(name) or {'counters': 'counter', 'histograms': 'histogram',
+                                              'gauges': 'gauge'}[by_name[name][0][0]]
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {kind}')
+            for _, labels, value in sorted(by_name[name], key=lambda item: item[1]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                for bound, count in zip(self.buckets, value['buckets']):
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", repr(bound)),))} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {value["count"]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value["sum"])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {value["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsCollector()
+metrics.describe('binit_requests_total', 'counter', 'Peticiones atendidas por endpoint y código HTTP')
+metrics.describe('binit_request_errors_total', 'counter', 'Peticiones con error (HTTP >= 400) por endpoint')
+metrics.describe('binit_request_duration_seconds', 'histogram', 'Latencia total por endpoint')
+metrics.describe('binit_stage_duration_seconds', 'histogram', 'Latencia por etapa de cada endpoint')
+metrics.describe('binit_inflight_requests', 'gauge', 'Peticiones en curso por worker')
+metrics.describe('binit_model_warm', 'gauge', '1 si el modelo del worker está precalentado')
+metrics.describe('binit_batch_queue_depth', 'gauge', 'Muestras esperando en la cola de micro-batching')
+metrics.describe('binit_process_resident_memory_bytes', 'gauge', 'Memoria residente del worker')
+metrics.describe('binit_feedback_queue_depth', 'gauge', 'Imágenes de feedback esperando a escribirse')
+metrics.describe('binit_feedback_write_seconds', 'histogram', 'Tiempo desde que se encola una imagen de feedback hasta que está en disco')
+metrics.describe('binit_feedback_errors_total', 'counter', 'Fallos de escritura de feedback por etapa (callback: sí se guardó)')
+metrics.describe('binit_feedback_rejected_total', 'counter', 'Imágenes de feedback rechazadas por cola llena')
+metrics.describe('binit_feedback_duplicates_total', 'counter', 'Imágenes de feedback casi duplicadas por acción (flag/skip)')
+metrics.describe('binit_worker_startup_seconds', 'gauge', 'Segundos desde el fork del worker hasta tener el modelo precalentado')
+metrics.describe('binit_worker_startup_rss_bytes', 'gauge', 'Memoria residente del worker al terminar el arranque')
+metrics.describe('binit_prediction_cache_total', 'counter', 'Consultas a la caché de predicciones (hit/miss)')
+metrics.describe('binit_voice_jobs_total', 'counter', 'Trabajos de /voice terminados por estado')
+metrics.describe('binit_tts_model_loaded', 'gauge', '1 si el modelo TTS está cargado en el worker')
+metrics.describe('binit_tts_model_load_seconds', 'gauge', 'Duración de la última carga del modelo TTS')
+metrics.describe('binit_tts_model_resident_seconds', 'gauge', 'Segundos que lleva cargado el modelo TTS')
@@ -0,0 +1,391 @@
+"""
+Servidor de inferencia compartido por todos los workers de uWSGI.
+
+Un solo proceso carga el modelo (un único juego de pesos y un único pool de
+hilos de TensorFlow) y atiende a los workers con INFERENCE_BACKEND=remote:
+
+- Los tensores viajan por un bloque de memoria compartida dividido en
+  MODEL_SERVER_SLOTS slots. Cada conexión recibe un slot propio al conectarse
+  y lo conserva hasta desconectarse, así que no hay que coordinar su uso.
+- Por el socket unix de control solo pasan cabeceras de pocos bytes: el
+  cliente escribe su batch en el slot y envía ('R', n); el servidor escribe
+  probabilidades y heatmaps en la zona de salida del slot y responde con su
+  forma. Las peticiones que llegan a la vez de varios workers se agrupan en
+  un único forward pass.
+- El servidor nunca espera a un cliente: lee lo que haya en cada conexión
+  lista, lo acumula en su buffer y solo atiende las cabeceras completas, así
+  que un cliente lento o a medias no bloquea a los demás.
+
+Uso:
+    python model_server.py
+    INFERENCE_BACKEND=remote uwsgi --ini uwsgi.ini
+"""
+import json
+import os
+import selectors
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from inference import TARGET_SIZE, load_engine
+
+
+# =====================================================================
+# CONFIGURACIÓN SERVIDOR DE MODELO
+# =====================================================================
+MODEL_SERVER_SOCKET = os.environ.get('MODEL_SERVER_SOCKET', '/tmp/binit_model.sock')
+MODEL_SERVER_SHM = os.environ.get('MODEL_SERVER_SHM', 'binit_model')
+# Un slot por conexión: al menos processes x (threads + 1) de uWSGI
+MODEL_SERVER_SLOTS = int(os.environ.get('MODEL_SERVER_SLOTS', 8))
+# Imágenes por slot; los batches mayores se envían en varias partes
+MODEL_SERVER_SLOT_BATCH = int(os.environ.get('MODEL_SERVER_SLOT_BATCH', 4))
+MODEL_SERVER_CONNECT_TIMEOUT = float(os.environ.get('MODEL_SERVER_CONNECT_TIMEOUT', 120))
+# =====================================================================
+
+# Petición: tipo (R = run, E = embed, S = stats) + número de imágenes
+_REQUEST = struct.Struct('!cI')
+# Respuesta a R/E: estado (0 = ok), imágenes, alto y ancho del heatmap (o dimensión del embedding)
+_REPLY = struct.Struct('!BIII')
+_LENGTH = struct.Struct('!I')
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('Conexión cerrada')
+        data.extend(chunk)
+    return bytes(data)
+
+
+def _send_message(sock, payload):
+    data = json.dumps(payload).encode()
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _recv_message(sock):
+    size, = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+def _attach_shared_memory(name):
+    """Se adjunta al bloque sin registrarlo para borrado al salir (lo gestiona el servidor)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: el resource_tracker lo borraría al terminar el worker
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class ModelServer:
+    def __init__(self, engine, socket_path=MODEL_SERVER_SOCKET, shm_name=MODEL_SERVER_SHM,
+                 slots=MODEL_SERVER_SLOTS, slot_batch=MODEL_SERVER_SLOT_BATCH, target_size=TARGET_SIZE):
+        self.engine = engine
+        self.socket_path = socket_path
+        self.slot_batch = slot_batch
+        self.input_shape = (target_size[1], target_size[0], 3)
+        self.requests = 0
+        self.batches = 0
+
+        # Formas de salida a partir de una inferencia de prueba
+        dummy = np.zeros((1,) + self.input_shape, np.float32)
+        probs, _, _, heatmap = engine.run(dummy)
+        self.num_classes = probs.shape[1]
+        self.heatmap_shape = heatmap.shape[1:]
+        self.embedding_dim = engine.embed(dummy).shape[1]
+
+        self.input_size = int(np.prod(self.input_shape))
+        self.output_size = max(self.num_classes + int(np.prod(self.heatmap_shape)), self.embedding_dim)
+        slot_floats = slot_batch * (self.input_size + self.output_size)
+        try:
+            # Un bloque huérfano de una ejecución anterior
+            stale = shared_memory.SharedMemory(name=shm_name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name=shm_name, create=True, size=slots * slot_floats * 4)
+        buffer = np.ndarray((slots, slot_floats), np.float32, self.shm.buf)
+        split = slot_batch * self.input_size
+        self.inputs = [buffer[i, :split].reshape((slot_batch,) + self.input_shape) for i in range(slots)]
+        self.outputs = [buffer[i, split:].reshape(slot_batch, self.output_size) for i in range(slots)]
+        self.free_slots = list(range(slots))
+        self._selector = selectors.DefaultSelector()
+        self._slots = {}
+        self._buffers = {}
+
+    def _drop(self, sock):
+        """Cierra la conexión de un worker y libera su slot."""
+        if sock in self._slots:
+            self._selector.unregister(sock)
+            self.free_slots.append(self._slots.pop(sock))
+            del self._buffers[sock]
+        sock.close()
+
+    def _read_requests(self, sock):
+        """
+        Lee lo disponible en una conexión lista (un solo recv, que no bloquea)
+        y devuelve las peticiones (tipo, n) cuya cabecera ya está completa.
+        """
+        try:
+            chunk = sock.recv(4096)
+        except OSError:
+            chunk = b''
+        if not chunk:
+            self._drop(sock)
+            return []
+        buffer = self._buffers[sock]
+        buffer.extend(chunk)
+        requests = []
+        while len(buffer) >= _REQUEST.size:
+            requests.append(_REQUEST.unpack_from(buffer))
+            del buffer[:_REQUEST.size]
+        return requests
+
+    def _reply(self, sock, data):
+        try:
+            sock.sendall(data)
+        except OSError:
+            self._drop(sock)
+
+    def handshake(self):
+        return {
+            'shm': self.shm.name,
+            'slots': len(self.inputs),
+            'slot_batch': self.slot_batch,
+            'input_shape': list(self.input_shape),
+            'input_size': self.input_size,
+            'output_size': self.output_size,
+            'num_classes': self.num_classes,
+        }
+
+    def stats(self):
+        return dict(self.engine.stats(), server_pid=os.getpid(), requests=self.requests, batches=self.batches,
+                    free_slots=len(self.free_slots))
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o666)
+        listener.listen(64)
+        self._selector.register(listener, selectors.EVENT_READ)
+        print(f"✅ Servidor de modelo en {self.socket_path} ({len(self.inputs)} slots, shm {self.shm.name})")
+
+        try:
+            while True:
+                pending = []
+                for key, _ in self._selector.select():
+                    sock = key.fileobj
+                    if sock is listener:
+                        self._accept(listener)
+                        continue
+                    for kind, n in self._read_requests(sock):
+                        if sock not in self._slots:
+                            break
+                        if kind == b'S':
+                            data = json.dumps(self.stats()).encode()
+                            self._reply(sock, _LENGTH.pack(len(data)) + data)
+                        else:
+                            pending.append((sock, self._slots[sock], kind, n))
+
+                # Todas las peticiones listas en esta vuelta van en un solo batch por tipo
+                for kind in (b'R', b'E'):
+                    group = [p for p in pending if p[2] == kind]
+                    if group:
+                        self._run_group(kind, group)
+        finally:
+            listener.close()
+            os.remove(self.socket_path)
+            self.shm.close()
+            self.shm.unlink()
+
+    def _accept(self, listener):
+        conn, _ = listener.accept()
+        try:
+            if not self.free_slots:
+                _send_message(conn, {'error': 'Sin slots libres (MODEL_SERVER_SLOTS)'})
+                conn.close()
+                return
+            slot = self.free_slots.pop()
+            self._slots[conn] = slot
+            self._buffers[conn] = bytearray()
+            self._selector.register(conn, selectors.EVENT_READ)
+            _send_message(conn, dict(self.handshake(), slot=slot))
+        except OSError:
+            self._drop(conn)
+
+    def _run_group(self, kind, group):
+        batch = np.concatenate([self.inputs[slot][:n] for _, slot, _, n in group])
+        try:
+            if kind == b'R':
+                probs, _, _, heatmap = self.engine.run(batch)
+                outputs = np.concatenate([probs, heatmap.reshape(len(batch), -1)], axis=1)
+                reply = (0,) + tuple(self.heatmap_shape)
+            else:
+                outputs = self.engine.embed(batch)
+                reply = (0, outputs.shape[1], 0)
+        except Exception as e:
+            message = str(e).encode()
+            for sock, _, _, n in group:
+                self._reply(sock, _REPLY.pack(1, n, 0, 0) + _LENGTH.pack(len(message)) + message)
+            return
+
+        self.batches += 1
+        offset = 0
+        for sock, slot, _, n in group:
+            self.outputs[slot][:n, :outputs.shape[1]] = outputs[offset:offset + n]
+            offset += n
+            self.requests += 1
+            self._reply(sock, _REPLY.pack(reply[0], n, reply[1], reply[2]))
+
+
+class RemoteEngine:
+    """
+    Motor que delega en model_server.py. Misma interfaz que InferenceEngine
+    (`run`, `predict`, `embed`, `warmup`, `stats`); cada hilo usa su propia
+    conexión y su propio slot de memoria compartida.
+    """
+    model = None
+    grad_model = None
+
+    def __init__(self, socket_path=MODEL_SERVER_SOCKET, connect_timeout=MODEL_SERVER_CONNECT_TIMEOUT,
+                 warmup=True):
+        self.socket_path = socket_path
+        self.connect_timeout = connect_timeout
+        self.warm = False
+        self.warmup_seconds = None
+        self._local = threading.local()
+        self._shm = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if warmup:
+            self.warmup()
+
+    def _connection(self, connect_timeout=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and conn['pid'] == os.getpid():
+            return conn
+
+        deadline = time.monotonic() + (self.connect_timeout if connect_timeout is None else connect_timeout)
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+                break
+            except OSError:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise ConnectionError(f'No se pudo conectar con el servidor de modelo en {self.socket_path}')
+                time.sleep(0.5)
+        info = _recv_message(sock)
+        if 'error' in info:
+            sock.close()
+            raise ConnectionError(info['error'])
+
+        with self._lock:
+            if self._shm is None or self._pid != os.getpid():
+                self._shm = _attach_shared_memory(info['shm'])
+                self._pid = os.getpid()
+        slot_floats = info['slot_batch'] * (info['input_size'] + info['output_size'])
+        buffer = np.ndarray((info['slots'], slot_floats), np.float32, self._shm.buf)
+        split = info['slot_batch'] * info['input_size']
+        slot = info['slot']
+        conn = self._local.conn = {
+            'pid': os.getpid(),
+            'sock': sock,
+            'info': info,
+            'input': buffer[slot, :split].reshape([info['slot_batch']] + info['input_shape']),
+            'output': buffer[slot, split:].reshape(info['slot_batch'], info['output_size']),
+        }
+        return conn
+
+    def _call(self, kind, batch):
+        """Envía el batch por partes de slot_batch; devuelve las salidas y la cabecera de cada parte."""
+        conn = self._connection()
+        batch = np.asarray(batch, np.float32)
+        size = conn['info']['slot_batch']
+        parts = []
+        for start in range(0, len(batch), size):
+            chunk = batch[start:start + size]
+            n = len(chunk)
+            conn['input'][:n] = chunk
+            try:
+                conn['sock'].sendall(_REQUEST.pack(kind, n))
+                status, n, a, b = _REPLY.unpack(_recv_exact(conn['sock'], _REPLY.size))
+                if status:
+                    length, = _LENGTH.unpack(_recv_exact(conn['sock'], _LENGTH.size))
+                    raise RuntimeError(_recv_exact(conn['sock'], length).decode())
+            except (ConnectionError, OSError):
+                # El servidor se reinició: la próxima llamada vuelve a conectar
+                conn['sock'].close()
+                self._local.conn = None
+                raise
+            parts.append((conn['output'][:n].copy(), a, b))
+        return conn['info'], parts
+
+    def run(self, batch):
+        """Clasificación + heatmap para un batch (N, alto, ancho, 3)."""
+        info, parts = self._call(b'R', batch)
+        classes = info['num_classes']
+        predictions = np.concatenate([out[:, :classes] for out, _, _ in parts])
+        heatmap = np.concatenate([out[:, classes:classes + h * w].reshape(-1, h, w) for out, h, w in parts])
+        return predictions, np.argmax(predictions, axis=-1), predictions.max(axis=-1), heatmap
+
+    def predict(self, batch):
+        """Solo probabilidades."""
+        return self.run(batch)[0]
+
+    def embed(self, batch):
+        """Embedding (N, canales) calculado por el servidor."""
+        _, parts = self._call(b'E', batch)
+        return np.concatenate([out[:, :dim] for out, dim, _ in parts])
+
+    def warmup(self):
+        start = time.perf_counter()
+        self.run(np.zeros((1, TARGET_SIZE[1], TARGET_SIZE[0], 3), np.float32))
+        self.warmup_seconds = time.perf_counter() - start
+        self.warm = True
+
+    def stats(self):
+        # Sin reintentos de conexión: /health no debe esperar a que el servidor arranque
+        conn = self._connection(connect_timeout=0)
+        try:
+            conn['sock'].sendall(_REQUEST.pack(b'S', 0))
+            server = _recv_message(conn['sock'])
+        except (ConnectionError, OSError):
+            conn['sock'].close()
+            self._local.conn = None
+            raise
+        return {
+            'backend': 'remote',
+            'socket': self.socket_path,
+            'cam_method': server.get('cam_method'),
+            'warm': self.warm,
+            'warmup_seconds': self.warmup_seconds,
+            'server': server,
+        }
+
+
+def main():
+    # Con SIGTERM (uWSGI, Docker) se libera la memoria compartida y el socket
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    engine = load_engine(os.environ.get('MODEL_SERVER_BACKEND', 'keras'))
+    server = ModelServer(engine)
+    server.serve_forever()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
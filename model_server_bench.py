@@ -0,0 +1,145 @@
+"""
+Compara el modelo por worker (cada proceso carga el suyo) con el servidor de
+modelo compartido (model_server.py + INFERENCE_BACKEND=remote).
+
+Lanza --workers procesos con --threads hilos cada uno, como uWSGI, que
+envían peticiones de una imagen (igual que /predict) durante --seconds
+segundos. Reporta throughput total, latencia p50/p95 y la memoria (RSS y
+PSS) de todos los procesos, incluido el servidor.
+
+Uso:
+    python model_server_bench.py --workers 2 --threads 2 --seconds 30 --output server_bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from inference import TARGET_SIZE
+from model_server import MODEL_SERVER_SOCKET
+
+
+def process_memory(pid):
+    """(RSS, PSS) en bytes de un proceso, desde /proc/<pid>/smaps_rollup."""
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    values[key] = int(rest.split()[0]) * 1024
+    except OSError:
+        pass
+    return values.get('Rss'), values.get('Pss')
+
+
+def client(backend, threads, seconds, ready, start, results):
+    from inference import load_engine
+    engine = load_engine(backend)
+    ready.set()
+    start.wait()
+
+    latencies = []
+    lock = threading.Lock()
+    image = np.random.default_rng(0).uniform(0, 255, (1, TARGET_SIZE[1], TARGET_SIZE[0], 3)).astype(np.float32)
+    deadline = time.monotonic() + seconds
+
+    def loop():
+        own = []
+        while time.monotonic() < deadline:
+            t = time.perf_counter()
+            engine.run(image)
+            own.append(time.perf_counter() - t)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    rss, pss = process_memory(os.getpid())
+    results.put({'pid': os.getpid(), 'latencies': latencies, 'rss': rss, 'pss': pss})
+
+
+def run_layout(layout, workers, threads, seconds):
+    server = None
+    if layout == 'remote':
+        server = subprocess.Popen([sys.executable, 'model_server.py'])
+    backend = 'remote' if layout == 'remote' else os.environ.get('INFERENCE_BACKEND', 'keras')
+
+    # 'spawn': cada cliente arranca limpio, como un worker con lazy-apps
+    ctx = multiprocessing.get_context('spawn')
+    start = ctx.Event()
+    results = ctx.Queue()
+    readies, procs = [], []
+    for _ in range(workers):
+        ready = ctx.Event()
+        proc = ctx.Process(target=client, args=(backend, threads, seconds, ready, start, results))
+        proc.start()
+        readies.append(ready)
+        procs.append(proc)
+    for ready in readies:
+        ready.wait()
+
+    start.set()
+    reports = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    server_memory = (None, None)
+    if server is not None:
+        server_memory = process_memory(server.pid)
+        server.terminate()
+        server.wait()
+
+    latencies = np.concatenate([np.array(r['latencies']) for r in reports]) * 1000.0
+    total_rss = sum(r['rss'] or 0 for r in reports) + (server_memory[0] or 0)
+    total_pss = sum(r['pss'] or 0 for r in reports) + (server_memory[1] or 0)
+    return {
+        'layout': layout,
+        'workers': workers,
+        'threads': threads,
+        'requests': int(latencies.size),
+        'throughput_per_s': latencies.size / seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'rss_mb': total_rss / 2**20,
+        'pss_mb': total_pss / 2**20,
+        'server_rss_mb': server_memory[0] / 2**20 if server_memory[0] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Modelo por worker frente a servidor de modelo compartido')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--layouts', nargs='+', default=['local', 'remote'], choices=['local', 'remote'])
+    parser.add_argument('--output', default='server_bench.json')
+    args = parser.parse_args()
+
+    if 'remote' in args.layouts and os.path.exists(MODEL_SERVER_SOCKET):
+        print(f"⚠️ {MODEL_SERVER_SOCKET} ya existe: el servidor del benchmark lo reemplazará")
+
+    results = [run_layout(layout, args.workers, args.threads, args.seconds) for layout in args.layouts]
+
+    print(f"{'layout':<8} {'img/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8} {'PSS MB':>8}")
+    for r in results:
+        print(f"{r['layout']:<8} {r['throughput_per_s']:8.1f} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['rss_mb']:8.0f} {r['pss_mb']:8.0f}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
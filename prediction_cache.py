@@ -0,0 +1,187 @@
+"""
+Caché de predicciones por hash perceptual para /predict.
+
+Los kioscos suelen enviar el mismo frame varias veces (objeto quieto,
+reintentos). La búsqueda usa un dHash de 64 bits de la imagen ya
+redimensionada a TARGET_SIZE, pero con un fondo fijo dos objetos pequeños
+distintos pueden dar el mismo dHash: por eso cada acierto se confirma con el
+sha1 de los píxeles redimensionados y solo se sirve si el frame es idéntico.
+Con PRED_CACHE_MAX_DISTANCE > 0 se aceptan además frames cuyo dHash difiere en
+hasta esa cantidad de bits, sin confirmación (aproximado: puede devolver la
+predicción de otro objeto; desactivado por defecto). Las entradas viven en SQLite para que
+todos los workers de uWSGI compartan la caché, con expulsión LRU
+(PRED_CACHE_SIZE entradas) y caducidad (PRED_CACHE_TTL segundos).
+
+Desactivada por defecto: los frames de una cámara en vivo casi nunca se
+repiten byte a byte, así que solo compensa con clientes que reenvían el mismo
+frame. Solo se escribe al guardar una entrada nueva (o al completar su JPEG) y
+la expulsión se hace por lotes cada PRED_CACHE_EVICT_EVERY escrituras.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+# =====================================================================
+# CONFIGURACIÓN CACHÉ DE PREDICCIONES
+# =====================================================================
+PRED_CACHE_ENABLED = os.environ.get('PRED_CACHE_ENABLED', '0') == '1'
+PRED_CACHE_PATH = os.environ.get('PRED_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'binit_pred_cache.sqlite'))
+PRED_CACHE_SIZE = int(os.environ.get('PRED_CACHE_SIZE', 256))
+PRED_CACHE_TTL = float(os.environ.get('PRED_CACHE_TTL', 30))
+PRED_CACHE_MAX_DISTANCE = int(os.environ.get('PRED_CACHE_MAX_DISTANCE', 0))
+# Escrituras de cada proceso entre dos pasadas de expulsión
+PRED_CACHE_EVICT_EVERY = int(os.environ.get('PRED_CACHE_EVICT_EVERY', 32))
+# =====================================================================
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phash INTEGER NOT NULL,
+    digest BLOB NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    heatmap BLOB NOT NULL,
+    heatmap_rows INTEGER NOT NULL,
+    heatmap_cols INTEGER NOT NULL,
+    jpeg BLOB,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_phash ON predictions (phash);
+CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used);
+"""
+
+
+def perceptual_hash(img):
+    """dHash de 64 bits (como entero con signo, apto para SQLite) de una imagen RGB uint8."""
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = int(np.packbits(bits).view('>u8')[0])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def pixel_digest(img):
+    """sha1 de los píxeles de la imagen redimensionada: confirma que dos frames son idénticos."""
+    return hashlib.sha1(np.ascontiguousarray(img).tobytes()).digest()
+
+
+def hamming_distances(phash, others):
+    """Distancia de Hamming entre un hash y un array de hashes (int64)."""
+    xor = np.bitwise_xor(np.asarray(others, dtype=np.int64), np.int64(phash))
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class PredictionCache:
+    def __init__(self, path=PRED_CACHE_PATH, max_entries=PRED_CACHE_SIZE, ttl=PRED_CACHE_TTL,
+                 max_distance=PRED_CACHE_MAX_DISTANCE, evict_every=PRED_CACHE_EVICT_EVERY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.evict_every = max(1, evict_every)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _connection(self):
+        # Una conexión por hilo y proceso: las conexiones no sobreviven a un fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            columns = {r[1] for r in conn.execute('PRAGMA table_info(predictions)')}
+            if columns and 'digest' not in columns:
+                # Caché de una versión anterior sin sha1 de confirmación: se descarta
+                conn.execute('DROP TABLE predictions')
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, phash, digest):
+        """Entrada del mismo frame (o la más cercana dentro de la tolerancia), o None. Nunca lanza excepciones."""
+        try:
+            return self._lookup(phash, digest)
+        except sqlite3.Error as e:
+            print(f"⚠️ Caché de predicciones no disponible: {e}")
+            return None
+
+    def _lookup(self, phash, digest):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute('SELECT id FROM predictions WHERE phash = ? AND digest = ? AND created >= ? LIMIT 1',
+                           (phash, digest, now - self.ttl)).fetchone()
+        entry_id = row[0] if row else None
+        if entry_id is None and self.max_distance > 0:
+            rows = conn.execute('SELECT id, phash FROM predictions WHERE created >= ?',
+                                (now - self.ttl,)).fetchall()
+            entry_id = None
+            if rows:
+                distances = hamming_distances(phash, [r[1] for r in rows])
+                best = int(np.argmin(distances))
+                if distances[best] <= self.max_distance:
+                    entry_id = rows[best][0]
+        if entry_id is None:
+            return None
+
+        conn.execute('UPDATE predictions SET last_used = ? WHERE id = ?', (now, entry_id))
+        label, confidence, heatmap, rows_, cols, jpeg = conn.execute(
+            'SELECT label, confidence, heatmap, heatmap_rows, heatmap_cols, jpeg FROM predictions WHERE id = ?',
+            (entry_id,)).fetchone()
+        return {
+            'id': entry_id,
+            'label': label,
+            'confidence': confidence,
+            'heatmap': np.frombuffer(heatmap, np.uint8).reshape(rows_, cols).astype(np.float32) / 255.0,
+            'jpeg': jpeg,
+        }
+
+    def put(self, phash, digest, label, confidence, heatmap, jpeg=None):
+        """Guarda una predicción nueva; cada `evict_every` escrituras expulsa las caducadas o menos usadas."""
+        heatmap_uint8 = np.uint8(255 * np.asarray(heatmap))
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT INTO predictions (phash, digest, label, confidence, heatmap, heatmap_rows,'
+                ' heatmap_cols, jpeg, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (phash, digest, label, float(confidence), heatmap_uint8.tobytes(), heatmap_uint8.shape[0],
+                 heatmap_uint8.shape[1], jpeg, now, now))
+            if self._count_write():
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"⚠️ No se pudo guardar en la caché de predicciones: {e}")
+
+    def set_jpeg(self, entry_id, jpeg):
+        """Completa el JPEG de una entrada guardada sin él (modos 'grid' y 'bbox')."""
+        try:
+            self._connection().execute('UPDATE predictions SET jpeg = ? WHERE id = ? AND jpeg IS NULL',
+                                       (jpeg, entry_id))
+        except sqlite3.Error as e:
+            print(f"⚠️ No se pudo guardar en la caché de predicciones: {e}")
+
+    def _count_write(self):
+        with self._lock:
+            self._writes += 1
+            return self._writes % self.evict_every == 0
+
+    def _evict(self, conn, now):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM predictions WHERE created < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM predictions WHERE id NOT IN '
+                '(SELECT id FROM predictions ORDER BY last_used DESC LIMIT ?)', (self.max_entries,))
+            conn.execute('COMMIT')
+        except sqlite3.Error:
+            conn.execute('ROLLBACK')
+            raise
@@ -0,0 +1,105 @@
+"""
+Numeración de las muestras guardadas por /save_image.
+
+Cada clase tiene un contador persistente en SQLite; `next_number` lo
+incrementa dentro de una transacción `BEGIN IMMEDIATE`, de modo que dos
+workers de uWSGI nunca reciben el mismo número. La primera vez que se pide
+un número para una clase, el contador se inicializa con el mayor
+`CLASE_N.jpg` existente en su carpeta (migración única desde el esquema
+anterior basado en `os.listdir`).
+
+Uso (migración explícita, opcional):
+    python sample_counter.py training_data
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+
+# =====================================================================
+# CONFIGURACIÓN NUMERACIÓN DE MUESTRAS
+# =====================================================================
+TRAINING_DATA_DIR = os.environ.get('TRAINING_DATA_DIR', 'training_data')
+SAMPLE_COUNTER_DB = os.environ.get('SAMPLE_COUNTER_DB', os.path.join(TRAINING_DATA_DIR, '.counters.sqlite'))
+# =====================================================================
+
+_SCHEMA = 'CREATE TABLE IF NOT EXISTS counters (class_name TEXT PRIMARY KEY, last INTEGER NOT NULL)'
+
+
+def max_existing_number(class_dir, class_name):
+    """Mayor N de los archivos CLASE_N.jpg de una carpeta (0 si no hay)."""
+    pattern = re.compile(rf'^{re.escape(class_name)}_(\d+)\.jpg$')
+    max_num = 0
+    try:
+        entries = os.scandir(class_dir)
+    except FileNotFoundError:
+        return 0
+    with entries:
+        for entry in entries:
+            match = pattern.match(entry.name)
+            if match:
+                max_num = max(max_num, int(match.group(1)))
+    return max_num
+
+
+class SampleCounter:
+    def __init__(self, root=TRAINING_DATA_DIR, db_path=SAMPLE_COUNTER_DB):
+        self.root = root
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connection(self):
+        # Una conexión por hilo y proceso: las conexiones no sobreviven a un fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def next_number(self, class_name):
+        """Reserva y devuelve el siguiente número de la clase."""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT last FROM counters WHERE class_name = ?', (class_name,)).fetchone()
+            if row is None:
+                last = max_existing_number(os.path.join(self.root, class_name), class_name)
+                conn.execute('INSERT INTO counters (class_name, last) VALUES (?, ?)', (class_name, last + 1))
+            else:
+                last = row[0]
+                conn.execute('UPDATE counters SET last = ? WHERE class_name = ?', (last + 1, class_name))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return last + 1
+
+    def migrate(self):
+        """Inicializa los contadores de todas las carpetas que aún no tienen uno."""
+        conn = self._connection()
+        seeded = {}
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            known = {r[0] for r in conn.execute('SELECT class_name FROM counters')}
+            for entry in sorted(os.scandir(self.root), key=lambda e: e.name):
+                if entry.is_dir() and entry.name not in known:
+                    seeded[entry.name] = max_existing_number(entry.path, entry.name)
+                    conn.execute('INSERT INTO counters (class_name, last) VALUES (?, ?)',
+                                 (entry.name, seeded[entry.name]))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return seeded
+
+
+if __name__ == '__main__':
+    root = sys.argv[1] if len(sys.argv) > 1 else TRAINING_DATA_DIR
+    counter = SampleCounter(root, os.environ.get('SAMPLE_COUNTER_DB', os.path.join(root, '.counters.sqlite')))
+    for name, last in counter.migrate().items():
+        print(f"{name}: {last}")
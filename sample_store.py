@@ -0,0 +1,315 @@
+"""
+Almacén empaquetado de muestras de entrenamiento.
+
+Además del JPEG original en training_data/<CLASE>/, cada muestra de
+/save_image se añade a shards TFRecord de solo escritura al final, ya
+normalizada a TARGET_SIZE (JPEG calidad SAMPLE_STORE_QUALITY). Un manifiesto
+SQLite guarda etiqueta, fecha, shard y sha256 del contenido original; las
+muestras repetidas byte a byte se descartan.
+
+Todos los procesos añaden al mismo shard, que se cambia por uno nuevo al
+llegar a SAMPLE_STORE_SHARD_SIZE registros: reciclar workers no deja shards
+pequeños a medias. Los registros se escriben con el formato TFRecord dentro
+de la transacción del manifiesto, que serializa a los escritores, y la tabla
+`shards` guarda cuántos bytes de cada shard están confirmados; lo que quede
+detrás (un proceso muerto a mitad de escritura, un COMMIT fallido) se trunca
+en la siguiente escritura.
+
+`load_dataset` lee los shards directamente con `tf.data`.
+
+Uso:
+    python sample_store.py pack training_data     # empaqueta muestras existentes
+    python sample_store.py stats
+"""
+import argparse
+import atexit
+import glob
+import hashlib
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import uuid
+
+import cv2
+import tensorflow as tf
+
+from decoding import decode_encoded, DecodeError
+from inference import CLASS_NAMES, TARGET_SIZE
+
+
+# =====================================================================
+# CONFIGURACIÓN ALMACÉN DE MUESTRAS
+# =====================================================================
+SAMPLE_STORE_ENABLED = os.environ.get('SAMPLE_STORE_ENABLED', '1') == '1'
+SAMPLE_STORE_DIR = os.environ.get('SAMPLE_STORE_DIR', 'training_records')
+SAMPLE_STORE_SHARD_SIZE = int(os.environ.get('SAMPLE_STORE_SHARD_SIZE', 1000))
+SAMPLE_STORE_QUALITY = int(os.environ.get('SAMPLE_STORE_QUALITY', 95))
+# =====================================================================
+
+MANIFEST_NAME = 'manifest.sqlite'
+SHARD_PATTERN = 'shard-*.tfrecord'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    sha256 TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    shard TEXT NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_label ON samples (label);
+CREATE TABLE IF NOT EXISTS shards (
+    name TEXT PRIMARY KEY,
+    records INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+"""
+
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data):
+    """CRC-32C (Castagnoli), el checksum de los registros TFRecord."""
+    crc = 0xFFFFFFFF
+    table = _CRC32C_TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def _masked_crc(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def tfrecord(serialized):
+    """Registro TFRecord: longitud, CRC de la longitud, datos y CRC de los datos."""
+    length = struct.pack('<Q', len(serialized))
+    return (length + struct.pack('<I', _masked_crc(length)) + serialized +
+            struct.pack('<I', _masked_crc(serialized)))
+
+
+def _bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+
+
+def _int64_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+
+def _float_feature(value):
+    return tf.train.Feature(float_list=tf.train.FloatList(value=[value]))
+
+
+def normalize_jpeg(data, target_size=TARGET_SIZE, quality=SAMPLE_STORE_QUALITY):
+    """Imagen a JPEG RGB de TARGET_SIZE, con la misma decodificación que /predict."""
+    img = decode_encoded(data, target_size)
+    _, buffer = cv2.imencode('.jpg', cv2.cvtColor(img, cv2.COLOR_RGB2BGR),
+                             [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+
+class SampleStore:
+    def __init__(self, directory=SAMPLE_STORE_DIR, shard_size=SAMPLE_STORE_SHARD_SIZE):
+        self.directory = directory
+        self.shard_size = shard_size
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        atexit.register(self.close)
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            # Tras un fork no se reutiliza la conexión del padre
+            os.makedirs(self.directory, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.directory, MANIFEST_NAME), timeout=30,
+                                         isolation_level=None, check_same_thread=False)
+            self._conn.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _current_shard(self, conn):
+        """
+        Shard abierto (nombre, bytes confirmados) o uno nuevo si está lleno o su
+        archivo perdió datos. Debe llamarse dentro de la transacción del manifiesto.
+        """
+        row = conn.execute('SELECT name, records, bytes FROM shards ORDER BY rowid DESC LIMIT 1').fetchone()
+        if row is not None and row[1] < self.shard_size:
+            try:
+                if os.path.getsize(os.path.join(self.directory, row[0])) >= row[2]:
+                    return row[0], row[2]
+            except OSError:
+                pass
+        name = f"shard-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.tfrecord"
+        conn.execute('INSERT INTO shards (name, records, bytes) VALUES (?, 0, 0)', (name,))
+        return name, 0
+
+    def append(self, data, label, source=None, timestamp=None):
+        """
+        Añade la muestra si su contenido no está ya en el manifiesto.
+        Devuelve True si se añadió y False si era un duplicado.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            conn = self._connection()
+            if conn.execute('SELECT 1 FROM samples WHERE sha256 = ?', (digest,)).fetchone():
+                return False
+            example = tf.train.Example(features=tf.train.Features(feature={
+                'image': _bytes_feature(normalize_jpeg(data)),
+                'label': _bytes_feature(label.encode()),
+                'label_index': _int64_feature(CLASS_NAMES.index(label) if label in CLASS_NAMES else -1),
+                'sha256': _bytes_feature(digest.encode()),
+                'timestamp': _float_feature(timestamp),
+            }))
+            record = tfrecord(example.SerializeToString())
+            # El manifiesto serializa a todos los procesos: comprobar, escribir y registrar
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('SELECT 1 FROM samples WHERE sha256 = ?', (digest,)).fetchone():
+                    conn.execute('ROLLBACK')
+                    return False
+                shard, size = self._current_shard(conn)
+                with open(os.path.join(self.directory, shard), 'ab') as f:
+                    # Descarta lo escrito sin confirmar por una escritura anterior interrumpida
+                    f.truncate(size)
+                    f.write(record)
+                    f.flush()
+                conn.execute('UPDATE shards SET records = records + 1, bytes = ? WHERE name = ?',
+                             (size + len(record), shard))
+                conn.execute('INSERT INTO samples (sha256, label, timestamp, shard, source) VALUES (?, ?, ?, ?, ?)',
+                             (digest, label, timestamp, shard, source))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return True
+
+    def stats(self):
+        conn = self._connection()
+        return {
+            'samples': conn.execute('SELECT COUNT(*) FROM samples').fetchone()[0],
+            'shards': len(glob.glob(os.path.join(self.directory, SHARD_PATTERN))),
+            'per_label': dict(conn.execute('SELECT label, COUNT(*) FROM samples GROUP BY label ORDER BY label')),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+
+def parse_example(serialized, target_size=TARGET_SIZE):
+    """Registro TFRecord a (imagen float32 alto x ancho x 3, índice de clase)."""
+    features = tf.io.parse_single_example(serialized, {
+        'image': tf.io.FixedLenFeature([], tf.string),
+        'label_index': tf.io.FixedLenFeature([], tf.int64),
+    })
+    image = tf.io.decode_jpeg(features['image'], channels=3)
+    image.set_shape([target_size[1], target_size[0], 3])
+    return tf.cast(image, tf.float32), features['label_index']
+
+
+def manifest_keys(directory=SAMPLE_STORE_DIR):
+    """'<shard>:<sha256>' de cada muestra registrada en el manifiesto."""
+    conn = sqlite3.connect(os.path.join(directory, MANIFEST_NAME), timeout=30)
+    try:
+        return [f'{shard}:{digest}' for digest, shard in conn.execute('SELECT sha256, shard FROM samples')]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+
+def load_dataset(directory=SAMPLE_STORE_DIR, batch_size=32, shuffle_buffer=0):
+    """
+    `tf.data.Dataset` de (imágenes, índices de clase) leyendo todos los shards
+    en paralelo. Solo se leen los registros que el manifiesto asigna a ese
+    shard: un registro incompleto al final de un shard (proceso interrumpido)
+    o sin fila en el manifiesto (COMMIT fallido) se descarta. Sin shards
+    devuelve un dataset vacío.
+    """
+    # tf.string explícito: una lista vacía daría un tensor float32 y TFRecordDataset fallaría
+    files = tf.constant(sorted(glob.glob(os.path.join(directory, SHARD_PATTERN))), tf.string)
+    keys = manifest_keys(directory)
+    # La tabla no puede estar vacía: sin muestras, una clave que no coincide con nada
+    values = [1] * len(keys) if keys else [0]
+    manifest = tf.lookup.StaticHashTable(
+        tf.lookup.KeyValueTensorInitializer(tf.constant(keys or [''], tf.string), tf.constant(values, tf.int64)),
+        default_value=0)
+
+    def records(path):
+        shard = tf.strings.regex_replace(path, r'^.*/', '')
+        return tf.data.TFRecordDataset(path).map(lambda serialized: (shard, serialized))
+
+    def registered(shard, serialized):
+        digest = tf.io.parse_single_example(
+            serialized, {'sha256': tf.io.FixedLenFeature([], tf.string)})['sha256']
+        return manifest.lookup(tf.strings.join([shard, digest], ':')) > 0
+
+    dataset = tf.data.Dataset.from_tensor_slices(files).interleave(
+        records, cycle_length=tf.data.AUTOTUNE, num_parallel_calls=tf.data.AUTOTUNE)
+    dataset = dataset.apply(tf.data.experimental.ignore_errors())
+    dataset = dataset.filter(registered)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer)
+    dataset = dataset.map(lambda shard, serialized: parse_example(serialized),
+                          num_parallel_calls=tf.data.AUTOTUNE)
+    if batch_size:
+        dataset = dataset.batch(batch_size)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Almacén empaquetado de muestras de entrenamiento')
+    parser.add_argument('--dir', default=SAMPLE_STORE_DIR)
+    sub = parser.add_subparsers(dest='command', required=True)
+    pack = sub.add_parser('pack', help='Añade las imágenes de training_data/<CLASE>/')
+    pack.add_argument('data', nargs='?', default='training_data')
+    sub.add_parser('stats', help='Muestras por clase y número de shards')
+    args = parser.parse_args()
+
+    store = SampleStore(args.dir)
+    if args.command == 'pack':
+        added = skipped = failed = 0
+        for label in sorted(os.listdir(args.data)):
+            class_dir = os.path.join(args.data, label)
+            if not os.path.isdir(class_dir):
+                continue
+            for name in sorted(os.listdir(class_dir)):
+                if not name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    continue
+                path = os.path.join(class_dir, name)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                try:
+                    if store.append(data, label.upper(), source=path, timestamp=os.path.getmtime(path)):
+                        added += 1
+                    else:
+                        skipped += 1
+                except DecodeError as e:
+                    failed += 1
+                    print(f"⚠️ {path}: {e}")
+        store.close()
+        print(f"✅ {added} muestras añadidas, {skipped} duplicadas, {failed} con error")
+    print(store.stats())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
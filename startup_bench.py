@@ -0,0 +1,108 @@
+"""
+Mide el arranque de los workers en modo lazy (cada worker importa la app,
+como con lazy-apps = true) y preload (la app se importa una vez y los workers
+se crean por fork, como con uwsgi-preload.ini).
+
+Cada modo se ejecuta en un intérprete nuevo que hace de master: lanza
+--workers procesos con os.fork() a la vez, cada uno carga y precalienta el
+modelo, y se reporta el tiempo desde el fork hasta estar listo, RSS y PSS
+(memoria proporcional: las páginas compartidas se reparten entre procesos).
+
+Uso:
+    python startup_bench.py --workers 2 --output startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import types
+
+
+def run_mode(mode, workers):
+    """Hace de master de uWSGI en el modo indicado; devuelve el arranque de cada worker."""
+    master_import = None
+    if mode == 'preload':
+        os.environ['BINIT_PRELOAD'] = '1'
+        # Fuera de uWSGI no hay postfork: se registra sin ejecutar y cada hijo
+        # llama a init_worker, igual que haría uWSGI tras el fork
+        sys.modules['uwsgidecorators'] = types.SimpleNamespace(postfork=lambda f: f)
+        start = time.perf_counter()
+        import app
+        master_import = time.perf_counter() - start
+    else:
+        os.environ['BINIT_PRELOAD'] = '0'
+
+    children = []
+    for _ in range(workers):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            if mode == 'preload':
+                app.init_worker()
+            else:
+                import app
+            os.write(w, json.dumps(app.startup).encode())
+            os._exit(0)
+        os.close(w)
+        children.append((pid, r))
+
+    reports = []
+    for pid, r in children:
+        with os.fdopen(r) as f:
+            reports.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    return {'mode': mode, 'master_import_seconds': master_import, 'workers': reports}
+
+
+def summarize(result):
+    workers = result['workers']
+
+    def mean(key):
+        values = [w[key] for w in workers if w.get(key) is not None]
+        return sum(values) / len(values) if values else None
+
+    return {
+        'ready_seconds': mean('ready_seconds'),
+        'load_seconds': mean('load_seconds'),
+        'rss_mb': mean('rss_bytes') / 2**20,
+        'pss_mb': mean('pss_bytes') / 2**20 if mean('pss_bytes') else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempo y memoria de arranque de workers: lazy vs preload')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--modes', nargs='+', default=['lazy', 'preload'], choices=['lazy', 'preload'])
+    parser.add_argument('--output', default='startup.json')
+    parser.add_argument('--run-mode', choices=['lazy', 'preload'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args.workers)))
+        return 0
+
+    results = []
+    for mode in args.modes:
+        out = subprocess.run([sys.executable, __file__, '--run-mode', mode, '--workers', str(args.workers)],
+                             capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        result['summary'] = summarize(result)
+        results.append(result)
+
+    print(f"{'modo':<8} {'listo (s)':>10} {'modelo (s)':>11} {'RSS (MB)':>9} {'PSS (MB)':>9}")
+    for result in results:
+        s = result['summary']
+        pss = f"{s['pss_mb']:9.0f}" if s['pss_mb'] is not None else f"{'n/d':>9}"
+        print(f"{result['mode']:<8} {s['ready_seconds'] or 0:10.1f} {s['load_seconds']:11.1f} {s['rss_mb']:9.0f} {pss}")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -271,7 +271,7 @@ document.addEventListener("DOMContentLoaded", () => {
         // Encontrar el nombre del idioma para el backend
         const languageName = lang.displayName;
         
-        // Llamar al endpoint de generación
+        // Encolar la generación: el servidor responde con el id del trabajo
         const response = await fetch('/binit/voice', {
           method: 'POST',
           headers: {
@@ -286,7 +286,11 @@ document.addEventListener("DOMContentLoaded", () => {
           throw new Error(`Error en generación: ${response.status}`);
         }
 
-        const result = await response.json();
+        const job = await response.json();
+        const result = await this.waitForVoiceJob(job, progressText);
+        if (result.status !== 'done') {
+          throw new Error(`Trabajo ${result.status}: ${result.error || ''}`);
+        }
         progressText.textContent = 'Audios generados exitosamente';
         
         // Pequeño delay para mostrar el mensaje de éxito antes de ocultar
@@ -307,6 +311,27 @@ document.addEventListener("DOMContentLoaded", () => {
       }
     }
 
+    async waitForVoiceJob(job, progressText) {
+      // Consultar el estado del trabajo hasta que termine, mostrando el progreso por archivo
+      const statusUrl = job.status_url || `/binit/voice/jobs/${job.job_id}`;
+      let state = job;
+      while (state.status === 'queued' || state.status === 'running') {
+        if (state.status === 'queued') {
+          progressText.textContent = 'En cola para generar audios...';
+        } else {
+          const { done, errors, total } = state.progress;
+          progressText.textContent = `Generando audios... ${done + errors}/${total}`;
+        }
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const response = await fetch(statusUrl);
+        if (!response.ok) {
+          throw new Error(`Error consultando el trabajo: ${response.status}`);
+        }
+        state = await response.json();
+      }
+      return state;
+    }
+
     reproduceAudio(langCode) {
       // No reproducir audio si el overlay está activo
       if (!canPerformTransitions()) {
@@ -530,7 +555,7 @@ document.addEventListener("DOMContentLoaded", () => {
     // }
 
     sendCanvas.toBlob((blob) => {
-      fetch("/binit/predict", {
+      fetch("/binit/predict?mode=url", {
         method: "POST",
         body: blob,
       })
@@ -547,7 +572,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
             const gradcamImage = document.getElementById("gradcamImage");
             if (gradcamImage) {
-              gradcamImage.src = `data:image/jpeg;base64,${data.gradcam}`;
+              gradcamImage.src = data.gradcam_url;
             }
 
             currentPredictionLabel = data.label;
@@ -0,0 +1,123 @@
+"""
+Memoria de traducción persistente para /voice.
+
+Cada traducción se guarda en SQLite con clave (clave de la frase, idioma
+origen, idioma destino) junto con el texto origen del que salió. La clave
+de la frase es el nombre del audio (p. ej. 'Bienvenida.mp3') o el propio
+texto; si el texto en español de una clave cambia, la entrada guardada ya
+no coincide y se vuelve a traducir (y se sobrescribe).
+
+Uso (ver o vaciar la memoria):
+    python translation_memory.py stats
+    python translation_memory.py clear [IDIOMA_DESTINO]
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+
+# =====================================================================
+# CONFIGURACIÓN MEMORIA DE TRADUCCIÓN
+# =====================================================================
+TRANSLATION_MEMORY_ENABLED = os.environ.get('TRANSLATION_MEMORY_ENABLED', '1') == '1'
+TRANSLATION_MEMORY_PATH = os.environ.get('TRANSLATION_MEMORY_PATH', 'translations.sqlite')
+# =====================================================================
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS translations (
+    key TEXT NOT NULL,
+    source_lang TEXT NOT NULL,
+    target_lang TEXT NOT NULL,
+    source_text TEXT NOT NULL,
+    translated TEXT NOT NULL,
+    translator TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (key, source_lang, target_lang)
+)
+'''
+
+
+class TranslationMemory:
+    def __init__(self, db_path=TRANSLATION_MEMORY_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connection(self):
+        # Una conexión por hilo y proceso: las conexiones no sobreviven a un fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(_SCHEMA)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, entries, source_lang, target_lang):
+        """
+        Traducciones guardadas de `entries` ({clave: texto origen}). Solo
+        devuelve las claves cuyo texto origen sigue siendo el mismo.
+        """
+        conn = self._connection()
+        found = {}
+        keys = list(entries)
+        # Límite de variables de SQLite
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = conn.execute(
+                f'SELECT key, source_text, translated FROM translations '
+                f'WHERE source_lang = ? AND target_lang = ? AND key IN ({",".join("?" * len(chunk))})',
+                [source_lang, target_lang] + chunk)
+            for key, source_text, translated in rows:
+                if entries[key] == source_text:
+                    found[key] = translated
+        return found
+
+    def store(self, translations, source_lang, target_lang, translator=''):
+        """Guarda {clave: (texto origen, traducción)}, sustituyendo lo anterior."""
+        if not translations:
+            return
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO translations '
+                '(key, source_lang, target_lang, source_text, translated, translator, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(key, source_lang, target_lang, source, translated, translator, now)
+                 for key, (source, translated) in translations.items()])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def clear(self, target_lang=None):
+        conn = self._connection()
+        if target_lang:
+            cur = conn.execute('DELETE FROM translations WHERE target_lang = ?', (target_lang,))
+        else:
+            cur = conn.execute('DELETE FROM translations')
+        return cur.rowcount
+
+    def stats(self):
+        conn = self._connection()
+        return {f'{source}->{target}': count for source, target, count in conn.execute(
+            'SELECT source_lang, target_lang, COUNT(*) FROM translations '
+            'GROUP BY source_lang, target_lang ORDER BY target_lang')}
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    memory = TranslationMemory()
+    if command == 'stats':
+        for pair, count in memory.stats().items():
+            print(f"{pair}: {count}")
+    elif command == 'clear':
+        print(f"{memory.clear(sys.argv[2].upper() if len(sys.argv) > 2 else None)} traducciones eliminadas")
+    else:
+        print(__doc__)
+        sys.exit(2)
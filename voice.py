@@ -1,6 +1,10 @@
+import gc
 import os
+import threading
+import time
 import logging
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from dotenv import load_dotenv
 from flask import jsonify
 
@@ -11,18 +15,177 @@ try:
 except ImportError:
     pass  # Patch file not found, continue without patch
 
+from translation_memory import TranslationMemory, TRANSLATION_MEMORY_ENABLED
+from conditioning_cache import ConditioningCache, conditioning_cache, xtts_model, synthesize_with_latents, \
+    CONDITIONING_CACHE_ENABLED
+
 load_dotenv()
 COQUI_TTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
 # Base path para archivos de voz de referencia en español
 VOICE_REFERENCE_BASE_PATH = "static/audios/es/"
 OUTPATH_FILE_START = "static/audios/"
 
+# =====================================================================
+# CONFIGURACIÓN TRADUCCIÓN
+# =====================================================================
+# 'deepl' o 'stub' (traducción local ficticia, para probar sin red ni API key)
+TRANSLATOR = os.environ.get('TRANSLATOR', 'deepl').lower()
+# Frases por petición a la API de DeepL (máximo de la API: 50)
+DEEPL_BATCH_SIZE = int(os.environ.get('DEEPL_BATCH_SIZE', 50))
+# =====================================================================
+
+# =====================================================================
+# CONFIGURACIÓN REGISTRO DE MODELOS TTS
+# =====================================================================
+# Segundos sin uso tras los que se descarga el modelo para liberar RAM (0 = nunca)
+TTS_IDLE_TIMEOUT = float(os.environ.get('TTS_IDLE_TIMEOUT', 900))
+TTS_USE_GPU = os.environ.get('TTS_USE_GPU', '0') == '1'
+# =====================================================================
+
+
+class TTSModelRegistry:
+    """
+    Modelos Coqui TTS compartidos por todo el proceso.
+
+    Cada modelo se carga una sola vez y se comparte entre peticiones; un lock
+    por modelo serializa la síntesis (la instancia de TTS no es segura entre
+    hilos). Un hilo de limpieza, recreado tras un fork como los de
+    batching.py, descarga los modelos que llevan TTS_IDLE_TIMEOUT segundos
+    sin usarse.
+    """
+    def __init__(self, idle_timeout=TTS_IDLE_TIMEOUT, gpu=TTS_USE_GPU):
+        self.idle_timeout = idle_timeout
+        self.gpu = gpu
+        self._lock = threading.Lock()
+        self._models = {}
+        self._reaper = None
+        self._pid = None
+
+    def _entry(self, modelName):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Lo heredado del padre (locks incluidos) no es válido en el hijo
+                self._models = {}
+                self._reaper = None
+                self._pid = os.getpid()
+            entry = self._models.get(modelName)
+            if entry is None:
+                entry = self._models[modelName] = {
+                    'lock': threading.Lock(), 'instance': None, 'loads': 0, 'evictions': 0,
+                    'load_seconds': None, 'loaded_at': None, 'last_used': None, 'in_use': False}
+            return entry
+
+    def _load(self, modelName, entry):
+        from TTS.api import TTS as CoquiTTSLib
+        logging.info(f"Coqui TTS: {modelName}...")
+        start = time.perf_counter()
+        entry['instance'] = CoquiTTSLib(model_name=modelName, progress_bar=True, gpu=self.gpu)
+        entry['load_seconds'] = time.perf_counter() - start
+        entry['loaded_at'] = time.time()
+        entry['loads'] += 1
+        logging.info(f"Coqui TTS OK! ({entry['load_seconds']:.1f} s)")
+
+    @contextmanager
+    def acquire(self, modelName=COQUI_TTS_MODEL_NAME):
+        """Uso exclusivo del modelo mientras dura el bloque; lo carga si no está en memoria."""
+        entry = self._entry(modelName)
+        with entry['lock']:
+            if entry['instance'] is None:
+                self._load(modelName, entry)
+            entry['in_use'] = True
+            self._ensure_reaper()
+            try:
+                yield entry['instance']
+            finally:
+                entry['in_use'] = False
+                entry['last_used'] = time.time()
+
+    def preload(self, modelName=COQUI_TTS_MODEL_NAME):
+        with self.acquire(modelName):
+            pass
+
+    def evict(self, modelName=COQUI_TTS_MODEL_NAME):
+        """Descarga el modelo si no se está usando. Devuelve True si se descargó."""
+        entry = self._entry(modelName)
+        if not entry['lock'].acquire(blocking=False):
+            return False
+        try:
+            if entry['instance'] is None:
+                return False
+            entry['instance'] = None
+            entry['evictions'] += 1
+        finally:
+            entry['lock'].release()
+        gc.collect()
+        _release_freed_memory()
+        logging.info(f"Coqui TTS descargado por inactividad: {modelName}")
+        return True
+
+    def _ensure_reaper(self):
+        if self.idle_timeout <= 0:
+            return
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_loop, name='binit-tts-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, min(60.0, self.idle_timeout / 4)))
+            now = time.time()
+            with self._lock:
+                idle = [name for name, e in self._models.items()
+                        if e['instance'] is not None and not e['in_use']
+                        and e['last_used'] is not None and now - e['last_used'] >= self.idle_timeout]
+            for name in idle:
+                self.evict(name)
+
+    def stats(self):
+        """Tiempo de carga y residencia de cada modelo en este proceso."""
+        now = time.time()
+        with self._lock:
+            models = dict(self._models) if self._pid == os.getpid() else {}
+        result = {}
+        for name, e in models.items():
+            loaded = e['instance'] is not None
+            result[name] = {
+                'loaded': loaded,
+                'in_use': e['in_use'],
+                'loads': e['loads'],
+                'evictions': e['evictions'],
+                'load_seconds': e['load_seconds'],
+                'resident_seconds': now - e['loaded_at'] if loaded else None,
+                'idle_seconds': now - e['last_used'] if loaded and e['last_used'] and not e['in_use'] else None,
+            }
+        return {'idle_timeout': self.idle_timeout, 'models': result}
+
+
+def _release_freed_memory():
+    """Devuelve al sistema la memoria liberada por glibc (si está disponible)."""
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+tts_registry = TTSModelRegistry()
+
 class ITranslator(ABC):
     @abstractmethod
     def translate(self, text: str, targetLangCode: str, sourceLangCode: str = "es") -> str | None:
         """Traduce texto de un idioma fuente a un idioma destino."""
         pass
 
+    def translate_batch(self, texts: list, targetLangCode: str, sourceLangCode: str = "es",
+                        keys: list = None) -> list:
+        """
+        Traduce varias frases; devuelve una lista alineada con `texts` (None si falla).
+        `keys` identifica cada frase de forma estable (p. ej. el nombre del audio).
+        """
+        return [self.translate(text, targetLangCode, sourceLangCode) for text in texts]
+
 class ITextToSpeech(ABC):
     @abstractmethod
     def synthesize(self, text: str, langCode: str, refAudioPath: str, outputPath: str) -> bool:
@@ -72,43 +235,121 @@ class DeepLTranslationService(ITranslator):
             logging.error(f"Error durante la traducción con DeepL: {e}")
             return None
 
+    def translate_batch(self, texts: list, targetLangCode: str, sourceLangCode: str = "es",
+                        keys: list = None) -> list:
+        """
+        Traduce todas las frases con una petición a la API de DeepL por cada
+        DEEPL_BATCH_SIZE frases (deep-translator hace una petición por frase).
+        """
+        import requests
+
+        target = targetLangCode.upper()
+        # Códigos de destino que la API ya no acepta sin variante
+        target = {"ZH-CN": "ZH", "EN": "EN-US", "PT": "PT-PT"}.get(target, target)
+        host = "api-free.deepl.com" if self.apiKey.endswith(":fx") else "api.deepl.com"
+        results = []
+        for i in range(0, len(texts), DEEPL_BATCH_SIZE):
+            chunk = texts[i:i + DEEPL_BATCH_SIZE]
+            logging.info(f"Traduciendo {len(chunk)} frases -> '{target}'...")
+            try:
+                response = requests.post(
+                    f"https://{host}/v2/translate",
+                    headers={"Authorization": f"DeepL-Auth-Key {self.apiKey}"},
+                    data={"text": chunk, "target_lang": target, "source_lang": sourceLangCode.upper()},
+                    timeout=60,
+                )
+                response.raise_for_status()
+                translated = [t.get("text") or None for t in response.json()["translations"]]
+                if len(translated) != len(chunk):
+                    raise ValueError(f"{len(translated)} traducciones para {len(chunk)} frases")
+                results.extend(translated)
+            except Exception as e:
+                logging.error(f"Error durante la traducción con DeepL: {e}")
+                results.extend([None] * len(chunk))
+        return results
+
+class StubTranslationService(ITranslator):
+    """
+    Traductor local sin red: devuelve el texto marcado con el idioma destino.
+    Permite probar /voice y la memoria de traducción sin API key (TRANSLATOR=stub).
+    """
+    def __init__(self, apiKey: str = None):
+        self.calls = 0
+
+    def translate(self, text: str, targetLangCode: str, sourceLangCode: str = "es") -> str | None:
+        self.calls += 1
+        return f"[{targetLangCode.upper()}] {text}" if text else None
+
+class MemoizedTranslationService(ITranslator):
+    """
+    Consulta la memoria de traducción (SQLite) antes que el traductor real;
+    las frases que faltan se traducen juntas en un solo translate_batch.
+    """
+    def __init__(self, translator: ITranslator, memory: TranslationMemory = None):
+        self.translator = translator
+        self.memory = memory or TranslationMemory()
+        self.name = type(translator).__name__
+        self.hits = 0
+        self.misses = 0
+
+    def translate(self, text: str, targetLangCode: str, sourceLangCode: str = "es") -> str | None:
+        return self.translate_batch([text], targetLangCode, sourceLangCode)[0]
+
+    def translate_batch(self, texts: list, targetLangCode: str, sourceLangCode: str = "es",
+                        keys: list = None) -> list:
+        keys = list(keys) if keys is not None else list(texts)
+        source, target = sourceLangCode.upper(), targetLangCode.upper()
+        entries = dict(zip(keys, texts))
+        found = self.memory.lookup(entries, source, target)
+
+        missing = [key for key in entries if key not in found]
+        self.hits += len(entries) - len(missing)
+        self.misses += len(missing)
+        logging.info(f"Memoria de traducción {target}: {len(entries) - len(missing)} en caché, "
+                     f"{len(missing)} a traducir")
+        if missing:
+            translated = self.translator.translate_batch(
+                [entries[key] for key in missing], targetLangCode, sourceLangCode, missing)
+            new = {key: (entries[key], text) for key, text in zip(missing, translated) if text}
+            self.memory.store(new, source, target, self.name)
+            found.update((key, text) for key, (_, text) in new.items())
+        return [found.get(key) for key in keys]
+
+def create_translator(kind: str = None) -> ITranslator:
+    """Traductor configurado (TRANSLATOR), detrás de la memoria de traducción si está activa."""
+    kind = (kind or TRANSLATOR).lower()
+    if kind == "stub":
+        translator = StubTranslationService()
+    elif kind == "deepl":
+        translator = DeepLTranslationService(apiKey=os.getenv("DEEPL_API_KEY"))
+    else:
+        raise ValueError(f"TRANSLATOR no válido: {kind}")
+    return MemoizedTranslationService(translator) if TRANSLATION_MEMORY_ENABLED else translator
+
 class CoquiTextToSpeechService(ITextToSpeech):
     """
     Servicio de síntesis de voz que utiliza Coqui TTS.
     Cumple con SRP: su única responsabilidad es generar audio a partir de texto.
     """
-    def __init__(self, modelName: str = COQUI_TTS_MODEL_NAME):
+    def __init__(self, modelName: str = COQUI_TTS_MODEL_NAME, registry: TTSModelRegistry = None,
+                 conditioningCache: ConditioningCache = None):
         self.modelName = modelName
-        self.ttsInstance = None
+        # El modelo vive en el registro del proceso: crear el servicio no lo carga
+        self.registry = registry or tts_registry
+        # Latentes de las voces de referencia (None desactiva la caché)
+        self.conditioningCache = conditioningCache or (conditioning_cache if CONDITIONING_CACHE_ENABLED else None)
         # Intentar importar 'TTS' aquí.
         try:
-            from TTS.api import TTS as CoquiTTSLib
-            self._coquiTtsLib = CoquiTTSLib
+            import TTS.api  # noqa: F401
         except ImportError:
             logging.error("Missing dependency 'TTS'! ")
             raise
-        self._initializeTts()
-
-    def _initializeTts(self):
-        """Inicializa la instancia de Coqui TTS."""
-        try:
-            logging.info(f"Coqui TTS: {self.modelName}...")
-            self.ttsInstance = self._coquiTtsLib(model_name=self.modelName, progress_bar=True, gpu=False)
-            logging.info("Coqui TTS OK!")
-        except Exception as e:
-            logging.error(f"No se pudo cargar el modelo Coqui TTS ({self.modelName}): {e}")
-            self.ttsInstance = None
-
 
     def synthesize(self, text: str, langCode: str, refAudioPath: str, outputPath: str) -> bool:
         """
         Genera un archivo de audio a partir del texto usando una voz de referencia.
         langCode debe ser el código que Coqui TTS entiende (ej. 'en', 'es', 'fr', 'zh-cn').
         """
-        if not self.ttsInstance:
-            logging.error("Synthesize -> Missing model TTS")
-            return False
-
         logging.info(f"Synthesize -> Audio en '{langCode}'...")
         logging.info(f"Synthesize -> Texto: {text[:100]}...")
         logging.info(f"Synthesize -> Referencia: {refAudioPath}")
@@ -119,12 +360,18 @@ class CoquiTextToSpeechService(ITextToSpeech):
             return False
 
         try:
-            self.ttsInstance.tts_to_file(
-                text=text,
-                speaker_wav=refAudioPath,
-                language=langCode,
-                file_path=outputPath
-            )
+            with self.registry.acquire(self.modelName) as ttsInstance:
+                model = xtts_model(ttsInstance) if self.conditioningCache else None
+                if model is not None:
+                    latents = self.conditioningCache.get(model, self.modelName, refAudioPath)
+                    synthesize_with_latents(ttsInstance, latents, text, langCode, outputPath)
+                else:
+                    ttsInstance.tts_to_file(
+                        text=text,
+                        speaker_wav=refAudioPath,
+                        language=langCode,
+                        file_path=outputPath
+                    )
             logging.info(f"Synthesize OK -> {outputPath}")
             return True
         except Exception as e:
@@ -431,7 +678,7 @@ def getNewLangAudio(text, lang, logger=None):
     filenameOutput = f"{OUTPATH_FILE_START}{lang}/{filename}"
 
     try:
-        translator = DeepLTranslationService(apiKey=os.getenv("DEEPL_API_KEY"))
+        translator = create_translator()
         tts_synthesizer = CoquiTextToSpeechService(modelName=COQUI_TTS_MODEL_NAME)
     except Exception as e:
         logger.error(f"Servicios: {e}")
@@ -476,13 +723,25 @@ def get_audio_text_mapping():
         'Otro.mp3': 'Otro'
     }
 
-def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
+def generate_all_audios_for_language(targetLangName: str, logger=None, on_stage=None,
+                                     on_file=None, should_cancel=None) -> dict:
     """
     Genera todos los audios necesarios para un idioma específico
-    usando voces de referencia dinámicas
+    usando voces de referencia dinámicas.
+    `on_stage(etapa, segundos)` recibe la duración de cada etapa (init, load, translate, synthesize).
+    `on_file(archivo, error, segundos)` se llama al terminar cada audio (error None si se generó)
+    y `should_cancel()` se consulta antes de cada uno para detener la generación.
     """
     if logger is None:
         logger = logging.getLogger(__name__)
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if on_stage:
+                on_stage(stage, time.perf_counter() - start)
         
     if not targetLangName in list(get_supported_languages_map().keys()):
         logger.error(f'Idioma no soportado: {targetLangName}')
@@ -504,8 +763,10 @@ def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
     
     # Inicializar servicios
     try:
-        translator = DeepLTranslationService(apiKey=os.getenv("DEEPL_API_KEY"))
-        tts_synthesizer = CoquiTextToSpeechService(modelName=COQUI_TTS_MODEL_NAME)
+        translator = timed('init', create_translator)
+        tts_synthesizer = timed('init', CoquiTextToSpeechService, COQUI_TTS_MODEL_NAME)
+        # Solo la primera llamada del proceso (o tras una descarga por inactividad) carga el modelo
+        timed('load', tts_synthesizer.registry.preload, COQUI_TTS_MODEL_NAME)
     except Exception as e:
         logger.error(f"Error inicializando servicios: {e}")
         return {'success': False, 'error': 'Error al inicializar servicios'}
@@ -520,8 +781,28 @@ def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
     voiceUsageLog = []
     
     logger.info(f"--- Iniciando generación de {len(audioTextMapping)} audios para {targetLangName} ---")
+
+    # Traducir todas las frases de una vez (memoria de traducción + una petición para las que falten)
+    deeplCode = codes["deepl_code"]
+    filenames = list(audioTextMapping)
+    translations = timed(
+        'translate',
+        translator.translate_batch,
+        [audioTextMapping[f] for f in filenames],
+        deeplCode,
+        "es",
+        filenames
+    )
+    translatedByFile = dict(zip(filenames, translations))
     
+    cancelled = False
     for filename, spanishText in audioTextMapping.items():
+        if should_cancel and should_cancel():
+            cancelled = True
+            logger.info(f"--- Generación cancelada para {targetLangName} ---")
+            break
+        fileStart = time.perf_counter()
+        errorCount = len(errors)
         try:
             outputPath = os.path.join(outputDir, filename.replace('.mp3', '.wav'))
             
@@ -539,9 +820,7 @@ def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
                 logger.error(f"✗ Voz de referencia no encontrada: {voice_reference}")
                 continue
             
-            # Traducir texto
-            deeplCode = codes["deepl_code"]
-            translatedText = translator.translate(spanishText, deeplCode)
+            translatedText = translatedByFile.get(filename)
             
             if not translatedText:
                 errors.append(f"Error traduciendo {filename}")
@@ -550,7 +829,9 @@ def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
             
             # Generar audio
             coquiCode = codes["coqui_code"]
-            success = tts_synthesizer.synthesize(
+            success = timed(
+                'synthesize',
+                tts_synthesizer.synthesize,
                 translatedText,
                 coquiCode,
                 voice_reference,
@@ -572,6 +853,10 @@ def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
         except Exception as e:
             errors.append(f"Error en {filename}: {str(e)}")
             logger.error(f"✗ Excepción en {filename}: {e}")
+        finally:
+            if on_file:
+                on_file(filename, errors[-1] if len(errors) > errorCount else None,
+                        time.perf_counter() - fileStart)
     
     logger.info(f"--- Proceso finalizado. Generados: {len(generatedFiles)}, Errores: {len(errors)} ---")
     logger.info("--- Mapeo de voces utilizadas ---")
@@ -580,6 +865,7 @@ def generate_all_audios_for_language(targetLangName: str, logger=None) -> dict:
     
     return {
         'success': len(generatedFiles) > 0,
+        'cancelled': cancelled,
         'generated_files': generatedFiles,
         'errors': errors,
         'total_generated': len(generatedFiles),
@@ -0,0 +1,107 @@
+"""
+Benchmark de síntesis por frase: `speaker_wav` contra latentes cacheados.
+
+Sintetiza los textos de get_audio_text_mapping() (en español, sin traducir)
+con la voz de referencia de cada uno, primero pasando `speaker_wav` (XTTS
+recalcula el condicionamiento en cada frase) y después con los latentes de
+ConditioningCache. Reporta media/p50/p95 por frase de cada modo y el coste
+único de calcular los latentes.
+
+Uso:
+    python voice_bench.py --lang es --repeat 2 --output voice_bench.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from conditioning_cache import ConditioningCache, xtts_model, synthesize_with_latents
+from voice import (COQUI_TTS_MODEL_NAME, tts_registry, get_audio_text_mapping,
+                   get_voice_reference_for_audio)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+
+    def pct(p):
+        return samples[min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))]
+
+    return {
+        'count': len(samples),
+        'mean_s': sum(samples) / len(samples),
+        'p50_s': pct(50),
+        'p95_s': pct(95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempo de síntesis por frase con y sin latentes cacheados')
+    parser.add_argument('--lang', default='es', help='Código de idioma de Coqui (los textos no se traducen)')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default='voice_bench.json')
+    args = parser.parse_args()
+
+    phrases = list(get_audio_text_mapping().items())[:args.limit]
+    timings = {'speaker_wav': [], 'cached_latents': []}
+    latent_seconds = []
+
+    with tempfile.TemporaryDirectory() as tmp, tts_registry.acquire(COQUI_TTS_MODEL_NAME) as tts:
+        model = xtts_model(tts)
+        if model is None:
+            print(f"{COQUI_TTS_MODEL_NAME} no es un modelo XTTS")
+            return 2
+        # Caché vacía en un directorio temporal: el primer uso de cada referencia se mide aparte
+        cache = ConditioningCache(os.path.join(tmp, 'latents'))
+        output = os.path.join(tmp, 'out.wav')
+
+        for _ in range(args.repeat):
+            for filename, text in phrases:
+                reference = get_voice_reference_for_audio(filename)
+
+                start = time.perf_counter()
+                tts.tts_to_file(text=text, speaker_wav=reference, language=args.lang, file_path=output)
+                timings['speaker_wav'].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                latents = cache.get(model, COQUI_TTS_MODEL_NAME, reference)
+                fetched = time.perf_counter() - start
+                if cache.size() > len(latent_seconds):
+                    latent_seconds.append(fetched)
+                start = time.perf_counter()
+                synthesize_with_latents(tts, latents, text, args.lang, output)
+                timings['cached_latents'].append(time.perf_counter() - start)
+                print(f"\r  {len(timings['speaker_wav'])}/{len(phrases) * args.repeat}", end='', flush=True)
+    print()
+
+    results = {
+        'model': COQUI_TTS_MODEL_NAME,
+        'lang': args.lang,
+        'phrases': len(phrases),
+        'repeat': args.repeat,
+        'speaker_wav': summarize(timings['speaker_wav']),
+        'cached_latents': summarize(timings['cached_latents']),
+        'latent_compute': summarize(latent_seconds) if latent_seconds else None,
+    }
+
+    print(f"{'modo':<16} {'media (s)':>10} {'p50 (s)':>8} {'p95 (s)':>8}")
+    for mode in ('speaker_wav', 'cached_latents'):
+        s = results[mode]
+        print(f"{mode:<16} {s['mean_s']:10.2f} {s['p50_s']:8.2f} {s['p95_s']:8.2f}")
+    saving = results['speaker_wav']['mean_s'] - results['cached_latents']['mean_s']
+    print(f"\nAhorro por frase: {saving:.2f} s "
+          f"({saving / results['speaker_wav']['mean_s'] * 100:.0f}%)")
+    if latent_seconds:
+        print(f"Cálculo único de latentes: {results['latent_compute']['mean_s']:.2f} s por referencia "
+              f"({len(latent_seconds)} referencias)")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Resultados guardados en {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
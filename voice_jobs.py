@@ -0,0 +1,360 @@
+"""
+Trabajos asíncronos de generación de audios (/voice).
+
+POST /voice solo registra un trabajo en SQLite (VOICE_JOBS_DB) y responde con
+su id; un ejecutor de fondo lo reclama y ejecuta
+`generate_all_audios_for_language`, anotando el estado de cada archivo. Si ya
+hay un trabajo en cola o en curso para el mismo idioma se devuelve ese mismo.
+La cancelación se comprueba entre frases. Mientras un trabajo está en curso
+el ejecutor renueva su latido; un trabajo cuyo proceso ya no existe (o cuyo
+pid es ahora de otro proceso) o sin latido en VOICE_JOB_STALE_SECONDS se da
+por fallido.
+
+El ejecutor es VOICE_JOB_EXECUTOR:
+- 'thread': un hilo de fondo en cada worker de la app (sin uWSGI).
+- 'mule': un mule de uWSGI (`mule = voice_jobs.py` en uwsgi.ini), así la
+  síntesis y el modelo TTS quedan fuera de los workers de predicción.
+- 'external': cualquier otro proceso que ejecute este script.
+
+Uso (ejecutor independiente):
+    python voice_jobs.py
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from metrics import pid_alive, process_start_ticks
+
+
+# =====================================================================
+# CONFIGURACIÓN TRABAJOS DE VOZ
+# =====================================================================
+VOICE_JOBS_DB = os.environ.get('VOICE_JOBS_DB', 'voice_jobs.sqlite')
+VOICE_JOB_EXECUTOR = os.environ.get('VOICE_JOB_EXECUTOR', 'thread').lower()
+# Segundos entre consultas del ejecutor cuando no hay trabajos
+VOICE_JOB_POLL_INTERVAL = float(os.environ.get('VOICE_JOB_POLL_INTERVAL', 1.0))
+# Segundos que se conservan los trabajos terminados
+VOICE_JOB_RETENTION = float(os.environ.get('VOICE_JOB_RETENTION', 7 * 86400))
+# Segundos entre latidos de un trabajo en curso y sin latido para darlo por perdido
+VOICE_JOB_HEARTBEAT_INTERVAL = float(os.environ.get('VOICE_JOB_HEARTBEAT_INTERVAL', 30))
+VOICE_JOB_STALE_SECONDS = float(os.environ.get('VOICE_JOB_STALE_SECONDS', 300))
+# =====================================================================
+
+ACTIVE = ('queued', 'running')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    lang TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    worker_pid INTEGER,
+    worker_start INTEGER,
+    heartbeat_at REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_lang_status ON jobs (lang, status);
+CREATE TABLE IF NOT EXISTS job_files (
+    job_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    seconds REAL,
+    PRIMARY KEY (job_id, filename)
+);
+'''
+# Columnas añadidas después de crear la tabla en bases de datos existentes
+_MIGRATIONS = (('worker_start', 'INTEGER'), ('heartbeat_at', 'REAL'))
+
+
+def _claim_alive(pid, start):
+    """True si el proceso que reclamó el trabajo sigue vivo (y no es otro con el mismo pid)."""
+    if pid is None or not pid_alive(pid):
+        return False
+    current = process_start_ticks(pid)
+    return start is None or current is None or current == start
+
+
+def refresh_tts_gauges(collector):
+    """Gauges binit_tts_* del registro de modelos TTS de este proceso."""
+    from voice import tts_registry
+
+    for name, tts in tts_registry.stats()['models'].items():
+        collector.set_gauge('binit_tts_model_loaded', int(tts['loaded']), model=name)
+        collector.set_gauge('binit_tts_model_resident_seconds', tts['resident_seconds'] or 0, model=name)
+        if tts['load_seconds'] is not None:
+            collector.set_gauge('binit_tts_model_load_seconds', tts['load_seconds'], model=name)
+
+
+class VoiceJobStore:
+    def __init__(self, db_path=VOICE_JOBS_DB, retention=VOICE_JOB_RETENTION, stale_seconds=VOICE_JOB_STALE_SECONDS):
+        self.db_path = db_path
+        self.retention = retention
+        self.stale_seconds = stale_seconds
+        self._local = threading.local()
+
+    def _connection(self):
+        # Una conexión por hilo y proceso: las conexiones no sobreviven a un fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            for column, kind in _MIGRATIONS:
+                if column not in columns:
+                    try:
+                        conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {kind}')
+                    except sqlite3.OperationalError:
+                        # Otro proceso la añadió a la vez
+                        pass
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return result
+
+    def submit(self, lang):
+        """(id, True) del trabajo activo del idioma si existe; si no, (id nuevo, False)."""
+        def run(conn):
+            row = conn.execute(
+                f'SELECT id FROM jobs WHERE lang = ? AND status IN ({",".join("?" * len(ACTIVE))}) '
+                f'ORDER BY created_at LIMIT 1', (lang,) + ACTIVE).fetchone()
+            if row is not None:
+                return row[0], True
+            job_id = uuid.uuid4().hex
+            conn.execute('INSERT INTO jobs (id, lang, status, created_at) VALUES (?, ?, ?, ?)',
+                         (job_id, lang, 'queued', time.time()))
+            if self.retention > 0:
+                old = time.time() - self.retention
+                conn.execute('DELETE FROM job_files WHERE job_id IN '
+                             '(SELECT id FROM jobs WHERE finished_at < ?)', (old,))
+                conn.execute('DELETE FROM jobs WHERE finished_at < ?', (old,))
+            return job_id, False
+        return self._transaction(run)
+
+    def claim(self, filenames):
+        """Reclama el trabajo en cola más antiguo: (id, idioma) o None."""
+        def run(conn):
+            row = conn.execute("SELECT id, lang FROM jobs WHERE status = 'queued' "
+                               "ORDER BY created_at LIMIT 1").fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ?, worker_pid = ?, "
+                         "worker_start = ? WHERE id = ?", (now, now, os.getpid(), process_start_ticks(), row[0]))
+            conn.executemany("INSERT OR REPLACE INTO job_files (job_id, filename, status) VALUES (?, ?, 'pending')",
+                             [(row[0], name) for name in filenames])
+            return row
+        return self._transaction(run)
+
+    def recover(self):
+        """
+        Marca como fallidos los trabajos en curso cuyo proceso ya no existe o
+        que llevan más de `stale_seconds` sin latido.
+        """
+        def run(conn):
+            now = time.time()
+            rows = conn.execute("SELECT id, worker_pid, worker_start, COALESCE(heartbeat_at, started_at) "
+                                "FROM jobs WHERE status = 'running'").fetchall()
+            failed = []
+            for job_id, pid, start, heartbeat in rows:
+                if not _claim_alive(pid, start):
+                    failed.append((now, 'Ejecutor interrumpido', job_id))
+                elif self.stale_seconds > 0 and (heartbeat or 0) < now - self.stale_seconds:
+                    failed.append((now, 'Ejecutor sin latido', job_id))
+            conn.executemany("UPDATE jobs SET status = 'failed', finished_at = ?, error = ? "
+                             "WHERE id = ? AND status = 'running'", failed)
+            return len(failed)
+        return self._transaction(run)
+
+    def heartbeat(self, job_id):
+        self._connection().execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+                                   (time.time(), job_id))
+
+    def file_done(self, job_id, filename, error=None, seconds=None):
+        self._connection().execute(
+            'UPDATE job_files SET status = ?, error = ?, seconds = ? WHERE job_id = ? AND filename = ?',
+            ('error' if error else 'done', error, seconds, job_id, filename))
+        self.heartbeat(job_id)
+
+    def finish(self, job_id, status, result=None, error=None):
+        self._connection().execute(
+            'UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?',
+            (status, time.time(), json.dumps(result) if result is not None else None, error, job_id))
+
+    def cancel(self, job_id):
+        """Cancela un trabajo: en cola se cancela ya, en curso al terminar la frase actual."""
+        def run(conn):
+            row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == 'queued':
+                conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ?, cancel_requested = 1 "
+                             "WHERE id = ?", (time.time(), job_id))
+            elif row[0] == 'running':
+                conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+            return row[0]
+        status = self._transaction(run)
+        return None if status is None else self.get(job_id)
+
+    def cancel_requested(self, job_id):
+        row = self._connection().execute('SELECT cancel_requested FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get(self, job_id):
+        """Estado del trabajo con el progreso por archivo, o None si no existe."""
+        conn = self._connection()
+        row = conn.execute('SELECT id, lang, status, created_at, started_at, finished_at, '
+                           'cancel_requested, result, error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        files = [{'file': name, 'status': status, 'error': error, 'seconds': seconds}
+                 for name, status, error, seconds in conn.execute(
+                     'SELECT filename, status, error, seconds FROM job_files WHERE job_id = ? ORDER BY rowid',
+                     (job_id,))]
+        done = sum(1 for f in files if f['status'] == 'done')
+        failed = sum(1 for f in files if f['status'] == 'error')
+        return {
+            'job_id': row[0],
+            'lang': row[1],
+            'status': row[2],
+            'created_at': row[3],
+            'started_at': row[4],
+            'finished_at': row[5],
+            'cancel_requested': bool(row[6]),
+            'progress': {'done': done, 'errors': failed, 'total': len(files)},
+            'files': files,
+            'result': json.loads(row[7]) if row[7] else None,
+            'error': row[8],
+        }
+
+
+class VoiceJobRunner:
+    """
+    Ejecuta los trabajos de la cola de uno en uno. `on_stage(etapa, segundos)`
+    recibe la duración de cada etapa y `on_finish(estado)` el final de cada trabajo.
+    """
+    def __init__(self, store=None, poll_interval=VOICE_JOB_POLL_INTERVAL, on_stage=None, on_finish=None,
+                 heartbeat_interval=VOICE_JOB_HEARTBEAT_INTERVAL):
+        self.store = store or VoiceJobStore()
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.on_stage = on_stage
+        self.on_finish = on_finish
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._wakeup = threading.Event()
+
+    def ensure_started(self):
+        """Arranca el hilo ejecutor en este proceso (perezoso y recreado tras un fork)."""
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            self._wakeup.set()
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == pid and self._thread.is_alive():
+                return
+            self._pid = pid
+            self._wakeup = threading.Event()
+            self._thread = threading.Thread(target=self.run_forever, name='binit-voice-jobs', daemon=True)
+            self._thread.start()
+
+    def run_forever(self):
+        last_recover = None
+        while True:
+            # Al arrancar y después periódicamente: un trabajo perdido bloquearía su idioma
+            if last_recover is None or time.monotonic() - last_recover >= self.heartbeat_interval:
+                last_recover = time.monotonic()
+                try:
+                    self.store.recover()
+                except sqlite3.Error as e:
+                    print(f"⚠️ No se pudieron recuperar los trabajos de voz: {e}")
+            try:
+                ran = self.run_once()
+            except Exception as e:
+                print(f"⚠️ Error en el ejecutor de trabajos de voz: {e}")
+                ran = False
+            if not ran:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self):
+        """Ejecuta un trabajo si hay alguno en cola; devuelve True si ejecutó uno."""
+        from voice import generate_all_audios_for_language, get_audio_text_mapping
+
+        claimed = self.store.claim(list(get_audio_text_mapping()))
+        if claimed is None:
+            return False
+        job_id, lang = claimed
+        print(f"🔊 Trabajo de voz {job_id} ({lang}) iniciado")
+        # Una frase puede tardar minutos: el latido no depende de que termine
+        stop = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, stop), name='binit-voice-heartbeat',
+                         daemon=True).start()
+        try:
+            result = generate_all_audios_for_language(
+                lang,
+                on_stage=self.on_stage,
+                on_file=lambda filename, error, seconds: self.store.file_done(job_id, filename, error, seconds),
+                should_cancel=lambda: self.store.cancel_requested(job_id),
+            )
+        except Exception as e:
+            self.store.finish(job_id, 'failed', error=str(e))
+            status = 'failed'
+        else:
+            if result.get('cancelled'):
+                status = 'cancelled'
+            else:
+                status = 'done' if result['success'] else 'failed'
+            self.store.finish(job_id, status, result=result, error=result.get('error'))
+        finally:
+            stop.set()
+        print(f"🔊 Trabajo de voz {job_id} ({lang}): {status}")
+        if self.on_finish:
+            self.on_finish(status)
+        return True
+
+
+    def _heartbeat(self, job_id, stop):
+        while not stop.wait(self.heartbeat_interval):
+            try:
+                self.store.heartbeat(job_id)
+            except sqlite3.Error as e:
+                print(f"⚠️ No se pudo renovar el latido del trabajo de voz {job_id}: {e}")
+
+
+if __name__ == '__main__':
+    # También es el punto de entrada del mule de uWSGI (`mule = voice_jobs.py`)
+    import logging
+    from metrics import metrics
+
+    logging.basicConfig(level=logging.INFO)
+    # El modelo TTS vive en este proceso: sus gauges llegan a /metrics y /health
+    # por el archivo de métricas del mule, aunque no ejecute ningún trabajo
+    metrics.register_gauge_callback(refresh_tts_gauges)
+    metrics.start()
+    print(f"🔊 Ejecutor de trabajos de voz (pid {os.getpid()}, {VOICE_JOBS_DB})")
+    VoiceJobRunner(
+        on_stage=lambda stage, seconds: metrics.observe(
+            'binit_stage_duration_seconds', seconds, endpoint='voice_job', stage=stage),
+        on_finish=lambda status: metrics.inc('binit_voice_jobs_total', status=status),
+    ).run_forever()
@@ -0,0 +1,215 @@
+"""
+Generación en paralelo de los audios de varios idiomas.
+
+Cada (idioma, frase) es una unidad de trabajo independiente. Las
+traducciones se resuelven antes en el proceso principal (memoria de
+traducción + una petición por idioma) y la síntesis se reparte en un
+ProcessPoolExecutor: cada proceso carga su propio modelo TTS una sola vez
+(registro de voice.py) con TTS_TORCH_THREADS hilos de torch, de modo que
+TTS_PROCESSES x TTS_TORCH_THREADS no supere los núcleos de la máquina. Cada
+audio se escribe en un temporal del mismo directorio y se renombra al
+terminar, así que un audio a medio generar nunca se sirve.
+
+Cada proceso ocupa la RAM de un modelo xtts_v2 (~2 GB).
+
+Uso:
+    python voice_parallel.py --langs all --processes 4 --torch-threads 4
+    python voice_parallel.py --langs Inglés Francés --force --output synth_report.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from voice import (COQUI_TTS_MODEL_NAME, OUTPATH_FILE_START, create_translator, get_audio_text_mapping,
+                   get_supported_languages_map, get_voice_reference_for_audio)
+
+
+# =====================================================================
+# CONFIGURACIÓN SÍNTESIS EN PARALELO
+# =====================================================================
+TTS_TORCH_THREADS = int(os.environ.get('TTS_TORCH_THREADS', 4))
+TTS_PROCESSES = int(os.environ.get('TTS_PROCESSES', 0)) or max(1, (os.cpu_count() or 1) // TTS_TORCH_THREADS)
+# =====================================================================
+
+
+def _init_worker(torch_threads, modelName):
+    """Limita los hilos de torch y carga el modelo TTS de este proceso."""
+    # Antes de importar torch: OpenMP/MKL leen estas variables al cargarse
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS'):
+        os.environ[var] = str(torch_threads)
+    import torch
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(1)
+
+    from voice import tts_registry
+    tts_registry.idle_timeout = 0
+    tts_registry.preload(modelName)
+
+
+def _synthesize_item(item, modelName):
+    """Sintetiza una frase en un temporal y lo renombra a su ruta final."""
+    from voice import CoquiTextToSpeechService, tts_registry
+
+    outputDir = os.path.dirname(item['output'])
+    fd, tmpPath = tempfile.mkstemp(dir=outputDir, prefix='.', suffix='.tmp.wav')
+    os.close(fd)
+    start = time.perf_counter()
+    try:
+        ok = CoquiTextToSpeechService(modelName).synthesize(
+            item['text'], item['coqui_code'], item['reference'], tmpPath)
+        seconds = time.perf_counter() - start
+        if ok:
+            # mkstemp crea el archivo con permisos 0600: el audio se sirve como estático
+            os.chmod(tmpPath, 0o644)
+            os.replace(tmpPath, item['output'])
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+    model = tts_registry.stats()['models'].get(modelName, {})
+    return {
+        'lang': item['lang'],
+        'file': item['file'],
+        'ok': ok,
+        'seconds': seconds,
+        'pid': os.getpid(),
+        'load_seconds': model.get('load_seconds'),
+    }
+
+
+def plan(langNames, force=False):
+    """
+    Unidades de trabajo (idioma, frase) con el texto ya traducido. Las
+    frases con audio ya generado se omiten salvo con `force`.
+    """
+    langMap = get_supported_languages_map()
+    audioTextMapping = get_audio_text_mapping()
+    translator = create_translator()
+    items, errors = [], []
+    for langName in langNames:
+        codes = langMap[langName]
+        outputDir = f"{OUTPATH_FILE_START}{codes['country_code'].lower()}"
+        os.makedirs(outputDir, exist_ok=True)
+        pending = [f for f in audioTextMapping
+                   if force or not os.path.exists(os.path.join(outputDir, f))]
+        if not pending:
+            continue
+        translations = translator.translate_batch(
+            [audioTextMapping[f] for f in pending], codes['deepl_code'], "es", pending)
+        for filename, text in zip(pending, translations):
+            if not text:
+                errors.append({'lang': langName, 'file': filename, 'error': 'Error traduciendo'})
+                continue
+            items.append({
+                'lang': langName,
+                'file': filename,
+                'text': text,
+                'coqui_code': codes['coqui_code'],
+                'reference': get_voice_reference_for_audio(filename),
+                'output': os.path.join(outputDir, filename),
+            })
+    # Las frases largas primero: reparten mejor la carga al final de la cola
+    items.sort(key=lambda item: len(item['text']), reverse=True)
+    return items, errors
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else None
+
+
+def synthesize_parallel(items, processes=TTS_PROCESSES, torch_threads=TTS_TORCH_THREADS,
+                        modelName=COQUI_TTS_MODEL_NAME, on_item=None):
+    """Sintetiza las unidades de trabajo en un pool de procesos; devuelve el reporte."""
+    results = []
+    start = time.perf_counter()
+    if items:
+        # spawn: torch no es seguro tras un fork con sus hilos ya creados
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(processes, len(items)), mp_context=context,
+                                 initializer=_init_worker, initargs=(torch_threads, modelName)) as executor:
+            futures = {executor.submit(_synthesize_item, item, modelName): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {'lang': item['lang'], 'file': item['file'], 'ok': False,
+                              'seconds': None, 'error': str(e)}
+                results.append(result)
+                if on_item:
+                    on_item(result, len(results), len(items))
+    wall = time.perf_counter() - start
+
+    latencies = [r['seconds'] for r in results if r['ok']]
+    loads = {r['pid']: r['load_seconds'] for r in results if r.get('pid') and r.get('load_seconds')}
+    done = sum(1 for r in results if r['ok'])
+    return {
+        'processes': min(processes, len(items)) if items else 0,
+        'torch_threads': torch_threads,
+        'items': len(items),
+        'generated': done,
+        'failed': len(results) - done,
+        'wall_seconds': wall,
+        'throughput_per_min': done / wall * 60 if wall > 0 else None,
+        'item_seconds': {
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': _percentile(latencies, 50),
+            'p95': _percentile(latencies, 95),
+            'max': max(latencies) if latencies else None,
+        },
+        'model_load_seconds': list(loads.values()),
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera los audios de varios idiomas en paralelo')
+    parser.add_argument('--langs', nargs='+', default=['all'],
+                        help="Nombres de idioma de get_supported_languages_map() o 'all'")
+    parser.add_argument('--processes', type=int, default=TTS_PROCESSES)
+    parser.add_argument('--torch-threads', type=int, default=TTS_TORCH_THREADS)
+    parser.add_argument('--force', action='store_true', help='Regenera también los audios existentes')
+    parser.add_argument('--output', default='synth_report.json')
+    args = parser.parse_args()
+
+    langMap = get_supported_languages_map()
+    langNames = list(langMap) if args.langs == ['all'] else args.langs
+    unknown = [lang for lang in langNames if lang not in langMap]
+    if unknown:
+        print(f"Idiomas no soportados: {', '.join(unknown)}")
+        return 2
+
+    cores = os.cpu_count() or 1
+    if args.processes * args.torch_threads > cores:
+        print(f"⚠️ {args.processes} procesos x {args.torch_threads} hilos > {cores} núcleos")
+
+    items, errors = plan(langNames, force=args.force)
+    print(f"🔊 {len(items)} audios de {len(langNames)} idiomas con {args.processes} procesos "
+          f"x {args.torch_threads} hilos de torch")
+
+    def progress(result, done, total):
+        status = f"{result['seconds']:.1f} s" if result['ok'] else f"✗ {result.get('error', 'error')}"
+        print(f"  [{done}/{total}] {result['lang']} {result['file']}: {status}")
+
+    report = synthesize_parallel(items, args.processes, args.torch_threads, on_item=progress)
+    report['translation_errors'] = errors
+
+    s = report['item_seconds']
+    print(f"\n✅ {report['generated']} generados, {report['failed'] + len(errors)} errores "
+          f"en {report['wall_seconds']:.0f} s ({report['throughput_per_min'] or 0:.1f} audios/min)")
+    if s['mean'] is not None:
+        print(f"Por audio: media {s['mean']:.1f} s, p50 {s['p50']:.1f} s, p95 {s['p95']:.1f} s")
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Reporte guardado en {args.output}")
+    return 0 if not report['failed'] and not errors else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())